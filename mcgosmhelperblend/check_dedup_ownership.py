@@ -0,0 +1,161 @@
+# MIT License
+
+# Copyright (c) 2023 MCG - Artan Salihu
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Check of the building ownership of the --dedup export (export_sub_area_dedup) without Blender, for buildings
+crossing the edges of the sub-areas. The synthetic buildings are boxes in the scene coordinates of blosm,
+with rows of touching (terraced) buildings. Like the OSM API, the import of a sub-area contains every building
+with a corner in the sub-area, with its whole footprint. The check assigns the buildings of each import to the
+grid cells of the sub-area as export_sub_area_dedup does (one part per OSM building, footprint center) and
+verifies that every building is owned by exactly one grid cell of the whole area. For comparison, it also
+counts the buildings owned twice or never with the connected parts of a single buildings object, e.g.
+    python check_dedup_ownership.py --k 3 --grid_size 2 --buildings 300
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from mcgmeshutils import blosm_to_lonlat, connected_components, footprint_centers, in_bounds, merge_meshes, weld_vertices
+from mcgosmhelperblend_parallel import grid_cell_bboxes
+
+# Triangles of a box with the corners numbered as in box_mesh
+BOX_TRIANGLES = np.array([[0, 2, 1], [0, 3, 2], [4, 5, 6], [4, 6, 7], [0, 1, 5], [0, 5, 4],
+                          [1, 2, 6], [1, 6, 5], [2, 3, 7], [2, 7, 6], [3, 0, 4], [3, 4, 7]])
+
+
+def box_mesh(x0, y0, x1, y1, height):
+    """
+    Returns the (vertices, triangles) of a box building with the footprint (x0, y0, x1, y1) in meters.
+    """
+    vertices = np.array([[x, y, z] for z in (0., height) for x, y in ((x0, y0), (x1, y0), (x1, y1), (x0, y1))])
+    return vertices, BOX_TRIANGLES
+
+
+def synthetic_buildings(size, n_buildings, seed=0):
+    """
+    Returns the footprints (x0, y0, x1, y1) and heights of n_buildings boxes in a size x size m area centered
+    on the origin of blosm, in rows of one to four touching buildings, at least 20 m from the edges of the area.
+    """
+    rng = np.random.default_rng(seed)
+    footprints, heights = [], []
+    while len(footprints) < n_buildings:
+        x, y = rng.uniform(-size / 2 + 20, size / 2 - 100, 2)
+        depth = rng.uniform(8, 20)
+        for _ in range(rng.integers(1, 5)):
+            width = rng.uniform(6, 20)
+            footprints.append((x, y, x + width, y + depth))
+            heights.append(rng.uniform(5, 30))
+            x += width
+    return footprints[:n_buildings], heights[:n_buildings]
+
+
+def assign_buildings(imported, meshes, cells, lon0, lat0, per_building=True):
+    """
+    Assigns the imported buildings of a sub-area to its grid cells as export_sub_area_dedup does.
+
+    Args:
+        imported: The numbers of the buildings in the import.
+        meshes: The (vertices, triangles) of all the buildings.
+        cells: The (min_lon, min_lat, max_lon, max_lat) of the grid cells of the sub-area.
+        lon0, lat0: The origin of the projection of blosm.
+        per_building: True for one object per OSM building, False for a single object split into connected parts.
+
+    Returns:
+        A list with the numbers of the buildings owned by each grid cell.
+    """
+    vertices, triangles = merge_meshes([meshes[b] for b in imported])
+    triangle_building = np.repeat(np.asarray(imported, dtype=np.int64), [len(meshes[b][1]) for b in imported])
+    if per_building:
+        labels = np.repeat(np.arange(len(imported)), [len(meshes[b][1]) for b in imported])
+        centers = footprint_centers(vertices, triangles, labels, len(imported))
+    else:
+        vertices, triangles = weld_vertices(vertices, triangles)
+        labels = connected_components(len(vertices), triangles)
+        # Mean of the triangle centroids of each connected part
+        centroids = vertices[triangles].mean(axis=1)
+        counts = np.bincount(labels)
+        centers = np.column_stack([np.bincount(labels, weights=centroids[:, axis]) / counts for axis in (0, 1)])
+    lon, lat = blosm_to_lonlat(centers[:, 0], centers[:, 1], lon0, lat0)
+    owned = []
+    for cell in cells:
+        parts = np.flatnonzero(in_bounds(lon, lat, cell))
+        owned.append(sorted(set(triangle_building[np.isin(labels, parts)].tolist())))
+    return owned
+
+
+def check_dedup_ownership(k=2, grid_size=2, n_buildings=200, size=600., seed=0):
+    """
+    Imports the synthetic buildings sub-area by sub-area and counts the owners of every building.
+
+    Returns:
+        A list of the failed checks (empty if every building is owned by exactly one grid cell).
+    """
+    lon0, lat0 = 16.38, 48.21
+    footprints, heights = synthetic_buildings(size, n_buildings, seed)
+    meshes = [box_mesh(*footprint, height) for footprint, height in zip(footprints, heights)]
+    corners_lon, corners_lat = blosm_to_lonlat([-size / 2, size / 2], [-size / 2, size / 2], lon0, lat0)
+    bboxes = grid_cell_bboxes(corners_lon[0], corners_lat[0], corners_lon[1], corners_lat[1], k, grid_size)
+    footprint_lon, footprint_lat = blosm_to_lonlat(np.array(footprints)[:, [0, 2, 2, 0]], np.array(footprints)[:, [1, 1, 3, 3]], lon0, lat0)
+
+    failures = []
+    for per_building in (True, False):
+        owners = np.zeros(n_buildings, dtype=np.int64)
+        crossing = np.zeros(n_buildings, dtype=bool)
+        for a in range(k * k):
+            cells = [bbox for name, bbox in bboxes.items() if name.split('_')[0] == str(a)]
+            sub_area = (min(c[0] for c in cells), min(c[1] for c in cells), max(c[2] for c in cells), max(c[3] for c in cells))
+            # The OSM API returns the buildings with a corner in the sub-area, with all their corners
+            inside = (footprint_lon >= sub_area[0]) & (footprint_lon <= sub_area[2]) & (footprint_lat >= sub_area[1]) & (footprint_lat <= sub_area[3])
+            crossing |= inside.any(axis=1) & ~inside.all(axis=1)
+            imported = np.flatnonzero(inside.any(axis=1)).tolist()
+            for owned in assign_buildings(imported, meshes, cells, lon0, lat0, per_building):
+                owners[owned] += 1
+        twice, never = int((owners > 1).sum()), int((owners == 0).sum())
+        name = 'one part per OSM building, footprint center' if per_building else 'connected parts of a single object, centroid'
+        print(f'{name}: {int(crossing.sum())} of {n_buildings} buildings cross a sub-area edge, {twice} owned twice or more, {never} never owned')
+        if per_building and (twice or never):
+            failures.append(f'{twice} buildings owned by several grid cells, {never} by none')
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Check that the --dedup export assigns every building to exactly one grid cell')
+    parser.add_argument('--k', type=int, default=2, help='Number of sub-areas (k x k)')
+    parser.add_argument('--grid_size', type=int, default=2, help='Number of grid cells per sub-area (grid_size x grid_size)')
+    parser.add_argument('--buildings', type=int, default=200, help='Number of synthetic buildings')
+    parser.add_argument('--size', type=float, default=600., help='Size of the area in meters')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic buildings')
+    parser.add_argument('--help_options', action='store_true', help='Print options')
+    args = parser.parse_args()
+    if args.help_options:
+        parser.print_help()
+        sys.exit()
+
+    failures = check_dedup_ownership(args.k, args.grid_size, args.buildings, args.size, args.seed)
+    if failures:
+        print('Failed: ' + '; '.join(failures))
+        sys.exit(1)
+    print('Every building is owned by exactly one grid cell')
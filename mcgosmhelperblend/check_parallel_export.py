@@ -0,0 +1,160 @@
+# MIT License
+
+# Copyright (c) 2023 MCG - Artan Salihu
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Check of mcgosmhelperblend_parallel.py without Blender: the workers run stub_export_worker.py through a
+stand-in "blender" launcher that runs the --python script with this Python. The check
+    1. marks every grid cell as done, as left by an earlier complete run,
+    2. reruns the export where one worker crashes at --crash_cell and checks that every grid cell was
+       exported by at most one worker, that the crashed grid cell and the rest of the subset of its worker
+       are reported as not done (the records of the earlier run are not taken as done) and the others are done,
+    3. resumes and checks that exactly the grid cells not done are exported again and that all are done now,
+    4. resumes with other coordinates of the area and checks that all grid cells are exported again, e.g.
+    python check_parallel_export.py --k 2 --grid_size 3 --workers 4
+"""
+
+import argparse
+import os
+import stat
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from mcgosmhelperblend_parallel import grid_cell_names, read_manifest, run_parallel_export, write_cell_manifest
+
+STUB_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub_export_worker.py')
+
+
+def write_stand_in_blender(folder):
+    """
+    Writes an executable that takes the command line of Blender (--background [blend file] --python script -- options)
+    and runs the script with this Python.
+
+    Returns:
+        The path of the executable.
+    """
+    launcher = os.path.join(folder, 'stand_in_blender.py')
+    with open(launcher, 'w') as fp:
+        fp.write(f'#!{sys.executable}\n'
+                 'import subprocess, sys\n'
+                 'argv = sys.argv[1:]\n'
+                 'script = argv[argv.index("--python") + 1]\n'
+                 'sys.exit(subprocess.call([sys.executable, script] + argv[argv.index("--"):]))\n')
+    if os.name == 'nt':
+        executable = os.path.join(folder, 'stand_in_blender.bat')
+        with open(executable, 'w') as fp:
+            fp.write(f'@"{sys.executable}" "{launcher}" %*\n')
+        return executable
+    os.chmod(launcher, os.stat(launcher).st_mode | stat.S_IXUSR)
+    return launcher
+
+
+def read_exports(area_dir):
+    """
+    Reads the (grid cell, worker id) pairs written by the stub workers and empties the log.
+    """
+    log_file = os.path.join(area_dir, 'exports.log')
+    if not os.path.exists(log_file):
+        return []
+    with open(log_file, 'r') as fp:
+        exports = [tuple(line.split()[:2]) for line in fp if line.strip()]
+    os.remove(log_file)
+    return exports
+
+
+def check_parallel_export(k=2, grid_size=2, workers=3, crash_cell=None):
+    """
+    Runs the export with a crashing worker, then resumes it.
+
+    Returns:
+        A list of the failed checks (empty if the partition and the resume are correct).
+    """
+    failures = []
+    cells = grid_cell_names(k, grid_size)
+    crash_cell = crash_cell or cells[len(cells) // 2]
+    with tempfile.TemporaryDirectory() as folder:
+        args = argparse.Namespace(area_name='Check', x_min=16.36, x_max=16.40, y_min=48.20, y_max=48.22, k=k, grid_size=grid_size,
+                                  d_file_path=folder, scene_name='Scene', workers=workers, blender=write_stand_in_blender(folder),
+                                  blend_file=None, script=STUB_SCRIPT, resume=False)
+        area_dir = os.path.join(folder, args.area_name)
+        manifest_dir = os.path.join(area_dir, 'manifest')
+        os.makedirs(manifest_dir)
+        # 1. Records of an earlier complete run
+        for cell in cells:
+            write_cell_manifest(manifest_dir, cell, {'status': 'done', 'worker': 0})
+
+        # 2. Rerun with a crash
+        not_done = run_parallel_export(args, ['--crash_cell', crash_cell])
+        exports = read_exports(area_dir)
+        exported = [cell for cell, _ in exports]
+        workers_of_cell = {}
+        for cell, worker_id in exports:
+            workers_of_cell.setdefault(cell, set()).add(worker_id)
+        if len(exported) != len(set(exported)) or any(len(ids) > 1 for ids in workers_of_cell.values()):
+            failures.append(f'grid cells exported more than once: {sorted(cell for cell in set(exported) if exported.count(cell) > 1)}')
+        crash_worker = workers_of_cell.get(crash_cell, {None}).pop()
+        subset = cells[int(crash_worker)::workers] if crash_worker is not None else []
+        expected = subset[subset.index(crash_cell):] if crash_cell in subset else []
+        print(f'Crash at {crash_cell} (worker {crash_worker}): {len(exported)} grid cells exported, not done: {not_done}')
+        if not expected or sorted(not_done) != sorted(expected):
+            failures.append(f'not done after the crash {sorted(not_done)}, expected {sorted(expected)}')
+        manifest = read_manifest(manifest_dir)
+        if manifest.get(crash_cell, {}).get('status') != 'running':
+            failures.append(f'the crashed grid cell is {manifest.get(crash_cell)}, expected running')
+
+        # 3. Resume
+        args.resume = True
+        not_done_resumed = run_parallel_export(args)
+        resumed = [cell for cell, _ in read_exports(area_dir)]
+        print(f'Resume: {len(resumed)} grid cells exported, not done: {not_done_resumed}')
+        if sorted(resumed) != sorted(not_done):
+            failures.append(f'the resume exported {sorted(resumed)}, expected {sorted(not_done)}')
+        if not_done_resumed or any(record.get('status') != 'done' for record in read_manifest(manifest_dir).values()):
+            failures.append(f'grid cells not done after the resume: {not_done_resumed}')
+
+        # 4. Resume with other coordinates, the records of the old grid cells are not done
+        args.x_max += 0.01
+        run_parallel_export(args)
+        moved = [cell for cell, _ in read_exports(area_dir)]
+        print(f'Resume with x_max={args.x_max}: {len(moved)} grid cells exported')
+        if sorted(moved) != sorted(cells):
+            failures.append(f'the resume with other coordinates exported {len(moved)} of {len(cells)} grid cells')
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Check the partition and the resume of mcgosmhelperblend_parallel.py with a stub worker')
+    parser.add_argument('--k', type=int, default=2, help='Number of sub-areas (k x k)')
+    parser.add_argument('--grid_size', type=int, default=2, help='Number of grid cells per sub-area (grid_size x grid_size)')
+    parser.add_argument('--workers', type=int, default=3, help='Number of workers')
+    parser.add_argument('--crash_cell', type=str, default=None, help='Grid cell where a worker crashes (default: the middle one)')
+    parser.add_argument('--help_options', action='store_true', help='Print options')
+    args = parser.parse_args()
+    if args.help_options:
+        parser.print_help()
+        sys.exit()
+
+    failures = check_parallel_export(args.k, args.grid_size, args.workers, args.crash_cell)
+    if failures:
+        print('Failed: ' + '; '.join(failures))
+        sys.exit(1)
+    print('Partition and resume are correct')
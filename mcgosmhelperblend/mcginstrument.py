@@ -0,0 +1,212 @@
+# MIT License
+
+# Copyright (c) 2023 MCG - Artan Salihu
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+mcg instrumentation, copy of mcgosmhelpernxx/mcginstrument.py (kept identical below the docstring, see
+mcgosmhelpernxx/check_instrument_copies.py).
+
+Lightweight per-stage metrics written as JSON lines, one record per line:
+    with stage('download', cell='0_1'):
+        ...
+    count('osm_bytes', len(chunk))
+    event('cell', status='done')
+Each record has the event type, the name, the run id, the process id and a timestamp. A stage record also has the
+wall time (seconds), the CPU time (cpu_seconds), the error if the stage raised and, with tracemalloc enabled, the peak
+of the traced memory during the stage (peak_mb). Nested stages get the name of the enclosing stage as prefix
+(e.g. cell/download). close() writes a summary record with the totals per stage and the counters.
+
+Nothing is recorded until configure() is called or the MCG_METRICS environment variable is set to the path of the
+JSON lines file (MCG_PROFILE=1 and MCG_TRACE_MEMORY=1 enable cProfile and tracemalloc), so the metrics also work in
+worker processes. With cProfile, the profile is saved next to the metrics file as <metrics file>.<pid>.prof.
+"""
+
+import atexit
+import collections
+import contextlib
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+
+
+_recorder = None
+
+
+class MetricsRecorder:
+    """
+    Writes the metrics of one process to a JSON lines file (appending, so several processes can share the file).
+    """
+    def __init__(self, path, run=None, profile=False, trace_memory=False):
+        self.path = path
+        self.run = run or os.environ.get('MCG_METRICS_RUN') or time.strftime('%Y%m%d-%H%M%S')
+        # Worker processes inherit the run id
+        os.environ['MCG_METRICS_RUN'] = self.run
+        self.file = open(path, 'a', buffering=1)
+        self.counters = collections.Counter()
+        self.totals = collections.defaultdict(lambda: [0, 0.])
+        self.stack = []
+        # Running peak of the traced memory of each open stage (the peak of a nested stage is folded into its parent)
+        self.peaks = []
+        self.profiler = None
+        if profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def emit(self, event, name, **fields):
+        record = {'event': event, 'name': name, 'run': self.run, 'pid': os.getpid(), 'time': round(time.time(), 3)}
+        record.update(fields)
+        # One write per line, so lines of different processes do not interleave
+        self.file.write(json.dumps(record, default=str) + '\n')
+
+    @contextlib.contextmanager
+    def stage(self, name, **fields):
+        full_name = '/'.join(self.stack + [name])
+        self.stack.append(name)
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            # The peak of the parent so far is kept before the peak is reset for this stage
+            if self.peaks:
+                self.peaks[-1] = max(self.peaks[-1], tracemalloc.get_traced_memory()[1])
+            self.peaks.append(0)
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+        start_time = time.perf_counter()
+        start_cpu = time.process_time()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            seconds = time.perf_counter() - start_time
+            self.stack.pop()
+            if error is not None:
+                fields['error'] = error
+            if tracing:
+                peak = max(self.peaks.pop(), tracemalloc.get_traced_memory()[1])
+                if self.peaks:
+                    self.peaks[-1] = max(self.peaks[-1], peak)
+                fields['peak_mb'] = round(peak / 2**20, 3)
+            totals = self.totals[full_name]
+            totals[0] += 1
+            totals[1] += seconds
+            self.emit('stage', full_name, seconds=round(seconds, 6), cpu_seconds=round(time.process_time() - start_cpu, 6), **fields)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def close(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+            profile_file = f'{self.path}.{os.getpid()}.prof'
+            self.profiler.dump_stats(profile_file)
+            self.emit('profile', 'cprofile', file=profile_file)
+            self.profiler = None
+        self.emit('summary', 'totals', stages={name: {'count': n, 'seconds': round(seconds, 6)} for name, (n, seconds) in self.totals.items()},
+                  counters=dict(self.counters))
+        self.file.close()
+
+
+def configure(path=None, run=None, profile=False, trace_memory=False):
+    """
+    Starts recording the metrics of this process to the JSON lines file at path (closing a previous recorder).
+    Without a path, the MCG_METRICS environment variable is used; if neither is given, nothing is recorded.
+    The path is also stored in MCG_METRICS, so worker processes started later record to the same file.
+
+    Args:
+        path (str): The JSON lines file (default: None)
+        run (str): The id of the run written to each record (default: the start time)
+        profile (bool): Whether to profile the process with cProfile (default: False)
+        trace_memory (bool): Whether to record the peak memory of each stage with tracemalloc (default: False)
+
+    Returns:
+        The MetricsRecorder, or None if nothing is recorded.
+    """
+    global _recorder
+    if _recorder is not None:
+        _recorder.close()
+        _recorder = None
+    path = path or os.environ.get('MCG_METRICS')
+    if not path:
+        return None
+    os.environ['MCG_METRICS'] = path
+    if profile:
+        os.environ['MCG_PROFILE'] = '1'
+    if trace_memory:
+        os.environ['MCG_TRACE_MEMORY'] = '1'
+    _recorder = MetricsRecorder(path, run=run, profile=profile, trace_memory=trace_memory)
+    return _recorder
+
+
+def _get_recorder():
+    # Configure from the environment on first use, e.g. in worker processes
+    global _recorder
+    if _recorder is None and os.environ.get('MCG_METRICS'):
+        configure(profile=os.environ.get('MCG_PROFILE') == '1', trace_memory=os.environ.get('MCG_TRACE_MEMORY') == '1')
+    return _recorder
+
+
+def stage(name, **fields):
+    """
+    Returns a context manager recording the time of a stage, with the fields added to the record.
+    Does nothing if no recorder is configured.
+    """
+    recorder = _get_recorder()
+    if recorder is None:
+        return contextlib.nullcontext()
+    return recorder.stage(name, **fields)
+
+
+def count(name, n=1):
+    """
+    Adds n to a counter, the counters are written in the summary record.
+    """
+    recorder = _get_recorder()
+    if recorder is not None:
+        recorder.count(name, n)
+
+
+def event(name, **fields):
+    """
+    Writes a record with the fields, e.g. the status of a grid cell.
+    """
+    recorder = _get_recorder()
+    if recorder is not None:
+        recorder.emit('event', name, **fields)
+
+
+def close():
+    """
+    Writes the summary record (and the profile) and closes the metrics file.
+    """
+    global _recorder
+    if _recorder is not None:
+        _recorder.close()
+        _recorder = None
+
+
+# Write the summary of a process that does not call close()
+atexit.register(close)
@@ -0,0 +1,237 @@
+# MIT License
+
+# Copyright (c) 2023 MCG - Artan Salihu
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Mesh utilities on NumPy arrays for mcgosmhelperblend.py.
+They do not need Blender (bpy), so they can also be used and tested outside Blender.
+A mesh is given as vertices, an array of shape (N, 3), and triangles, an integer array of shape (M, 3)
+with the indices of the vertices of each triangle.
+"""
+
+import numpy as np
+
+
+# Record of a triangle in a binary STL file (50 bytes)
+STL_DTYPE = np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attribute', '<u2')])
+
+
+def triangle_normals(vertices, triangles):
+    """
+    Computes the unit normals of the triangles (right-hand rule). Degenerate triangles get a zero normal.
+
+    Args:
+        vertices: An array of shape (N, 3) with the coordinates of the vertices.
+        triangles: An array of shape (M, 3) with the vertex indices of the triangles.
+
+    Returns:
+        An array of shape (M, 3) with the normals.
+    """
+    corners = vertices[triangles]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    return np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+
+
+def merge_meshes(meshes):
+    """
+    Merges several meshes into a single mesh.
+
+    Args:
+        meshes: A list of (vertices, triangles) tuples.
+
+    Returns:
+        A (vertices, triangles) tuple of the merged mesh.
+    """
+    if not meshes:
+        return np.empty((0, 3), dtype=np.float32), np.empty((0, 3), dtype=np.int64)
+    offsets = np.cumsum([0] + [len(vertices) for vertices, _ in meshes[:-1]])
+    vertices = np.concatenate([vertices for vertices, _ in meshes])
+    triangles = np.concatenate([triangles + offset for (_, triangles), offset in zip(meshes, offsets)])
+    return vertices, triangles
+
+
+def write_binary_stl(filename, vertices, triangles, header=b'MCG binary STL'):
+    """
+    Writes a mesh to a binary STL file in one vectorized pass.
+
+    Args:
+        filename: The name of the STL file.
+        vertices: An array of shape (N, 3) with the coordinates of the vertices.
+        triangles: An array of shape (M, 3) with the vertex indices of the triangles.
+        header: The header of the file, at most 80 bytes.
+
+    Returns:
+        The number of triangles written.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+    records = np.zeros(len(triangles), dtype=STL_DTYPE)
+    records['normal'] = triangle_normals(vertices, triangles)
+    records['vertices'] = vertices[triangles]
+    with open(filename, 'wb') as f:
+        f.write(header[:80].ljust(80, b'\0'))
+        f.write(np.uint32(len(records)).tobytes())
+        records.tofile(f)
+    return len(records)
+
+
+def read_binary_stl(filename):
+    """
+    Reads a binary STL file.
+
+    Args:
+        filename: The name of the STL file.
+
+    Returns:
+        A (normals, corners) tuple with arrays of shape (M, 3) and (M, 3, 3).
+    """
+    with open(filename, 'rb') as f:
+        f.seek(80)
+        count = int(np.frombuffer(f.read(4), dtype='<u4')[0])
+        records = np.fromfile(f, dtype=STL_DTYPE, count=count)
+    return records['normal'], records['vertices']
+
+
+# Radius of the sphere of the transverse Mercator projection used by blosm
+EARTH_RADIUS = 6378137.
+
+
+def blosm_to_lonlat(x, y, lon0, lat0):
+    """
+    Converts scene coordinates of objects imported by blosm back to longitude and latitude.
+    blosm uses a spherical transverse Mercator projection centered at (lon0, lat0), which is stored
+    in the scene as scene["lon"] and scene["lat"].
+
+    Args:
+        x: The x-coordinates in meters.
+        y: The y-coordinates in meters.
+        lon0: The longitude of the projection center in degrees.
+        lat0: The latitude of the projection center in degrees.
+
+    Returns:
+        A (lon, lat) tuple of arrays in degrees.
+    """
+    x = np.asarray(x, dtype=np.float64) / EARTH_RADIUS
+    d = np.asarray(y, dtype=np.float64) / EARTH_RADIUS + np.radians(lat0)
+    lon = lon0 + np.degrees(np.arctan2(np.sinh(x), np.cos(d)))
+    lat = np.degrees(np.arcsin(np.sin(d) / np.cosh(x)))
+    return lon, lat
+
+
+def weld_vertices(vertices, triangles, tolerance=1e-4):
+    """
+    Merges the vertices that are closer than the tolerance (on a grid), so that faces which do not share
+    vertex indices but touch each other become connected.
+
+    Args:
+        vertices: An array of shape (N, 3) with the coordinates of the vertices.
+        triangles: An array of shape (M, 3) with the vertex indices of the triangles.
+        tolerance: The size of the grid in the units of the vertices.
+
+    Returns:
+        A (vertices, triangles) tuple of the welded mesh.
+    """
+    keys = np.round(np.asarray(vertices) / tolerance).astype(np.int64)
+    _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    return np.asarray(vertices)[first], inverse.reshape(-1)[triangles]
+
+
+def connected_components(n_vertices, triangles):
+    """
+    Labels the connected components (islands) of a mesh, e.g. the buildings of a merged buildings mesh.
+    Uses vectorized label propagation with pointer jumping instead of a Python union-find.
+
+    Args:
+        n_vertices: The number of vertices.
+        triangles: An array of shape (M, 3) with the vertex indices of the triangles.
+
+    Returns:
+        An array of shape (M,) with the component of each triangle, numbered 0, 1, 2, ...
+    """
+    labels = np.arange(n_vertices)
+    while True:
+        # Every vertex of a triangle takes the smallest label of the triangle
+        smallest = labels[triangles].min(axis=1)
+        new_labels = labels.copy()
+        for corner in range(3):
+            np.minimum.at(new_labels, triangles[:, corner], smallest)
+        # Pointer jumping: follow the labels to their roots
+        while True:
+            jumped = new_labels[new_labels]
+            if np.array_equal(jumped, new_labels):
+                break
+            new_labels = jumped
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    _, components = np.unique(labels[triangles[:, 0]], return_inverse=True)
+    return components.reshape(-1)
+
+
+def footprint_centers(vertices, triangles, labels, n_labels):
+    """
+    Computes the center of the footprint (the x-y bounding box) of each labeled part of a mesh, e.g. of each building.
+    Unlike the mean of the triangle centroids, it depends only on the outline of the part, so a building gets the
+    same center in every import that contains it (also when the triangulation or the simplification differs).
+
+    Args:
+        vertices: An array of shape (N, 3) with the coordinates of the vertices.
+        triangles: An array of shape (M, 3) with the vertex indices of the triangles.
+        labels: An array of shape (M,) with the part of each triangle, numbered 0, 1, 2, ...
+        n_labels: The number of parts.
+
+    Returns:
+        An array of shape (n_labels, 2) with the x-y center of each part (NaN for a part without triangles).
+    """
+    corners = np.asarray(vertices, dtype=np.float64)[triangles][:, :, :2]
+    low = np.full((n_labels, 2), np.inf)
+    high = np.full((n_labels, 2), -np.inf)
+    np.minimum.at(low, labels, corners.min(axis=1))
+    np.maximum.at(high, labels, corners.max(axis=1))
+    with np.errstate(invalid='ignore'):
+        return (low + high) / 2
+
+
+def submesh(vertices, triangles, mask):
+    """
+    Extracts the triangles selected by the mask as a mesh with only the vertices they use.
+
+    Args:
+        vertices: An array of shape (N, 3) with the coordinates of the vertices.
+        triangles: An array of shape (M, 3) with the vertex indices of the triangles.
+        mask: A boolean array of shape (M,) selecting the triangles.
+
+    Returns:
+        A (vertices, triangles) tuple of the extracted mesh.
+    """
+    selected = triangles[mask]
+    used, inverse = np.unique(selected, return_inverse=True)
+    return vertices[used], inverse.reshape(-1, 3)
+
+
+def in_bounds(lon, lat, bounds):
+    """
+    Checks which points are inside the (min_lon, min_lat, max_lon, max_lat) bounds. The bounds are half-open
+    (the maximum is excluded), so a point on the common edge of two grid cells belongs to exactly one of them.
+    """
+    min_lon, min_lat, max_lon, max_lat = bounds
+    return (lon >= min_lon) & (lon < max_lon) & (lat >= min_lat) & (lat < max_lat)
@@ -53,7 +53,14 @@ import argparse
 #import shapely.geometry as sg
 import time
 import sys
+import math
 
+# mcgmeshutils.py is next to this script, Blender does not add the folder of the script to the path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import mcginstrument
+from mcginstrument import stage
+from mcgmeshutils import merge_meshes, write_binary_stl, blosm_to_lonlat, weld_vertices, connected_components, footprint_centers, submesh, in_bounds
+from mcgosmhelperblend_parallel import write_cell_manifest, is_cell_done
 
 
 #from wrt_modules.utils import divide_area_into_grid
@@ -164,102 +171,541 @@ def blender_osm_export_stl(args):
     if not os.path.exists(args.d_file_path + f'/{area_name}'):
         os.makedirs(args.d_file_path + f'/{area_name}')
 
-    with open(args.d_file_path + f'/{area_name}' + '/grid_cells.json', 'w') as fp:
+    # Parallel workers write the same file, so write it to a temporary file first
+    tmp_file = args.d_file_path + f'/{area_name}' + f'/grid_cells.{os.getpid()}.tmp'
+    with open(tmp_file, 'w') as fp:
         json.dump(grid_cells, fp)
+    os.replace(tmp_file, args.d_file_path + f'/{area_name}' + '/grid_cells.json')
     
     with open(args.d_file_path + f'/{area_name}' + '/grid_cells.json', 'r') as fp:
         grid_cells = json.load(fp)
 
     grid_cells_new = {int(k): v for k, v in grid_cells.items()}
 
+    # Manifest of the completed grid cells (one file per grid cell, shared by parallel workers)
+    manifest_dir = args.d_file_path + f'/{area_name}/manifest'
+    os.makedirs(manifest_dir, exist_ok=True)
+    cells = getattr(args, 'cells', None)
+    failed_cells = []
+
     for k, v in grid_cells_new.items():
         print(f'"Bizirk" or sub-area {k} of {area_name} has {len(v)} grid cells')
 
+        pending = []
         for i, ar in enumerate(v):
-            min_lon, min_lat, max_lon, max_lat = ar
-            print(f'Grid cell {i} of sub-area {k} has coordinates: {min_lon, min_lat, max_lon, max_lat}')
-
-            # Paste into blosom the coordinates of the grid cell
-            bpy.data.scenes[args.scene_name].blosm.minLon = min_lon
-            bpy.data.scenes[args.scene_name].blosm.minLat = min_lat     
-            bpy.data.scenes[args.scene_name].blosm.maxLon = max_lon
-            bpy.data.scenes[args.scene_name].blosm.maxLat = max_lat 
-
-            print(args.d_file_path)
+            cell_name = f'{k}_{i}'
+            # Export only the grid cells assigned to this worker
+            if cells is not None and cell_name not in cells:
+                continue
+            # Skip the grid cells completed in a previous run
+            if getattr(args, 'resume', False) and is_cell_done(manifest_dir, cell_name, ar):
+                print(f'Grid cell {i} of sub-area {k} already completed. Skipping.')
+                continue
+            pending.append(i)
+
+        if getattr(args, 'dedup', False) and pending:
+            # Import the sub-area once and slice it into the grid cells
+            area_start_time = time.time()
+            for i in pending:
+                write_cell_manifest(manifest_dir, f'{k}_{i}', {'status': 'running', 'worker': getattr(args, 'worker_id', 0)})
+            try:
+                with stage('sub_area', sub_area=k, cells=len(pending)):
+                    cell_stats = export_sub_area_dedup(args, k, v, pending)
+            except Exception as e:
+                print(f'Sub-area {k} failed: {e!r}')
+                failed_cells += [f'{k}_{i}' for i in pending]
+                reset_scene()
+                for i in pending:
+                    write_cell_manifest(manifest_dir, f'{k}_{i}', {'status': 'failed', 'error': repr(e), 'seconds': time.time() - area_start_time, 'worker': getattr(args, 'worker_id', 0)})
+                continue
+            area_seconds = time.time() - area_start_time
+            memory_mb = memory_usage_mb()
+            print(f'Sub-area {k} took {area_seconds:.1f} s, memory {memory_mb} MB, {len(bpy.data.meshes)} meshes and {len(bpy.data.materials)} materials left')
+            for i in pending:
+                write_cell_manifest(manifest_dir, f'{k}_{i}', dict({'status': 'done', 'bbox': v[i], 'seconds': area_seconds / len(pending), 'memory_mb': memory_mb, 'worker': getattr(args, 'worker_id', 0)}, **cell_stats[i]))
+            continue
+
+        for i in pending:
+            ar = v[i]
+            cell_name = f'{k}_{i}'
+            cell_start_time = time.time()
+            # A crash during the export leaves the grid cell as running, i.e. not done
+            write_cell_manifest(manifest_dir, cell_name, {'status': 'running', 'worker': getattr(args, 'worker_id', 0)})
+            try:
+                with stage('cell', cell=cell_name):
+                    simplify_stats = export_grid_cell(args, k, i, ar)
+            except Exception as e:
+                print(f'Grid cell {i} of sub-area {k} failed: {e!r}')
+                failed_cells.append(cell_name)
+                # Do not leave the objects of the failed grid cell in the next one
+                reset_scene()
+                write_cell_manifest(manifest_dir, cell_name, {'status': 'failed', 'error': repr(e), 'seconds': time.time() - cell_start_time, 'worker': getattr(args, 'worker_id', 0)})
+                continue
+            cell_seconds = time.time() - cell_start_time
+            memory_mb = memory_usage_mb()
+            print(f'Grid cell {i} of sub-area {k} took {cell_seconds:.1f} s, memory {memory_mb} MB, {len(bpy.data.meshes)} meshes and {len(bpy.data.materials)} materials left')
+            record = {'status': 'done', 'bbox': ar, 'seconds': cell_seconds, 'memory_mb': memory_mb, 'worker': getattr(args, 'worker_id', 0)}
+            if simplify_stats:
+                record['simplify'] = simplify_stats
+            write_cell_manifest(manifest_dir, cell_name, record)
+
+    if failed_cells:
+        print(f'{len(failed_cells)} grid cells failed: {failed_cells}')
+    return failed_cells
+
+
+def export_grid_cell(args, k, i, ar):
+    """
+    Imports the terrain and buildings of a grid cell with blosm, exports them to DAE and STL files
+    in args.d_file_path/area_name and deletes the imported objects.
 
+    Args:
+        args: The arguments to the function.
+        k: The number of the sub-area.
+        i: The number of the grid cell in the sub-area.
+        ar: The coordinates of the grid cell as (min_lon, min_lat, max_lon, max_lat).
 
-            # First, get terrain data
-                    # 1.0 Firs, terrain data:
-            bpy.context.scene.blosm.dataType = 'terrain'
-            bpy.ops.blosm.import_data()
-            print("Terrain data loaded from ArcGIS")
-            
-            # Export to Collada only terrain
-            bpy.ops.wm.collada_export(filepath=args.d_file_path + f'/{area_name}/{k}_{i}_terrain.dae')
+    Returns:
+        The face counts before and after the simplification of the terrain and the buildings (empty without --simplify).
+    """
+    area_name = args.area_name
+    min_lon, min_lat, max_lon, max_lat = ar
+    print(f'Grid cell {i} of sub-area {k} has coordinates: {min_lon, min_lat, max_lon, max_lat}')
+
+    # Paste into blosom the coordinates of the grid cell
+    bpy.data.scenes[args.scene_name].blosm.minLon = min_lon
+    bpy.data.scenes[args.scene_name].blosm.minLat = min_lat     
+    bpy.data.scenes[args.scene_name].blosm.maxLon = max_lon
+    bpy.data.scenes[args.scene_name].blosm.maxLat = max_lat 
+
+    print(args.d_file_path)
+
+
+    # First, get terrain data
+            # 1.0 Firs, terrain data:
+    bpy.context.scene.blosm.dataType = 'terrain'
+    with stage('import_terrain'):
+        bpy.ops.blosm.import_data()
+    print("Terrain data loaded from ArcGIS")
+    terrain_objects = list(bpy.context.scene.objects)
+    simplify_stats = {}
+    if getattr(args, 'simplify', False):
+        with stage('simplify', data='terrain'):
+            simplify_stats['terrain'] = simplify_objects(terrain_objects, args.simplify_angle, args.simplify_merge_distance, args.decimate_ratio)
+    
+    # Export to Collada only terrain
+    with stage('export_terrain_dae'):
+        bpy.ops.wm.collada_export(filepath=args.d_file_path + f'/{area_name}/{k}_{i}_terrain.dae')
 
-            # Switch to OSM
+    # Switch to OSM
 
-            bpy.context.scene.blosm.dataType = 'osm'
+    bpy.context.scene.blosm.dataType = 'osm'
 
-            # ---- Collada ---- #
+    # ---- Collada ---- #
 
-            bpy.data.scenes[args.scene_name].blosm.mode = '3Dsimple'
-            bpy.data.scenes[args.scene_name].blosm.buildings = True
-            bpy.data.scenes[args.scene_name].blosm.water = False
-            bpy.data.scenes[args.scene_name].blosm.highways = False
-            bpy.data.scenes[args.scene_name].blosm.forests = False
-            bpy.data.scenes[args.scene_name].blosm.vegetation = False
-            bpy.data.scenes[args.scene_name].blosm.railways = False
+    bpy.data.scenes[args.scene_name].blosm.mode = '3Dsimple'
+    bpy.data.scenes[args.scene_name].blosm.buildings = True
+    bpy.data.scenes[args.scene_name].blosm.water = False
+    bpy.data.scenes[args.scene_name].blosm.highways = False
+    bpy.data.scenes[args.scene_name].blosm.forests = False
+    bpy.data.scenes[args.scene_name].blosm.vegetation = False
+    bpy.data.scenes[args.scene_name].blosm.railways = False
 
-            bpy.ops.blosm.import_data() # Import buildings
+    with stage('import_buildings'):
+        bpy.ops.blosm.import_data() # Import buildings
+    if getattr(args, 'simplify', False):
+        with stage('simplify', data='buildings'):
+            simplify_stats['buildings'] = simplify_objects([obj for obj in bpy.context.scene.objects if obj not in terrain_objects],
+                                                           args.simplify_angle, args.simplify_merge_distance, args.decimate_ratio)
+        print_simplify_stats(f'Grid cell {i} of sub-area {k}', simplify_stats)
 
-            # Deselect all objects
-            bpy.ops.object.select_all(action='DESELECT')
+    # Deselect all objects
+    bpy.ops.object.select_all(action='DESELECT')
 
-            # Select objects with ".osm_buildings" in their name
-            for obj in bpy.context.scene.objects:
-                if ".osm_buildings" in obj.name:
-                    obj.select_set(True)
+    # Select objects with ".osm_buildings" in their name
+    for obj in bpy.context.scene.objects:
+        if ".osm_buildings" in obj.name:
+            obj.select_set(True)
 
-            bpy.ops.wm.collada_export(filepath=args.d_file_path + f'/{area_name}/{k}_{i}_buildings.dae', selected=True) # Export buildings
+    with stage('export_buildings_dae'):
+        bpy.ops.wm.collada_export(filepath=args.d_file_path + f'/{area_name}/{k}_{i}_buildings.dae', selected=True) # Export buildings
 
-            # bpy.data.scenes[args.scene_name].blosm.buildings = False
-            # bpy.data.scenes[args.scene_name].blosm.water = False
-            # bpy.data.scenes[args.scene_name].blosm.highways = False
-            # bpy.data.scenes[args.scene_name].blosm.forests = False
-            # bpy.data.scenes[args.scene_name].blosm.vegetation = False
-            # bpy.data.scenes[args.scene_name].blosm.railways = True
+    # bpy.data.scenes[args.scene_name].blosm.buildings = False
+    # bpy.data.scenes[args.scene_name].blosm.water = False
+    # bpy.data.scenes[args.scene_name].blosm.highways = False
+    # bpy.data.scenes[args.scene_name].blosm.forests = False
+    # bpy.data.scenes[args.scene_name].blosm.vegetation = False
+    # bpy.data.scenes[args.scene_name].blosm.railways = True
 
-            # bpy.ops.blosm.import_data() # Import railways
+    # bpy.ops.blosm.import_data() # Import railways
 
-            # # Deselect all objects
-            # bpy.ops.object.select_all(action='DESELECT')
+    # # Deselect all objects
+    # bpy.ops.object.select_all(action='DESELECT')
 
-            # # Select objects that contain "railway"
-            # for obj in bpy.context.scene.objects:
-            #     if "railway" in obj.name:
-            #         obj.select_set(True)
+    # # Select objects that contain "railway"
+    # for obj in bpy.context.scene.objects:
+    #     if "railway" in obj.name:
+    #         obj.select_set(True)
 
-            # bpy.ops.wm.collada_export(filepath=args.d_file_path + f'/{k}_{i}_railway.dae', selected=True) # Export buildings
-            
-            # ---- STL ----
+    # bpy.ops.wm.collada_export(filepath=args.d_file_path + f'/{k}_{i}_railway.dae', selected=True) # Export buildings
+    
+    # ---- STL ----
+    with stage('export_stl', writer=getattr(args, 'stl_writer', 'bpy')):
+        if getattr(args, 'stl_writer', 'bpy') == 'numpy':
+            # Write the STL directly from the mesh data
+            export_stl_numpy(bpy.context.scene.objects, args.d_file_path + f'/{area_name}/{k}_{i}.stl', merge=not getattr(args, 'stl_per_object', False))
+        else:
             # Select all objects
             bpy.ops.object.select_all(action='SELECT')
             # Export to stl and give a complete filename
             bpy.ops.export_mesh.stl(filepath=args.d_file_path + f'/{area_name}/{k}_{i}.stl')
 
-            # --- Next grid cell ---
+    # --- Next grid cell ---
 
-            # Select all objects
-            bpy.ops.object.select_all(action='SELECT')
+    # Remove the objects and the data left behind by them
+    with stage('reset_scene'):
+        reset_scene()
+    
+    print("HERE")
+    return simplify_stats
+
+
+def export_sub_area_dedup(args, k, v, pending):
+    """
+    Imports the terrain and buildings of a whole sub-area once with blosm and slices them into the grid cells,
+    instead of importing every grid cell on its own (the imports of neighbouring grid cells overlap at the
+    shared edges and buildings crossing an edge are imported in both of them).
+    The terrain triangles are assigned to the grid cell containing their centroid. The buildings are imported as
+    one object per OSM building (blosm singleObject off) and each building is assigned as a whole to the grid cell
+    containing the center of its footprint. The OSM API returns the whole footprint of a building crossing the
+    edge of a sub-area, so the imports of both sub-areas compute the same center and exactly one of them owns the
+    building. Buildings whose center is outside the sub-area are left to the neighbouring sub-area
+    (see check_dedup_ownership.py). With an older blosm that joins all buildings into one object, the buildings
+    are split into connected parts instead (touching buildings form one block). A block crossing the edge of a
+    sub-area is then not the same in both imports and can end up in both sub-areas or in none.
+    With args.simplify, the terrain and buildings of the sub-area are simplified (simplify_objects) before the slicing.
+    For each grid cell, k_i_terrain.stl, k_i_buildings.stl and the merged k_i.stl are written to
+    args.d_file_path/area_name (no DAE files), and the buildings of each grid cell (OSM id, footprint center) are listed
+    in k_buildings.json.
+
+    Args:
+        args: The arguments to the function.
+        k: The number of the sub-area.
+        v: The coordinates of the grid cells of the sub-area as (min_lon, min_lat, max_lon, max_lat).
+        pending: The numbers of the grid cells to export.
+
+    Returns:
+        A dictionary with the key being the grid cell number and the value being the number of terrain triangles and buildings.
+    """
+    area_name = args.area_name
+    scene = bpy.data.scenes[args.scene_name]
+    min_lon = min(ar[0] for ar in v)
+    min_lat = min(ar[1] for ar in v)
+    max_lon = max(ar[2] for ar in v)
+    max_lat = max(ar[3] for ar in v)
+    print(f'Sub-area {k} has coordinates: {min_lon, min_lat, max_lon, max_lat}')
+
+    scene.blosm.minLon = min_lon
+    scene.blosm.minLat = min_lat
+    scene.blosm.maxLon = max_lon
+    scene.blosm.maxLat = max_lat
+
+    # Terrain of the whole sub-area
+    scene.blosm.dataType = 'terrain'
+    with stage('import_terrain'):
+        bpy.ops.blosm.import_data()
+    print("Terrain data loaded from ArcGIS")
+    terrain_objects = list(scene.objects)
+    simplify_stats = {}
+    if getattr(args, 'simplify', False):
+        with stage('simplify', data='terrain'):
+            simplify_stats['terrain'] = simplify_objects(terrain_objects, args.simplify_angle, args.simplify_merge_distance, args.decimate_ratio)
+
+    # Buildings of the whole sub-area
+    scene.blosm.dataType = 'osm'
+    scene.blosm.mode = '3Dsimple'
+    scene.blosm.buildings = True
+    scene.blosm.water = False
+    scene.blosm.highways = False
+    scene.blosm.forests = False
+    scene.blosm.vegetation = False
+    scene.blosm.railways = False
+    if hasattr(scene.blosm, 'singleObject'):
+        # One object per OSM building
+        scene.blosm.singleObject = False
+    with stage('import_buildings'):
+        bpy.ops.blosm.import_data()
+    building_objects = [obj for obj in scene.objects if obj not in terrain_objects]
+    if getattr(args, 'simplify', False):
+        with stage('simplify', data='buildings'):
+            simplify_stats['buildings'] = simplify_objects(building_objects, args.simplify_angle, args.simplify_merge_distance, args.decimate_ratio)
+        print_simplify_stats(f'Sub-area {k}', simplify_stats)
+
+    # Origin of the projection used by blosm for the scene coordinates
+    lon0, lat0 = scene["lon"], scene["lat"]
+
+    with stage('label_buildings'):
+        terrain_vertices, terrain_triangles = merge_meshes([(vertices, triangles) for _, vertices, triangles in mesh_arrays_from_objects(terrain_objects)])
+        centroids = terrain_vertices[terrain_triangles].mean(axis=1)
+        terrain_lon, terrain_lat = blosm_to_lonlat(centroids[:, 0], centroids[:, 1], lon0, lat0)
+
+        objects_by_name = {obj.name: obj for obj in building_objects}
+        building_meshes = [(name, vertices, triangles) for name, vertices, triangles in mesh_arrays_from_objects(building_objects) if len(triangles)]
+        building_vertices, building_triangles = merge_meshes([(vertices, triangles) for _, vertices, triangles in building_meshes])
+        if len(building_meshes) > 1:
+            # One object per building, keyed on its OSM id
+            components = np.repeat(np.arange(len(building_meshes)), [len(triangles) for _, _, triangles in building_meshes])
+            building_keys = [osm_building_id(objects_by_name[name]) for name, _, _ in building_meshes]
+        else:
+            # All buildings in one object: the faces of a building do not always share vertices, weld them before labeling the buildings
+            building_vertices, building_triangles = weld_vertices(building_vertices, building_triangles)
+            components = connected_components(len(building_vertices), building_triangles) if len(building_triangles) else np.empty(0, dtype=np.int64)
+            building_keys = None
+        n_buildings = components.max() + 1 if len(components) else 0
+        if building_keys is None:
+            building_keys = list(range(n_buildings))
+        centers = footprint_centers(building_vertices, building_triangles, components, n_buildings)
+        building_lon, building_lat = blosm_to_lonlat(centers[:, 0], centers[:, 1], lon0, lat0)
+    print(f'Sub-area {k}: {len(terrain_triangles)} terrain triangles, {n_buildings} buildings')
+
+    cell_stats = {}
+    cell_buildings = {}
+    for i in pending:
+        terrain = submesh(terrain_vertices, terrain_triangles, in_bounds(terrain_lon, terrain_lat, v[i]))
+        building_ids = np.flatnonzero(in_bounds(building_lon, building_lat, v[i]))
+        is_cell_building = np.zeros(n_buildings, dtype=bool)
+        is_cell_building[building_ids] = True
+        buildings = submesh(building_vertices, building_triangles, is_cell_building[components])
+
+        with stage('write_stl', cell=f'{k}_{i}'):
+            write_binary_stl(args.d_file_path + f'/{area_name}/{k}_{i}_terrain.stl', *terrain)
+            write_binary_stl(args.d_file_path + f'/{area_name}/{k}_{i}_buildings.stl', *buildings)
+            write_binary_stl(args.d_file_path + f'/{area_name}/{k}_{i}.stl', *merge_meshes([terrain, buildings]))
+
+        cell_buildings[f'{k}_{i}'] = [[building_keys[b], float(building_lon[b]), float(building_lat[b])] for b in building_ids]
+        cell_stats[i] = {'terrain_triangles': len(terrain[1]), 'buildings': len(building_ids), 'building_triangles': len(buildings[1])}
+        if simplify_stats:
+            # The simplification runs on the whole sub-area before the slicing
+            cell_stats[i]['sub_area_simplify'] = simplify_stats
+        print(f'Grid cell {i} of sub-area {k}: {len(terrain[1])} terrain triangles, {len(building_ids)} buildings')
+
+    # Buildings (OSM id, or the number of the block with a single buildings object, and footprint center) of each grid cell
+    tmp_file = args.d_file_path + f'/{area_name}/{k}_buildings.{os.getpid()}.tmp'
+    with open(tmp_file, 'w') as fp:
+        json.dump({'origin': [lon0, lat0], 'cells': cell_buildings}, fp)
+    os.replace(tmp_file, args.d_file_path + f'/{area_name}/{k}_buildings.json')
+
+    with stage('reset_scene'):
+        reset_scene()
+    return cell_stats
+
+
+def osm_building_id(obj):
+    """
+    Returns the OSM id of a building object imported by blosm (custom property "id" or "osm_id"),
+    or the name of the object if blosm did not store the id.
+    """
+    for key in ('id', 'osm_id'):
+        if key in obj.keys():
+            return str(obj[key])
+    return obj.name
+
+
+def simplify_objects(objects, angle_limit=5., merge_distance=1e-4, decimate_ratio=None):
+    """
+    Simplifies the meshes of the objects with bmesh to reduce the number of faces for the ray-tracing:
+    merges the vertices closer than merge_distance, removes degenerate faces and interior faces (faces whose
+    edges all have more than two faces, e.g. the walls between touching buildings) and merges the neighbouring
+    faces whose angle is below angle_limit into polygons (limited dissolve, faces of different materials are kept apart).
+    The angle limit bounds the error of the simplification. Optionally, a collapse decimation with decimate_ratio
+    follows, which reduces the faces further but is not error bounded.
+
+    Args:
+        objects: The Blender objects, the objects that are not meshes are skipped.
+        angle_limit: The maximum angle in degrees between faces merged by the limited dissolve (0 to skip it).
+        merge_distance: The distance in meters below which vertices are merged.
+        decimate_ratio: The ratio of the faces kept by the collapse decimation (None to skip it).
+
+    Returns:
+        A dictionary with the number of faces (polygons) and triangles before and after the simplification.
+    """
+    import bmesh
+    stats = {'faces_before': 0, 'faces_after': 0, 'triangles_before': 0, 'triangles_after': 0}
+    # Original mesh name -> simplified mesh, objects sharing a mesh (linked duplicates) are simplified once
+    done = {}
+    for obj in objects:
+        if obj.type != 'MESH':
+            continue
+        src = obj.data
+        if src.name in done:
+            # Point the other users of the mesh to the decimated mesh as well
+            obj.data = done[src.name]
+            continue
+        faces, triangles = mesh_face_counts(obj.data)
+        stats['faces_before'] += faces
+        stats['triangles_before'] += triangles
+
+        bm = bmesh.new()
+        bm.from_mesh(obj.data)
+        bmesh.ops.remove_doubles(bm, verts=bm.verts, dist=merge_distance)
+        bmesh.ops.dissolve_degenerate(bm, edges=bm.edges, dist=merge_distance)
+        interior = [face for face in bm.faces if all(len(edge.link_faces) > 2 for edge in face.edges)]
+        if interior:
+            bmesh.ops.delete(bm, geom=interior, context='FACES_ONLY')
+        if angle_limit > 0:
+            bmesh.ops.dissolve_limit(bm, angle_limit=math.radians(angle_limit), verts=bm.verts[:], edges=bm.edges[:], delimit={'MATERIAL'})
+        bm.to_mesh(obj.data)
+        bm.free()
+        obj.data.update()
+
+        if decimate_ratio is not None and decimate_ratio < 1:
+            # Apply a collapse decimate modifier by replacing the mesh with the evaluated one
+            modifier = obj.modifiers.new('mcg_decimate', 'DECIMATE')
+            modifier.decimate_type = 'COLLAPSE'
+            modifier.ratio = decimate_ratio
+            depsgraph = bpy.context.evaluated_depsgraph_get()
+            obj.data = bpy.data.meshes.new_from_object(obj.evaluated_get(depsgraph))
+            obj.modifiers.remove(modifier)
+
+        done[src.name] = obj.data
+        faces, triangles = mesh_face_counts(obj.data)
+        stats['faces_after'] += faces
+        stats['triangles_after'] += triangles
+
+    # Remove the original meshes replaced by the decimated ones, once no object uses them anymore
+    for name, mesh in done.items():
+        src = bpy.data.meshes.get(name)
+        if src is not None and src != mesh and src.users == 0:
+            bpy.data.meshes.remove(src)
+    mcginstrument.count('faces_removed', stats['faces_before'] - stats['faces_after'])
+    return stats
+
+
+def mesh_face_counts(mesh):
+    """
+    Returns the number of polygons of a mesh and the number of triangles they are split into (as in the STL files).
+    """
+    loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get('loop_total', loop_totals)
+    return len(loop_totals), int((loop_totals - 2).sum())
+
+
+def print_simplify_stats(name, simplify_stats):
+    """
+    Prints the face and triangle counts of simplify_objects for the terrain and the buildings.
+    """
+    for data, stats in simplify_stats.items():
+        print(f'{name} {data}: {stats["faces_before"]} -> {stats["faces_after"]} faces, '
+              f'{stats["triangles_before"]} -> {stats["triangles_after"]} triangles')
+
+
+def reset_scene():
+    """
+    Removes all objects of the scene and purges the data blocks they leave behind (meshes, materials,
+    textures, images, curves, empty collections) with bulk bpy.data calls instead of bpy.ops.object.delete,
+    so that the Blender session does not grow from one grid cell to the next.
+    """
+    scene = bpy.context.scene
+    objects = list(scene.objects)
+    if hasattr(bpy.data, 'batch_remove'):
+        bpy.data.batch_remove(ids=objects)
+    else:
+        for obj in objects:
+            bpy.data.objects.remove(obj, do_unlink=True)
+
+    # Remove the (nested) collections that are empty now
+    def remove_empty_collections(parent):
+        for collection in list(parent.children):
+            remove_empty_collections(collection)
+            if len(collection.objects) == 0 and len(collection.children) == 0:
+                bpy.data.collections.remove(collection)
+    remove_empty_collections(scene.collection)
+
+    # Purge the orphan data blocks, repeated as removing a block can orphan others (e.g. mesh -> material -> image)
+    if hasattr(bpy.data, 'orphans_purge'):
+        bpy.data.orphans_purge(do_local_ids=True, do_linked_ids=True, do_recursive=True)
+    else:
+        data_collections = (bpy.data.meshes, bpy.data.materials, bpy.data.textures, bpy.data.images, bpy.data.curves, bpy.data.node_groups)
+        while True:
+            orphans = [block for data in data_collections for block in data if block.users == 0]
+            if not orphans:
+                break
+            bpy.data.batch_remove(ids=orphans)
+
+
+def memory_usage_mb():
+    """
+    Returns the memory (resident set size) of the Blender process in MB, or None if it is not available.
+    Uses psutil if installed, otherwise the peak memory from the resource module (not on Windows).
+    """
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().rss / 2**20, 1)
+    except ImportError:
+        pass
+    try:
+        import resource
+        # ru_maxrss is in KB on Linux and in bytes on macOS
+        scale = 2**20 if sys.platform == 'darwin' else 2**10
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+    except ImportError:
+        return None
+
+
+def mesh_arrays_from_objects(objects):
+    """
+    Gets the world-space vertices and triangles of the mesh objects (with modifiers applied) as NumPy arrays,
+    using foreach_get instead of a Python loop over the vertices.
+
+    Args:
+        objects: The Blender objects, the objects that are not meshes are skipped.
+
+    Returns:
+        A list of (name, vertices, triangles) tuples with vertices of shape (N, 3) and triangles of shape (M, 3).
+    """
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    meshes = []
+    for obj in objects:
+        if obj.type != 'MESH':
+            continue
+        obj_eval = obj.evaluated_get(depsgraph)
+        mesh = obj_eval.to_mesh()
+        mesh.calc_loop_triangles()
+        vertices = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        triangles = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+        mesh.vertices.foreach_get('co', vertices)
+        mesh.loop_triangles.foreach_get('vertices', triangles)
+        obj_eval.to_mesh_clear()
+        # Transform to world coordinates
+        matrix = np.array(obj.matrix_world, dtype=np.float64)
+        vertices = vertices.reshape(-1, 3) @ matrix[:3, :3].T + matrix[:3, 3]
+        meshes.append((obj.name, vertices, triangles.reshape(-1, 3)))
+    return meshes
+
+
+def export_stl_numpy(objects, filepath, merge=True):
+    """
+    Exports the mesh objects to a binary STL file without the bpy.ops STL export operator.
+
+    Args:
+        objects: The Blender objects to export.
+        filepath: The name of the STL file.
+        merge: If True, all objects are written as a single merged mesh to filepath.
+               If False, each object is written to its own file filepath_<object name>.stl.
+
+    Returns:
+        The number of triangles written.
+    """
+    meshes = mesh_arrays_from_objects(objects)
+    if merge:
+        vertices, triangles = merge_meshes([(vertices, triangles) for _, vertices, triangles in meshes])
+        return write_binary_stl(filepath, vertices, triangles)
+    count = 0
+    for name, vertices, triangles in meshes:
+        count += write_binary_stl(filepath[:-len('.stl')] + f'_{name}.stl', vertices, triangles)
+    return count
 
-            # Delete selected objects
-            bpy.ops.object.delete()
-            
-            print("HERE")
 
-            # Pause the script for 30 seconds
-            
 if __name__ == '__main__':
     # Run the main function
     parser = argparse.ArgumentParser(f'Retrieve a grid of sub-areas and base stations in the area')
@@ -272,16 +718,36 @@ if __name__ == '__main__':
     parser.add_argument('--grid_size', type=int, default=2, help='Number of grid cells to divide each sub-area into grid_size x grid_size grid cells. The center of each grid cell will be a point of interest.')
     parser.add_argument('--d_file_path', type=str, default= None, help='Path to the folder where the stl files will be saved. If None, then default is C:/Users/Desktop/Results. You MUST have the absolute path here. Otherwise data are stored in Blender folder.')
     parser.add_argument('--scene_name', type=str, default='Scene', help='Name of the scene in blender. Default is Scene')
+    parser.add_argument('--stl_writer', type=str, default='bpy', choices=['bpy', 'numpy'], help='bpy uses the Blender STL export operator, numpy writes the binary STL directly from the mesh data (faster).')
+    parser.add_argument('--stl_per_object', action='store_true', help='With --stl_writer numpy, write one STL file per object instead of a single merged mesh.')
+    parser.add_argument('--dedup', action='store_true', help='Import each sub-area once and slice it into the grid cells, so that each building is in exactly one grid cell. Writes STL files only (no DAE).')
+    parser.add_argument('--simplify', action='store_true', help='Simplify the terrain and buildings before the DAE/STL export: merge close vertices, remove degenerate and interior faces and merge coplanar faces (limited dissolve). Reports the face counts before and after per grid cell.')
+    parser.add_argument('--simplify_angle', type=float, default=5., help='With --simplify, maximum angle in degrees between faces merged into one polygon (bounds the error, 0 to keep all faces)')
+    parser.add_argument('--simplify_merge_distance', type=float, default=1e-4, help='With --simplify, distance in meters below which vertices are merged')
+    parser.add_argument('--decimate_ratio', type=float, default=None, help='With --simplify, also apply a collapse decimation keeping this ratio of the faces (not error bounded)')
+    parser.add_argument('--cells', nargs='+', type=str, default=None, help='Names of the grid cells to export, e.g., 0_1 0_2 (sub-area_grid cell). Default is all grid cells.')
+    parser.add_argument('--resume', action='store_true', help='Skip the grid cells marked as done (with the same coordinates) in d_file_path/area_name/manifest')
+    parser.add_argument('--worker_id', type=int, default=0, help='Id of the worker when running several Blender instances (see mcgosmhelperblend_parallel.py)')
+    parser.add_argument('--metrics', type=str, default=None, help='Write per-stage timings (blosm imports, DAE/STL export, scene reset) as JSON lines to this file')
+    parser.add_argument('--profile', action='store_true', help='With --metrics, also profile with cProfile (saved next to the metrics file)')
+    parser.add_argument('--trace_memory', action='store_true', help='With --metrics, also record the peak memory of each stage with tracemalloc')
     parser.add_argument('--help_options', action='store_true', help='Print options')
-    # Parse the arguments
-    args = parser.parse_args()
+    # Parse the arguments after "--" when run as blender --background --python mcgosmhelperblend.py -- [options]
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    args = parser.parse_args(argv)
     # Print the available options if requested
     if args.help_options:
         parser.print_help()
         sys.exit()
     # if args.verbose:
     #     print("Verbose enabled")
+    mcginstrument.configure(args.metrics, profile=args.profile, trace_memory=args.trace_memory)
     start_time = time.time()
-    blender_osm_export_stl(args)
+    with stage('blender_osm_export_stl', area_name=args.area_name, worker=args.worker_id):
+        failed_cells = blender_osm_export_stl(args)
     print("--- %s minutes ---" % ((time.time() - start_time)/60))
+    mcginstrument.close()
+    # Report the failure to the orchestrator when running headless
+    if failed_cells and bpy.app.background:
+        sys.exit(1)
 
@@ -0,0 +1,240 @@
+# MIT License
+
+# Copyright (c) 2023 MCG - Artan Salihu
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Runs mcgosmhelperblend.py in several headless Blender instances in parallel.
+
+The grid cells are split into disjoint subsets, one per worker, and each worker runs
+    blender --background [blend_file] --python mcgosmhelperblend.py -- [options] --cells <subset>
+The workers write one manifest file per grid cell to d_file_path/area_name/manifest ('running' when the
+export of the grid cell starts, 'done' or 'failed' when it ends), so a crashed run can be continued with --resume.
+Before the workers start, the grid cells assigned to them are marked 'queued', so a record of an earlier run is
+never taken as done for a grid cell that crashed in this run. This script runs with a normal Python, not in Blender,
+and the manifest functions are shared with mcgosmhelperblend.py. check_parallel_export.py runs it with a stub
+worker script (stub_export_worker.py) instead of Blender and blosm.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+def grid_cell_names(k, grid_size):
+    """
+    Returns the names (sub-area_grid cell) of the grid cells in the same order as blender_osm_export_stl.
+
+    Args:
+        k: The number of sub-areas (k x k).
+        grid_size: The number of grid cells in each sub-area (grid_size x grid_size), 0 means one grid cell per sub-area.
+
+    Returns:
+        A list of grid cell names, e.g. ['0_0', '0_1', ...].
+    """
+    cells_per_area = grid_size * grid_size if grid_size > 0 else 1
+    return [f'{a}_{c}' for a in range(k * k) for c in range(cells_per_area)]
+
+
+def grid_cell_bboxes(x_min, y_min, x_max, y_max, k, grid_size):
+    """
+    Returns the coordinates of the grid cells, computed as divide_area_into_grid in mcgosmhelperblend.py.
+
+    Args:
+        x_min, y_min, x_max, y_max: The coordinates of the area.
+        k: The number of sub-areas (k x k).
+        grid_size: The number of grid cells in each sub-area (grid_size x grid_size), 0 means one grid cell per sub-area.
+
+    Returns:
+        A dictionary with the key being the grid cell name and the value being its (min_lon, min_lat, max_lon, max_lat).
+    """
+    def divide(x_min, y_min, x_max, y_max, k):
+        x_step = (x_max - x_min) / k
+        y_step = (y_max - y_min) / k
+        return [(x_min + i * x_step, y_min + j * y_step, x_min + (i + 1) * x_step, y_min + (j + 1) * y_step) for i in range(k) for j in range(k)]
+
+    bboxes = {}
+    for a, sub_area in enumerate(divide(x_min, y_min, x_max, y_max, k)):
+        for c, cell in enumerate(divide(*sub_area, grid_size) if grid_size > 0 else [sub_area]):
+            bboxes[f'{a}_{c}'] = list(cell)
+    return bboxes
+
+
+def same_bbox(bbox, other, tolerance=1e-9):
+    """
+    Checks if two bounding boxes (min_lon, min_lat, max_lon, max_lat) are equal within a tolerance in degrees
+    (other is None if the record has no bounding box).
+    """
+    if other is None or len(other) != 4:
+        return False
+    return all(abs(a - b) <= tolerance for a, b in zip(bbox, other))
+
+
+def read_manifest(manifest_dir):
+    """
+    Reads the status of the grid cells written by the workers.
+
+    Args:
+        manifest_dir: The folder with one JSON file per grid cell.
+
+    Returns:
+        A dictionary with the key being the grid cell name and the value being its record.
+    """
+    manifest = {}
+    if not os.path.isdir(manifest_dir):
+        return manifest
+    for filename in os.listdir(manifest_dir):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(manifest_dir, filename), 'r') as fp:
+                manifest[filename[:-len('.json')]] = json.load(fp)
+        except (OSError, ValueError):
+            continue
+    return manifest
+
+
+def write_cell_manifest(manifest_dir, cell_name, record):
+    """
+    Writes the status of a grid cell to manifest_dir/cell_name.json. The file is written to a temporary
+    file first and then renamed, so parallel workers and crashes never leave a half-written file.
+    """
+    tmp_file = f'{manifest_dir}/{cell_name}.{os.getpid()}.tmp'
+    with open(tmp_file, 'w') as fp:
+        json.dump(record, fp)
+    os.replace(tmp_file, f'{manifest_dir}/{cell_name}.json')
+
+
+def is_cell_done(manifest_dir, cell_name, bbox=None):
+    """
+    Checks if the manifest marks the grid cell as done. If bbox is given, a record with another bounding box
+    (e.g. from a run with a different area or grid size) does not count as done.
+    """
+    try:
+        with open(f'{manifest_dir}/{cell_name}.json', 'r') as fp:
+            record = json.load(fp)
+    except (OSError, ValueError):
+        return False
+    return record.get('status') == 'done' and (bbox is None or same_bbox(bbox, record.get('bbox')))
+
+
+def run_parallel_export(args, worker_options=()):
+    """
+    Partitions the grid cells into args.workers disjoint subsets and exports each subset in its own
+    headless Blender instance. The output of each worker is written to d_file_path/area_name/logs.
+
+    Args:
+        args: The arguments to the function.
+        worker_options: Additional options passed to each worker, e.g. ['--stl_writer', 'numpy'].
+
+    Returns:
+        A list of the grid cells that are not done after all workers finished.
+    """
+    if args.d_file_path is None:
+        args.d_file_path = os.path.join(os.path.expanduser("~"), "Desktop", "Results")
+    # All workers must write to the same absolute path
+    args.d_file_path = os.path.abspath(args.d_file_path)
+    area_dir = os.path.join(args.d_file_path, args.area_name)
+    manifest_dir = os.path.join(area_dir, 'manifest')
+    log_dir = os.path.join(area_dir, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+    os.makedirs(manifest_dir, exist_ok=True)
+
+    cells = grid_cell_names(args.k, args.grid_size)
+    if args.resume:
+        bboxes = grid_cell_bboxes(args.x_min, args.y_min, args.x_max, args.y_max, args.k, args.grid_size)
+        cells = [cell for cell in cells if not is_cell_done(manifest_dir, cell, bboxes[cell])]
+    print(f'{len(cells)} grid cells of {args.area_name} to export with {args.workers} Blender workers')
+    if not cells:
+        return []
+
+    if '--dedup' in worker_options:
+        # With --dedup a worker imports whole sub-areas, so all grid cells of a sub-area go to the same worker
+        sub_areas = sorted({cell.split('_')[0] for cell in cells}, key=int)
+        subsets = [[cell for cell in cells if cell.split('_')[0] in sub_areas[w::args.workers]] for w in range(args.workers)]
+    else:
+        # Round-robin partition, so that neighbouring grid cells (and their load) are spread over the workers
+        subsets = [cells[w::args.workers] for w in range(args.workers)]
+    # Replace the records of an earlier run, a grid cell is done only if a worker of this run finishes it
+    for worker_id, subset in enumerate(subsets):
+        for cell in subset:
+            write_cell_manifest(manifest_dir, cell, {'status': 'queued', 'worker': worker_id})
+
+    processes = []
+    for worker_id, subset in enumerate(subsets):
+        if not subset:
+            continue
+        command = [args.blender, '--background']
+        if args.blend_file is not None:
+            command.append(args.blend_file)
+        command += ['--python', args.script, '--',
+                    '--area_name', args.area_name,
+                    '--x_min', str(args.x_min), '--x_max', str(args.x_max),
+                    '--y_min', str(args.y_min), '--y_max', str(args.y_max),
+                    '--k', str(args.k), '--grid_size', str(args.grid_size),
+                    '--d_file_path', args.d_file_path, '--scene_name', args.scene_name,
+                    '--worker_id', str(worker_id)] + list(worker_options) + ['--cells'] + subset
+        log_file = open(os.path.join(log_dir, f'worker_{worker_id}.log'), 'w')
+        print(f'Worker {worker_id}: {len(subset)} grid cells, log in {log_file.name}')
+        processes.append((worker_id, subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT), log_file))
+
+    for worker_id, process, log_file in processes:
+        returncode = process.wait()
+        log_file.close()
+        if returncode != 0:
+            print(f'Worker {worker_id} exited with code {returncode}')
+
+    manifest = read_manifest(manifest_dir)
+    not_done = [cell for cell in cells if manifest.get(cell, {}).get('status') != 'done']
+    if not_done:
+        print(f'{len(not_done)} grid cells are not done: {not_done}. Rerun with --resume to export them.')
+    return not_done
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(f'Export the grid cells of an area with several headless Blender instances')
+    parser.add_argument('--area_name', type=str, default='Vienna_Model_22', help='Name of the area')
+    parser.add_argument('--x_min', type=float, default=16.3157, help='Minimum longitude')
+    parser.add_argument('--x_max', type=float, default=16.4362, help='Maximum longitude')
+    parser.add_argument('--y_min', type=float, default=48.1663, help='Minimum latitude')
+    parser.add_argument('--y_max', type=float, default=48.2275, help='Maximum latitude')
+    parser.add_argument('--k', type=int, default=2, help='Number of sub-areas (bizirks) to divide the area into kxk sub-areas')
+    parser.add_argument('--grid_size', type=int, default=2, help='Number of grid cells to divide each sub-area into grid_size x grid_size grid cells.')
+    parser.add_argument('--d_file_path', type=str, default=None, help='Path to the folder where the stl files will be saved. If None, then default is Desktop/Results.')
+    parser.add_argument('--scene_name', type=str, default='Scene', help='Name of the scene in blender. Default is Scene')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of Blender instances running in parallel. Default is the number of cores.')
+    parser.add_argument('--blender', type=str, default='blender', help='Path to the Blender executable')
+    parser.add_argument('--blend_file', type=str, default=None, help='Blend file opened by each worker (e.g. with the blosm add-on settings). Default is the startup file.')
+    parser.add_argument('--script', type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mcgosmhelperblend.py'), help='Script run by each worker. Default is mcgosmhelperblend.py next to this file.')
+    parser.add_argument('--resume', action='store_true', help='Skip the grid cells marked as done (with the same coordinates) in d_file_path/area_name/manifest')
+    parser.add_argument('--help_options', action='store_true', help='Print options')
+    # Parse the arguments, the unknown ones are passed to the workers (e.g. --stl_writer numpy)
+    args, worker_options = parser.parse_known_args()
+    # Print the available options if requested
+    if args.help_options:
+        parser.print_help()
+        sys.exit()
+    start_time = time.time()
+    not_done = run_parallel_export(args, worker_options)
+    print("--- %s minutes ---" % ((time.time() - start_time)/60))
+    sys.exit(1 if not_done else 0)
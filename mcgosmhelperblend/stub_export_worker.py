@@ -0,0 +1,72 @@
+# MIT License
+
+# Copyright (c) 2023 MCG - Artan Salihu
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Stand-in for mcgosmhelperblend.py without Blender and blosm, passed as --script of mcgosmhelperblend_parallel.py
+by check_parallel_export.py. It takes the worker options of mcgosmhelperblend.py, writes the same manifest records
+('running', then 'done') for its grid cells and, instead of the blosm import and the DAE/STL export, appends
+"<grid cell> <worker id> <pid>" to d_file_path/area_name/exports.log. With --crash_cell, the worker exits without
+any clean-up when it starts that grid cell, like a Blender instance that crashes during the export.
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from mcgosmhelperblend_parallel import grid_cell_bboxes, write_cell_manifest, is_cell_done
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Stand-in for the mcgosmhelperblend.py worker')
+    parser.add_argument('--area_name', type=str, required=True)
+    parser.add_argument('--x_min', type=float, required=True)
+    parser.add_argument('--x_max', type=float, required=True)
+    parser.add_argument('--y_min', type=float, required=True)
+    parser.add_argument('--y_max', type=float, required=True)
+    parser.add_argument('--k', type=int, required=True)
+    parser.add_argument('--grid_size', type=int, required=True)
+    parser.add_argument('--d_file_path', type=str, required=True)
+    parser.add_argument('--scene_name', type=str, default='Scene')
+    parser.add_argument('--worker_id', type=int, default=0)
+    parser.add_argument('--cells', nargs='+', type=str, default=None)
+    parser.add_argument('--resume', action='store_true')
+    parser.add_argument('--crash_cell', type=str, default=None, help='Exit without clean-up when this grid cell starts')
+    # Options after "--" as in blender --background --python stub_export_worker.py -- [options]
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else sys.argv[1:]
+    args = parser.parse_args(argv)
+
+    area_dir = os.path.join(args.d_file_path, args.area_name)
+    manifest_dir = os.path.join(area_dir, 'manifest')
+    os.makedirs(manifest_dir, exist_ok=True)
+    bboxes = grid_cell_bboxes(args.x_min, args.y_min, args.x_max, args.y_max, args.k, args.grid_size)
+    for cell_name, bbox in bboxes.items():
+        if args.cells is not None and cell_name not in args.cells:
+            continue
+        if args.resume and is_cell_done(manifest_dir, cell_name, bbox):
+            continue
+        write_cell_manifest(manifest_dir, cell_name, {'status': 'running', 'worker': args.worker_id})
+        with open(os.path.join(area_dir, 'exports.log'), 'a') as fp:
+            fp.write(f'{cell_name} {args.worker_id} {os.getpid()}\n')
+        if cell_name == args.crash_cell:
+            os._exit(1)
+        write_cell_manifest(manifest_dir, cell_name, {'status': 'done', 'bbox': bbox, 'worker': args.worker_id})
@@ -0,0 +1,101 @@
+"""
+Import-time benchmark of the mcgosmhelpernxx CLI.
+
+Runs python -X importtime for the modules of the CLI in fresh interpreters and reports the cumulative import time
+of each module, its slowest imports and the heavy dependencies (matplotlib, scipy, osmnx, ...) it loads.
+It also times "python main.py --help_options". With --check, it exits with 1 if a heavy dependency is loaded
+by main.py or the startup is slower than the budget, so it can guard CLI startup regressions, e.g.
+    python bench_import_time.py --check --budget_ms 500
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+# Dependencies that must only be imported in the functions that use them
+HEAVY_MODULES = ('matplotlib', 'scipy', 'osmnx', 'shapely', 'requests', 'geopandas', 'pandas', 'networkx')
+
+# Modules of the CLI, main.py must not load any of the HEAVY_MODULES
+MODULES = ('main', 'retrieve_geo_data', 'mcgosm_modules', 'mcgosm_pipeline')
+
+
+def import_times(module, python=sys.executable):
+    """
+    Imports a module in a fresh interpreter with -X importtime.
+
+    Args:
+        module (str): The name of the module, imported from the folder of this script.
+        python (str): The Python executable (default: the current one).
+
+    Returns:
+        A list of (name, self_us, cumulative_us) tuples of all imported modules, in import order.
+    """
+    result = subprocess.run([python, '-X', 'importtime', '-c', f'import {module}'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f'import {module} failed:\n{result.stderr}')
+    times = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times.append((name.strip(), int(self_us), int(cumulative_us)))
+    return times
+
+
+def cli_startup_seconds(repeat=3, python=sys.executable):
+    """
+    Returns the best wall time in seconds of "python main.py --help_options" over repeat runs.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        subprocess.run([python, 'main.py', '--help_options'], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, check=True)
+        best = min(best, time.perf_counter() - start_time)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Benchmark the import time of the mcgosmhelpernxx CLI')
+    parser.add_argument('--modules', nargs='+', default=list(MODULES), help='Modules to benchmark')
+    parser.add_argument('--top', type=int, default=5, help='Number of slowest imports shown per module')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs of main.py --help_options (the best is reported)')
+    parser.add_argument('--budget_ms', type=float, default=500., help='Maximum wall time of main.py --help_options in ms (with --check)')
+    parser.add_argument('--check', action='store_true', help='Exit with 1 if main.py imports a heavy dependency or the startup exceeds the budget')
+    parser.add_argument('--help_options', action='store_true', help='Print options')
+    args = parser.parse_args()
+    if args.help_options:
+        parser.print_help()
+        sys.exit()
+
+    failures = []
+    for module in args.modules:
+        try:
+            times = import_times(module)
+        except RuntimeError as e:
+            # A missing optional dependency should not hide the results of the other modules
+            print(e)
+            failures.append(f'import {module} failed')
+            continue
+        own = [t for t in times if t[0] == module]
+        total_ms = own[-1][2] / 1000 if own else sum(t[1] for t in times) / 1000
+        heavy = sorted({name.split('.')[0] for name, _, _ in times if name.split('.')[0] in HEAVY_MODULES})
+        print(f'{module}: {total_ms:.1f} ms, {len(times)} modules, heavy: {", ".join(heavy) or "none"}')
+        for name, self_us, cumulative_us in sorted((t for t in times if t[0] != module), key=lambda t: t[2], reverse=True)[:args.top]:
+            print(f'    {cumulative_us / 1000:8.1f} ms  {name}')
+        if module == 'main' and heavy:
+            failures.append(f'main imports {", ".join(heavy)}')
+
+    startup_ms = cli_startup_seconds(args.repeat) * 1000
+    print(f'main.py --help_options: {startup_ms:.0f} ms (budget {args.budget_ms:.0f} ms)')
+    if startup_ms > args.budget_ms:
+        failures.append(f'CLI startup {startup_ms:.0f} ms exceeds the budget of {args.budget_ms:.0f} ms')
+
+    if failures:
+        print('Regressions: ' + '; '.join(failures))
+        if args.check:
+            sys.exit(1)
@@ -0,0 +1,76 @@
+"""
+Check that the copies of mcginstrument.py in the other tools have the same code as this folder's one.
+
+Each tool runs from its own folder (mcgosmhelperblend from Blender, mcgremcomris as plain scripts), so the
+instrumentation is copied instead of imported. The copies may only differ in the license header and the module
+docstring; the check compares the code after the module docstring and prints the differences, e.g.
+    python check_instrument_copies.py
+"""
+
+import argparse
+import ast
+import difflib
+import os
+import sys
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SOURCE = os.path.join(HERE, 'mcginstrument.py')
+
+COPIES = (os.path.join(HERE, '..', 'mcgosmhelperblend', 'mcginstrument.py'),
+          os.path.join(HERE, '..', 'mcgremcomris', 'MCGInstrument.py'))
+
+
+def code_lines(filename):
+    """
+    Reads the lines of a module after its docstring.
+
+    Args:
+        filename (str): The path to the module.
+
+    Returns:
+        A list of the lines after the module docstring (all lines if it has none).
+    """
+    with open(filename, 'r', encoding='utf-8') as f:
+        source = f.read()
+    body = ast.parse(source).body
+    lines = source.splitlines(keepends=True)
+    if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant) and isinstance(body[0].value.value, str):
+        return lines[body[0].end_lineno:]
+    return lines
+
+
+def check_copies(source=SOURCE, copies=COPIES):
+    """
+    Compares the code of the copies with the source.
+
+    Returns:
+        A list of the copies that differ (empty if all are identical), the differences are printed.
+    """
+    expected = code_lines(source)
+    failures = []
+    for copy in copies:
+        if not os.path.exists(copy):
+            failures.append(f'{os.path.normpath(copy)} is missing')
+            continue
+        diff = list(difflib.unified_diff(expected, code_lines(copy), os.path.normpath(source), os.path.normpath(copy)))
+        if diff:
+            sys.stdout.writelines(diff)
+            failures.append(f'{os.path.normpath(copy)} differs from {os.path.normpath(source)}')
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Check that the copies of mcginstrument.py have the same code')
+    parser.add_argument('--help_options', action='store_true', help='Print options')
+    args = parser.parse_args()
+    if args.help_options:
+        parser.print_help()
+        sys.exit()
+
+    failures = check_copies()
+    if failures:
+        print('Failed: ' + '; '.join(failures))
+        sys.exit(1)
+    print(f'The {len(COPIES)} copies of mcginstrument.py have the same code')
@@ -0,0 +1,199 @@
+"""
+Check of the split/retry path of download_osm_map against a local stand-in of the OSM API.
+
+The stand-in serves /api/0.6/map?bbox=west,south,east,north from a synthetic map (a grid of nodes and one way per row
+of the grid that crosses the whole area) and, like the OSM API, answers 400 if the bounding box is larger than
+--max_area. It returns the nodes in the bounding box plus the ways that use one of them with all their nodes, so the
+parts of a split download overlap. With --flaky n, it answers the first n requests of every bounding box with
+429 (Retry-After: 0) or 503, like a busy OSM API. The check downloads the whole area with the session of
+get_osm_session and verifies that the merged file has every node and way exactly once, that the parts were removed,
+that the 429/503 answers are retried until the download succeeds (and raise once the retries are used up), and that
+a failing part (403 for a "forbidden" quarter, or a split depth that is not enough) raises and leaves no part
+files behind, e.g.
+    python check_osm_download.py --max_area 0.0004
+"""
+
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from mcgosm_modules import download_osm_map, get_osm_session
+
+
+class StandInOSMHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of the stand-in OSM API. The map and the limits are attributes of the server:
+    nodes ({id: (lon, lat)}), ways ({id: [node ids]}), max_area, forbidden (a (lon, lat) point, bounding boxes
+    containing it get a 403) and flaky (the number of 429/503 answers to each bounding box before it is served).
+    """
+    def do_GET(self):
+        query = urlparse(self.path)
+        if query.path != '/api/0.6/map' or 'bbox' not in parse_qs(query.query):
+            self.respond(404, 'Not found')
+            return
+        west, south, east, north = (float(value) for value in parse_qs(query.query)['bbox'][0].split(','))
+        self.server.requests.append((west, south, east, north))
+        attempt = self.server.requests.count((west, south, east, north))
+        if attempt <= self.server.flaky:
+            # Alternate "too many requests" (with a Retry-After header) and "service unavailable"
+            if attempt % 2:
+                self.respond(429, 'Too many requests', headers={'Retry-After': '0'})
+            else:
+                self.respond(503, 'Service unavailable')
+            return
+        if (east - west) * (north - south) > self.server.max_area:
+            self.respond(400, 'The maximum bbox size is %s, and your request was too large.' % self.server.max_area)
+            return
+        forbidden = self.server.forbidden
+        if forbidden is not None and west <= forbidden[0] <= east and south <= forbidden[1] <= north:
+            self.respond(403, 'Forbidden')
+            return
+        inside = {node_id for node_id, (lon, lat) in self.server.nodes.items() if west <= lon <= east and south <= lat <= north}
+        ways = {way_id: node_ids for way_id, node_ids in self.server.ways.items() if inside.intersection(node_ids)}
+        node_ids = inside.union(*ways.values()) if ways else inside
+        lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<osm version="0.6" generator="stand-in">',
+                 f' <bounds minlat="{south}" minlon="{west}" maxlat="{north}" maxlon="{east}"/>']
+        lines += [f' <node id="{node_id}" lon="{self.server.nodes[node_id][0]}" lat="{self.server.nodes[node_id][1]}"/>' for node_id in sorted(node_ids)]
+        for way_id, way_nodes in sorted(ways.items()):
+            lines.append(f' <way id="{way_id}">' + ''.join(f'<nd ref="{node_id}"/>' for node_id in way_nodes) + '<tag k="highway" v="residential"/></way>')
+        lines.append('</osm>')
+        self.respond(200, '\n'.join(lines) + '\n', 'text/xml')
+
+    def respond(self, status, body, content_type='text/plain', headers=None):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stand_in(bbox, grid=20, max_area=4e-4, forbidden=None, flaky=0):
+    """
+    Starts the stand-in OSM API on a free local port in a background thread.
+
+    Args:
+        bbox (tuple): The (west, south, east, north) of the synthetic map.
+        grid (int): The number of nodes per row and column of the map (default: 20)
+        max_area (float): The largest bounding box area in square degrees that is not rejected with 400 (default: 4e-4)
+        forbidden (tuple): A (lon, lat) point, bounding boxes containing it are answered with 403 (default: None)
+        flaky (int): The number of 429/503 answers to each bounding box before it is served (default: 0)
+
+    Returns:
+        The server (call shutdown() when done) and the URL of its map endpoint.
+    """
+    west, south, east, north = bbox
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInOSMHandler)
+    # Nodes in the middle of the grid cells, so no node is on the border of two parts
+    server.nodes = {1 + i * grid + j: (round(west + (j + 0.5) * (east - west) / grid, 7), round(south + (i + 0.5) * (north - south) / grid, 7))
+                    for i in range(grid) for j in range(grid)}
+    server.ways = {1 + i: [1 + i * grid + j for j in range(grid)] for i in range(grid)}
+    server.max_area = max_area
+    server.forbidden = forbidden
+    server.flaky = flaky
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/api/0.6/map'
+
+
+def check_split_download(bbox, grid=20, max_area=4e-4, max_split_depth=4, flaky=0, max_retries=5):
+    """
+    Downloads the area from the stand-in and checks the merged file and the removal of the parts.
+    With flaky > 0, also checks that every bounding box was retried until it was served.
+
+    Returns:
+        A list of the failed checks (empty if the download is correct).
+    """
+    failures = []
+    server, url = start_stand_in(bbox, grid=grid, max_area=max_area, flaky=flaky)
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'map.osm')
+            download_osm_map(*bbox, filename, session=get_osm_session(max_retries=max_retries, backoff_factor=0.01), url=url, max_split_depth=max_split_depth)
+            root = ET.parse(filename).getroot()
+            node_ids = [int(node.get('id')) for node in root.iter('node')]
+            way_ids = [int(way.get('id')) for way in root.iter('way')]
+            print(f'{len(server.requests)} requests, {len(node_ids)} nodes, {len(way_ids)} ways in {filename}')
+            if sorted(node_ids) != sorted(server.nodes):
+                failures.append(f'merged file has {len(node_ids)} nodes ({len(set(node_ids))} unique), expected {len(server.nodes)}')
+            if sorted(way_ids) != sorted(server.ways):
+                failures.append(f'merged file has {len(way_ids)} ways ({len(set(way_ids))} unique), expected {len(server.ways)}')
+            for way in root.iter('way'):
+                if [int(nd.get('ref')) for nd in way.iter('nd')] != server.ways[int(way.get('id'))]:
+                    failures.append(f'way {way.get("id")} has wrong nodes')
+            if len(set(server.requests)) == 1:
+                failures.append('the area was not split, lower --max_area')
+            attempts = {request: server.requests.count(request) for request in server.requests}
+            if any(n != flaky + 1 for n in attempts.values()):
+                failures.append(f'bounding boxes requested {sorted(set(attempts.values()))} times, expected {flaky + 1} (flaky={flaky})')
+            if glob.glob(filename + '.*.part'):
+                failures.append('part files left after the download')
+    finally:
+        server.shutdown()
+    return failures
+
+
+def check_failed_download(bbox, grid=20, max_area=4e-4, max_split_depth=4, flaky=2):
+    """
+    Checks that a failing part (403), a split depth that is not enough and 429/503 answers beyond the retries of the
+    session raise an error and leave no part files.
+
+    Returns:
+        A list of the failed checks.
+    """
+    import requests
+
+    failures = []
+    west, south, east, north = bbox
+    # The last quarter fails, after the parts of the other quarters were written
+    cases = (((east - (east - west) / 8, north - (north - south) / 8), max_split_depth, 0, 5), (None, 0, 0, 5),
+             (None, max_split_depth, flaky + 1, flaky))
+    for forbidden, depth, flaky_answers, max_retries in cases:
+        server, url = start_stand_in(bbox, grid=grid, max_area=max_area, forbidden=forbidden, flaky=flaky_answers)
+        case = f'forbidden={forbidden}, max_split_depth={depth}, flaky={flaky_answers}, max_retries={max_retries}'
+        try:
+            with tempfile.TemporaryDirectory() as folder:
+                filename = os.path.join(folder, 'map.osm')
+                try:
+                    download_osm_map(*bbox, filename, session=get_osm_session(max_retries=max_retries, backoff_factor=0.01), url=url, max_split_depth=depth)
+                    failures.append(f'no error with {case}')
+                except requests.HTTPError as e:
+                    print(f'{case}: {e}')
+                if glob.glob(filename + '.*.part'):
+                    failures.append(f'part files left after the error with {case}')
+        finally:
+            server.shutdown()
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Check the split/retry path of download_osm_map against a local stand-in of the OSM API')
+    parser.add_argument('--bbox', nargs=4, type=float, default=[16.36, 48.20, 16.40, 48.22], help='west south east north of the area')
+    parser.add_argument('--grid', type=int, default=20, help='Number of nodes per row and column of the synthetic map')
+    parser.add_argument('--max_area', type=float, default=2e-4, help='Largest bbox area in square degrees the stand-in accepts')
+    parser.add_argument('--max_split_depth', type=int, default=4, help='max_split_depth of download_osm_map')
+    parser.add_argument('--flaky', type=int, default=2, help='Number of 429/503 answers to each bounding box before it is served')
+    parser.add_argument('--help_options', action='store_true', help='Print options')
+    args = parser.parse_args()
+    if args.help_options:
+        parser.print_help()
+        sys.exit()
+
+    failures = check_split_download(tuple(args.bbox), args.grid, args.max_area, args.max_split_depth)
+    failures += check_split_download(tuple(args.bbox), args.grid, args.max_area, args.max_split_depth, flaky=args.flaky, max_retries=args.flaky + 1)
+    failures += check_failed_download(tuple(args.bbox), args.grid, args.max_area, args.max_split_depth, flaky=args.flaky)
+    if failures:
+        print('Failed: ' + '; '.join(failures))
+        sys.exit(1)
+    print('Split download, retries, merge and clean-up are correct')
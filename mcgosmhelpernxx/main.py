@@ -1,7 +1,6 @@
 import argparse
 import sys
 import time
-from retrieve_geo_data import retrieve_geo_data
 
 def main():
     parser = argparse.ArgumentParser(f'Retrieve a grid of sub-areas and base stations in the area')
@@ -16,6 +15,14 @@ def main():
     parser.add_argument('--read_bs_from_file', type=bool, default=False, help='Read the BS coordinates from a JSON file')
     parser.add_argument('--num_points_per_grid_cell', type=int, default=2, help='Number of points per grid cell.')
     parser.add_argument('--num_bs_per_area', type=int, default=1, help='Number of base stations per area')
+    parser.add_argument('--bs_min_spacing', type=float, default=0., help='Minimum distance (in degrees) between random base stations in a sub-area. 0 means no minimum distance.')
+    parser.add_argument('--resume', action='store_true', help='Skip the grid cells completed in a previous run (see Results/area_name/manifest.json)')
+    parser.add_argument('--workers', type=int, default=0, help='Number of worker processes for processing and writing the grid cells. 0 processes the grid cells one after the other in a single process.')
+    parser.add_argument('--fetch_workers', type=int, default=2, help='Number of worker processes fetching the grid cells from OSM (only used with --workers > 0)')
+    parser.add_argument('--queue_size', type=int, default=4, help='Maximum number of grid cells waiting between two pipeline stages (only used with --workers > 0)')
+    parser.add_argument('--metrics', type=str, default=None, help='Write per-stage timings (download, extrude, plot, write) as JSON lines to this file')
+    parser.add_argument('--profile', action='store_true', help='With --metrics, also profile with cProfile (saved next to the metrics file)')
+    parser.add_argument('--trace_memory', action='store_true', help='With --metrics, also record the peak memory of each stage with tracemalloc')
     parser.add_argument('--help_options', action='store_true', help='Print options')
     # Parse the arguments
     args = parser.parse_args()
@@ -26,9 +33,15 @@ def main():
     # if args.verbose:
     #     print("Verbose enabled")
     # Run the main function with the arguments    
+    # Imported here, so that --help_options does not load numpy, osmnx, ...
+    from retrieve_geo_data import retrieve_geo_data
+    import mcginstrument
+    mcginstrument.configure(args.metrics, profile=args.profile, trace_memory=args.trace_memory)
     start_time = time.time()
-    retrieve_geo_data(args)
+    with mcginstrument.stage('retrieve_geo_data', area_name=args.area_name):
+        retrieve_geo_data(args)
     print("--- %s minutes ---" % ((time.time() - start_time)/60))    
+    mcginstrument.close()
 
 
 if __name__ == '__main__':
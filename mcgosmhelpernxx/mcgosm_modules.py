@@ -1,17 +1,20 @@
 """
 mcgosm functions.
+
+matplotlib, scipy and requests are imported in the functions that use them, so importing this module
+(and starting the CLI) stays fast.
 """
 
-import matplotlib.pyplot as plt
-from scipy.spatial import Voronoi, voronoi_plot_2d
 import numpy as np
 import json
 import os
 import xml.etree.ElementTree as ET
-import requests
+from xml.sax.saxutils import quoteattr
 import time
 import math
 
+from mcginstrument import stage, count
+
 
 def divide_area_into_grid(x_min, y_min, x_max, y_max, k, plot=False):
     """
@@ -44,6 +47,7 @@ def divide_area_into_grid(x_min, y_min, x_max, y_max, k, plot=False):
     
     # Plot the squares
     if plot:
+        import matplotlib.pyplot as plt
         for square in squares:
             x_start, y_start, x_end, y_end = square
             plt.plot([x_start, x_end, x_end, x_start, x_start], [y_start, y_start, y_end, y_end, y_start])
@@ -56,9 +60,11 @@ def divide_area_into_grid(x_min, y_min, x_max, y_max, k, plot=False):
     return squares
 
 
-def divide_area_into_voronoi_cells(x_min, y_min, x_max, y_max, points=None, k=None, plot=False):
+def divide_area_into_voronoi_cells(x_min, y_min, x_max, y_max, points=None, k=None, plot=False, bounded=False):
     """
     Divides the rectangular area defined by the given coordinates into arbitrary non-overlapping voronoi cells.
+    With bounded=True the cells are clipped to the area (see bounded_voronoi_cells), so that there is exactly
+    one finite cell per point, in the same order as the points.
 
     Args:
         x_min (float): The minimum x-coordinate of the rectangular area.
@@ -68,6 +74,7 @@ def divide_area_into_voronoi_cells(x_min, y_min, x_max, y_max, points=None, k=No
         points (list): A list of tuples representing the points as (x, y) coordinates.
         k (int): The number of points to generate if points are not given.
         plot(bool): Whether to plot the voronoi cells or not (default: False)
+        bounded(bool): Whether to clip the voronoi cells to the area or not (default: False)
 
     Returns:
         A list of lists representing the voronoi cells as a list of (x, y) coordinates.
@@ -77,6 +84,21 @@ def divide_area_into_voronoi_cells(x_min, y_min, x_max, y_max, points=None, k=No
     if points is None:
         points = generate_random_points_in_area(x_min, y_min, x_max, y_max, k)
 
+    if plot:
+        import matplotlib.pyplot as plt
+
+    if bounded:
+        voronoi_cells = bounded_voronoi_cells(x_min, y_min, x_max, y_max, points)
+        if plot:
+            for i, cell in enumerate(voronoi_cells):
+                plt.fill(cell[:, 0], cell[:, 1], fill=False)
+                plt.plot(points[i][0], points[i][1], 'ko')
+                plt.text(points[i][0], points[i][1], i)
+            plt.show()
+        return voronoi_cells
+
+    from scipy.spatial import Voronoi, voronoi_plot_2d
+
     # Create the voronoi diagram
     vor = Voronoi(points)
 
@@ -103,6 +125,69 @@ def divide_area_into_voronoi_cells(x_min, y_min, x_max, y_max, points=None, k=No
     return voronoi_cells
 
 
+def bounded_voronoi_cells(x_min, y_min, x_max, y_max, points):
+    """
+    Computes the voronoi cells of the points clipped to the rectangular area.
+    The points are mirrored on the four sides of the area, so that the voronoi edges between
+    the points and their mirror images lie exactly on the sides and all the cells of the
+    original points are finite and inside the area.
+
+    Args:
+        x_min (float): The minimum x-coordinate of the rectangular area.
+        y_min (float): The minimum y-coordinate of the rectangular area.
+        x_max (float): The maximum x-coordinate of the rectangular area.
+        y_max (float): The maximum y-coordinate of the rectangular area.
+        points (list): A list of tuples representing the points as (x, y) coordinates. All points must be inside the area.
+
+    Returns:
+        A list of arrays with the (x, y) coordinates of the vertices of each cell (counter-clockwise), one per point.
+    """
+    from scipy.spatial import Voronoi
+
+    points = np.asarray(points, dtype=float)
+    if np.any((points[:, 0] < x_min) | (points[:, 0] > x_max) | (points[:, 1] < y_min) | (points[:, 1] > y_max)):
+        raise ValueError('All points must be inside the area to compute bounded voronoi cells')
+
+    # Mirror the points on the left, right, bottom and top sides of the area
+    left, right, bottom, top = points.copy(), points.copy(), points.copy(), points.copy()
+    left[:, 0] = 2 * x_min - points[:, 0]
+    right[:, 0] = 2 * x_max - points[:, 0]
+    bottom[:, 1] = 2 * y_min - points[:, 1]
+    top[:, 1] = 2 * y_max - points[:, 1]
+    vor = Voronoi(np.vstack((points, left, right, bottom, top)))
+
+    voronoi_cells = []
+    for region_index in vor.point_region[:len(points)]:
+        vertices = vor.vertices[vor.regions[region_index]]
+        # Order the vertices around the center (the cells are convex) and remove round-off outside the area
+        center = vertices.mean(axis=0)
+        order = np.argsort(np.arctan2(vertices[:, 1] - center[1], vertices[:, 0] - center[0]))
+        voronoi_cells.append(np.clip(vertices[order], (x_min, y_min), (x_max, y_max)))
+
+    return voronoi_cells
+
+
+def assign_points_to_voronoi_cells(query_points, points, workers=-1):
+    """
+    Assigns each query point (e.g. UE positions) to the voronoi cell of its nearest point (e.g. serving BS).
+    This is the same as a point-in-polygon test against the voronoi cells, but it is a single
+    vectorized nearest neighbour query with a KD-tree, also for millions of query points.
+
+    Args:
+        query_points (array): An array of shape (N, 2) with the (x, y) coordinates of the query points.
+        points (list): A list of tuples representing the points (voronoi cell centers) as (x, y) coordinates.
+        workers (int): The number of threads for the query, -1 uses all cores (default: -1).
+
+    Returns:
+        A tuple (indices, distances) with the index of the voronoi cell and the distance to its point for each query point.
+    """
+    from scipy.spatial import cKDTree
+
+    tree = cKDTree(np.asarray(points, dtype=float))
+    distances, indices = tree.query(np.asarray(query_points, dtype=float), k=1, workers=workers)
+    return indices, distances
+
+
 def generate_random_points_in_area(x_min, y_min, x_max, y_max, k):
     """
     Generates K random points within the rectangular area defined by the four points a, b, c, and d.
@@ -157,10 +242,50 @@ def is_point_in_areas(point, areas):
     return False
 
 
+# The OSM API endpoint returning the map data of a bounding box
+OSM_API_URL = "https://api.openstreetmap.org/api/0.6/map"
+
+# The sessions shared by all downloads, one per (max_retries, backoff_factor, pool_maxsize) (created on first use)
+_osm_sessions = {}
+
+
+def get_osm_session(max_retries=5, backoff_factor=1., pool_maxsize=10):
+    """
+    Returns a requests session with a pool of keep-alive connections that retries failed requests
+    (connection errors and 429/500/502/503/504 responses) with exponential backoff.
+    The session is created on the first call with these parameters and reused by all later calls with the same ones.
+
+    Args:
+        max_retries (int): The maximum number of retries per request (default: 5)
+        backoff_factor (float): The backoff factor in seconds, the n-th retry waits backoff_factor * 2^(n-1) (default: 1.)
+        pool_maxsize (int): The maximum number of connections kept alive per host (default: 10)
+
+    Returns:
+        A requests.Session.
+    """
+    key = (max_retries, backoff_factor, pool_maxsize)
+    if key not in _osm_sessions:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(total=max_retries, backoff_factor=backoff_factor, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset(['GET']), respect_retry_after_header=True, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _osm_sessions[key] = session
+    return _osm_sessions[key]
+
+
 # Define a function that downloads osm map based on x_min, x_max, y_min, y_max
-def download_osm_map(x_min, y_min, x_max, y_max, filename):
+def download_osm_map(x_min, y_min, x_max, y_max, filename, session=None, url=OSM_API_URL, timeout=(10, 300), chunk_size=1 << 16, max_split_depth=4):
     """
     Downloads an OSM map based on the given coordinates.
+    The response is streamed to the file in chunks, so the memory does not grow with the size of the area.
+    If the OSM API rejects the area as too large (HTTP 400, too many nodes or bbox too large), the area is
+    split into four quarters which are downloaded separately and merged into a single file.
 
     Args:
         x_min (float): The minimum x-coordinate of the rectangular area.
@@ -168,14 +293,207 @@ def download_osm_map(x_min, y_min, x_max, y_max, filename):
         x_max (float): The maximum x-coordinate of the rectangular area.
         y_max (float): The maximum y-coordinate of the rectangular area.
         filename (str): The name of the file to save the map to.
+        session (requests.Session): The session used for the requests (default: the session of get_osm_session)
+        url (str): The URL of the OSM API map endpoint (default: OSM_API_URL)
+        timeout (tuple): The connect and read timeouts in seconds (default: (10, 300))
+        chunk_size (int): The size in bytes of the chunks written to the file (default: 65536)
+        max_split_depth (int): How many times the area may be split into quarters (default: 4)
+
+    Returns:
+        The name of the file.
+
+    Raises:
+        requests.HTTPError: If a part is rejected (or still too large after max_split_depth splits). The part files
+            written so far are removed.
+    """
+    if session is None:
+        session = get_osm_session()
+
+    part_files = []
+    try:
+        with stage('download', area=[x_min, y_min, x_max, y_max]):
+            _download_osm_parts(session, url, (x_min, y_min, x_max, y_max), filename, '0', timeout, chunk_size, max_split_depth, part_files)
+        if len(part_files) == 1:
+            os.replace(part_files[0], filename)
+        else:
+            print(f'Merging {len(part_files)} parts into {filename}')
+            with stage('merge', parts=len(part_files)):
+                merge_osm_files(part_files, filename)
+    finally:
+        for part_file in part_files:
+            if os.path.exists(part_file):
+                os.remove(part_file)
+    return filename
+
+
+def _download_osm_parts(session, url, bbox, filename, part_id, timeout, chunk_size, max_split_depth, part_files=None):
     """
+    Downloads the map data of the bounding box to a filename.part_id.part file, splitting the bounding box
+    into quarters while the OSM API rejects it. The part files are appended to part_files (before they are
+    written, so the caller can remove them if a download fails) and returned.
+    """
+    if part_files is None:
+        part_files = []
     # Define the bounding box coordinates for the area you want to download
-    west, south, east, north = x_min, y_min, x_max, y_max
+    west, south, east, north = bbox
+    part_file = f'{filename}.{part_id}.part'
 
     # Send a GET request to the OSM API to download the map data
-    url = f"https://api.openstreetmap.org/api/0.6/map?bbox={west},{south},{east},{north}"
-    response = requests.get(url)
+    with session.get(f"{url}?bbox={west},{south},{east},{north}", stream=True, timeout=timeout) as response:
+        if response.status_code == 400 and max_split_depth > 0:
+            print(f'OSM API rejected the area {bbox}: {response.text.strip()}. Splitting it into four parts.')
+            x_mid, y_mid = (west + east) / 2, (south + north) / 2
+            quarters = ((west, south, x_mid, y_mid), (x_mid, south, east, y_mid), (west, y_mid, x_mid, north), (x_mid, y_mid, east, north))
+            for q, quarter in enumerate(quarters):
+                _download_osm_parts(session, url, quarter, filename, part_id + str(q), timeout, chunk_size, max_split_depth - 1, part_files)
+            return part_files
+        response.raise_for_status()
+
+        # Save the map data to a file
+        part_files.append(part_file)
+        with open(part_file, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                count('osm_bytes', len(chunk))
+    return part_files
+
+
+def merge_osm_files(osm_files, filename):
+    """
+    Merges OSM XML files into one file. The nodes, ways and relations are written in this order
+    (one pass over the files each), elements present in several files are written once, and
+    the files are parsed incrementally so that only the ids of the written elements are kept in memory.
+
+    Args:
+        osm_files (list): The names of the OSM files to merge.
+        filename (str): The name of the merged OSM file.
+    """
+    bounds = None
+    root_attributes = None
+    for osm_file in osm_files:
+        for event, elem in ET.iterparse(osm_file, events=('start',)):
+            if elem.tag == 'osm':
+                root_attributes = root_attributes or dict(elem.attrib)
+            elif elem.tag == 'bounds':
+                b = [float(elem.get(key)) for key in ('minlat', 'minlon', 'maxlat', 'maxlon')]
+                bounds = b if bounds is None else [min(bounds[0], b[0]), min(bounds[1], b[1]), max(bounds[2], b[2]), max(bounds[3], b[3])]
+                break
+
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<osm' + ''.join(f' {key}={quoteattr(value)}' for key, value in (root_attributes or {}).items()) + '>\n')
+        if bounds is not None:
+            f.write(' <bounds minlat="%s" minlon="%s" maxlat="%s" maxlon="%s"/>\n' % tuple(bounds))
+        for tag in ('node', 'way', 'relation'):
+            written = set()
+            for osm_file in osm_files:
+                depth = 0
+                for event, elem in ET.iterparse(osm_file, events=('start', 'end')):
+                    if event == 'start':
+                        depth += 1
+                        if depth == 1:
+                            root = elem
+                        continue
+                    depth -= 1
+                    if depth != 1:
+                        continue
+                    if elem.tag == tag and elem.get('id') not in written:
+                        written.add(elem.get('id'))
+                        f.write(' ' + ET.tostring(elem, encoding='unicode').strip() + '\n')
+                    # Free the parsed elements
+                    root.clear()
+        f.write('</osm>\n')
+
+def load_manifest(manifest_file):
+    """
+    Loads the run manifest (per-cell status and timing) from a JSON file.
+
+    Args:
+        manifest_file (str): The path to the manifest JSON file.
+
+    Returns:
+        A dictionary with the key being the cell name (e.g. '0_3') and the value being the cell record.
+        An empty dictionary is returned if the manifest does not exist or cannot be read.
+    """
+    if not os.path.exists(manifest_file):
+        return {}
+    try:
+        with open(manifest_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # A corrupted manifest is treated as an empty one, i.e. all cells are processed again
+        return {}
+
+
+def save_manifest(manifest, manifest_file):
+    """
+    Saves the run manifest to a JSON file. The file is first written to a temporary file and then
+    replaced, so that a crash while writing never leaves a half-written manifest behind.
+
+    Args:
+        manifest (dict): The manifest dictionary as returned by load_manifest.
+        manifest_file (str): The path to the manifest JSON file.
+    """
+    tmp_file = manifest_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_file, manifest_file)
+
+
+def is_valid_geojson(filename):
+    """
+    Checks if a GeoJSON file exists and can be parsed as a FeatureCollection.
+
+    Args:
+        filename (str): The path to the GeoJSON file.
+
+    Returns:
+        True if the file exists and is a valid FeatureCollection, False otherwise.
+    """
+    if not os.path.exists(filename):
+        return False
+    try:
+        with open(filename, 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return isinstance(data, dict) and data.get('type') == 'FeatureCollection'
+
+
+def same_bbox(bbox, other, tolerance=1e-9):
+    """
+    Checks if two bounding boxes (x_min, y_min, x_max, y_max) are equal within a tolerance in degrees.
 
-    # Save the map data to a file
-    with open(filename, 'w') as f:
-        f.write(response.content.decode('utf-8'))
+    Args:
+        bbox (list): The first bounding box.
+        other (list): The second bounding box, e.g. read from a manifest (None if it is missing).
+        tolerance (float): The largest difference of a coordinate in degrees (default: 1e-9)
+
+    Returns:
+        True if all four coordinates are within the tolerance, False otherwise.
+    """
+    if other is None or len(other) != 4:
+        return False
+    return all(abs(a - b) <= tolerance for a, b in zip(bbox, other))
+
+
+def is_cell_completed(manifest, cell_name, geojson_file, bbox=None):
+    """
+    Checks if a grid cell was already completed in a previous run.
+
+    Args:
+        manifest (dict): The manifest dictionary as returned by load_manifest.
+        cell_name (str): The name of the grid cell (e.g. '0_3').
+        geojson_file (str): The path to the GeoJSON file of the grid cell.
+        bbox (list): The bounding box of the grid cell in this run. If given, a record of a grid cell with
+            another bounding box (e.g. a run with a different area or grid size) does not count as completed.
+
+    Returns:
+        True if the manifest marks the cell as done (with the same bounding box) and its GeoJSON file is valid, False otherwise.
+    """
+    record = manifest.get(cell_name)
+    if record is None or record.get('status') != 'done':
+        return False
+    if bbox is not None and not same_bbox(bbox, record.get('bbox')):
+        return False
+    return is_valid_geojson(geojson_file)
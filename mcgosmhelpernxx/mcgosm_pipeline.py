@@ -0,0 +1,252 @@
+"""
+mcgosm grid cell pipeline.
+
+The processing of a grid cell is split into three stages:
+    1. fetch: get the geometries around the center of the grid cell from OSM and project them
+    2. process: extrude the buildings to 3D polygons using the number of levels
+    3. write: save the figure and the GeoJSON file of the grid cell
+The stages can run one after the other in the same process (process_grid_cell in retrieve_geo_data.py)
+or as a producer/consumer pipeline over worker processes connected with bounded queues (run_cell_pipeline).
+"""
+
+import gc
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+
+from mcginstrument import stage as metrics_stage, close as close_metrics
+
+
+# Tags of the geometries retrieved for each grid cell
+OSM_TAGS = {'building':True, 'railway':True, 'highway':True, 'amenity':True}
+
+
+def fetch_cell_geometries(center, dist):
+    """
+    Gets the geometries of buildings, railway, highway and amenity around a point from OSM.
+
+    Args:
+        center (tuple): The center of the grid cell as (latitude, longitude).
+        dist (float): The distance in meters from the center to retrieve the geometries.
+
+    Returns:
+        A GeoDataFrame with the geometries projected to latitude-longitude.
+    """
+    import osmnx as ox
+
+    #Get geometries of buildings and railway (nodes-edges)
+    bbox = ox.utils_geo.bbox_from_point(center, dist=dist)
+    print(bbox)
+
+    # Get graph from point
+    #graph_from_point = ox.graph_from_point(center, dist=dist,retain_all=True)
+    #fig, ax = ox.plot_graph(graph_from_point, node_size=0, node_color='k', node_edgecolor='gray', node_zorder=2, edge_color='#999999', edge_linewidth=1, edge_alpha=1, bgcolor='k')
+    gdf_geometries = ox.geometries_from_point(center, OSM_TAGS, dist)
+
+    return ox.project_gdf(gdf_geometries, to_latlong=True)
+
+
+def extrude_buildings(gdf_proj):
+    """
+    Adds a height column calculated from the number of levels (3.5 m per level) and converts the
+    building polygons to 3D polygons with the height as z-coordinate.
+
+    Args:
+        gdf_proj (GeoDataFrame): The geometries of the grid cell as returned by fetch_cell_geometries.
+
+    Returns:
+        The GeoDataFrame with the extruded buildings (modified in place).
+    """
+    import shapely.geometry as sg
+
+    # Change longitude and latitude to latitute and longitude for gdf geometry type Point
+    #gdf['geometry'] = gdf['geometry'].apply(lambda x: Point(x.y, x.x))
+
+    # If building:levels is a column in the gdf_proj dataframe, then use it to calculate the height of each building
+    if "building:levels" in gdf_proj.columns:
+        # Get the number of levels for each building from the building:levels column
+        levels = gdf_proj["building:levels"]
+        # Make all levels with Nan values 0
+        levels = levels.fillna(0+1e-5)
+        # Convert levels to integers
+        levels = levels.astype(int)
+        # Add a column to gdf_proj with the height of each building calculated from the number of levels for each building * 3.5
+        gdf_proj['height'] = levels * 3.5
+        # Convert to float
+        gdf_proj['height'] = gdf_proj['height'].astype(float)
+
+        # Print the heigh of 11 buildings with the highest height
+        print(gdf_proj.sort_values(by='height', ascending=False)['height'][:11])
+        # For each building, update polygon geometry to a 3D polygon with height information
+        for i, row in gdf_proj.iterrows():
+            height = row['height']
+            if height >= 0.:
+                if row['geometry'].geom_type == 'Polygon':
+                    polygon = row['geometry']
+                    # Create a 3D polygon from the 2D polygon and the height
+                    gdf_proj.at[i, 'geometry'] = sg.Polygon([(p[0], p[1], height) for p in polygon.exterior.coords])
+
+    return gdf_proj
+
+
+def write_cell_outputs(gdf_proj, k, j, area_name):
+    """
+    Saves the figure of the grid cell in Results/area_name/grid_cells_images and the GeoJSON file
+    in Results/area_name/grid_cells_geojson.
+
+    Args:
+        gdf_proj (GeoDataFrame): The geometries of the grid cell.
+        k (int): The number of the sub-area.
+        j (int): The number of the grid cell in the sub-area.
+        area_name (str): The name of the area.
+
+    Returns:
+        None
+    """
+    import matplotlib.pyplot as plt
+    import osmnx as ox
+
+    #Save the figure to a Results/area_name and Results/area_name/grid_cells_area_name folder
+    os.makedirs('Results/' + area_name + '/grid_cells_images', exist_ok=True)
+
+    with metrics_stage('plot'):
+        #Create a figure with yellow colors on buildings
+        if "building" in gdf_proj.columns:
+            fig1, ax = ox.plot_footprints(gdf_proj, ax = None, figsize=(10, 10), color='yellow', edge_linewidth=2, bgcolor='#333333', save=False, show=False, close=False, dpi=600)
+            fig1.savefig(f'Results/' + area_name + '/grid_cells_images/' + str(k) + '_' + str(j) + '.png', dpi = 600)
+            # Close the figure
+            plt.close(fig1)
+        else:
+            # save a blank figure, with background color black
+            fig1 = plt.figure(figsize=(10, 10), facecolor='#333333')
+            fig1.savefig(f'Results/' + area_name + '/grid_cells_images/' + str(k) + '_' + str(j) + '.png', dpi = 600)
+            # Close the figure
+            plt.close(fig1)
+
+    # Save the gdf_proj dataframe to a GeoJSON file
+    os.makedirs('Results/' + area_name + '/grid_cells_geojson', exist_ok=True)
+    with metrics_stage('write'):
+        with open ('Results/' + area_name + '/grid_cells_geojson/' + str(k) + '_' + str(j) + '.geojson', 'w') as f:
+            f.write(gdf_proj.to_json())
+
+
+def _stage_worker(stage, in_queue, out_queue, result_queue, area_name, dist):
+    """
+    Runs one stage of the pipeline in a worker process until a None sentinel is received.
+    Each item is a dictionary with the cell name, k, j, center and (after the fetch stage) the GeoDataFrame.
+    The last stage reports the cell as done to the result queue, a failing stage reports the cell as failed.
+    """
+    if stage == 'write':
+        # Workers have no display
+        import matplotlib
+        matplotlib.use('Agg')
+
+    while True:
+        item = in_queue.get()
+        if item is None:
+            break
+        stage_start_time = time.time()
+        try:
+            if stage == 'fetch':
+                with metrics_stage('download', cell=item['cell_name']):
+                    item['gdf'] = fetch_cell_geometries(item['center'], dist)
+                print(f"Area {item['k']}, Grid cell {item['j']}, Point {item['center']}")
+            elif stage == 'process':
+                with metrics_stage('extrude', cell=item['cell_name']):
+                    item['gdf'] = extrude_buildings(item['gdf'])
+            else:
+                write_cell_outputs(item['gdf'], item['k'], item['j'], area_name)
+        except Exception as e:
+            result_queue.put(('failed', item['cell_name'], {'error': repr(e), stage: time.time() - stage_start_time}))
+            continue
+        finally:
+            # Do not keep the GeoDataFrame of the previous cell alive in the worker
+            gc.collect()
+        item['timings'][stage] = time.time() - stage_start_time
+        if out_queue is None:
+            result_queue.put(('done', item['cell_name'], item['timings']))
+        else:
+            out_queue.put(item)
+        del item
+    # Worker processes do not run the atexit handlers, write the metrics summary now
+    close_metrics()
+
+
+def run_cell_pipeline(cells, area_name, dist, on_result, num_workers=2, num_fetch_workers=2, queue_size=4):
+    """
+    Processes grid cells with a producer/consumer pipeline over worker processes.
+    The fetch, process and write stages run in separate worker processes connected with bounded queues,
+    so at most about queue_size GeoDataFrames are waiting between two stages and the memory stays flat
+    regardless of the number of grid cells.
+
+    Args:
+        cells (list): A list of tuples (cell_name, k, j, center) with center as (latitude, longitude).
+        area_name (str): The name of the area.
+        dist (float): The distance in meters from the center to retrieve the geometries.
+        on_result (callable): Called in the main process as on_result(status, cell_name, info) for every cell,
+            with status 'done' or 'failed' and info a dictionary with the timing per stage (and the error).
+        num_workers (int): The number of worker processes for the process and write stages (default: 2).
+        num_fetch_workers (int): The number of worker processes for the fetch stage (default: 2).
+            Keep it small to avoid the rate limit of the OSM API.
+        queue_size (int): The maximum number of cells waiting between two stages (default: 4).
+
+    Returns:
+        A list with the names of the failed grid cells.
+    """
+    ctx = mp.get_context('spawn')
+    fetch_queue = ctx.Queue(maxsize=queue_size)
+    process_queue = ctx.Queue(maxsize=queue_size)
+    write_queue = ctx.Queue(maxsize=queue_size)
+    result_queue = ctx.Queue()
+
+    stages = [
+        ('fetch', fetch_queue, process_queue, num_fetch_workers),
+        ('process', process_queue, write_queue, num_workers),
+        ('write', write_queue, None, num_workers),
+    ]
+    workers = {}
+    for stage, in_queue, out_queue, n in stages:
+        workers[stage] = [ctx.Process(target=_stage_worker, args=(stage, in_queue, out_queue, result_queue, area_name, dist), daemon=True) for _ in range(max(1, n))]
+        for worker in workers[stage]:
+            worker.start()
+
+    # Feed the cells from a thread, it blocks while the fetch queue is full
+    def feed():
+        for cell_name, k, j, center in cells:
+            fetch_queue.put({'cell_name': cell_name, 'k': k, 'j': j, 'center': center, 'timings': {}})
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+
+    failed = []
+    try:
+        remaining = len(cells)
+        while remaining > 0:
+            try:
+                status, cell_name, info = result_queue.get(timeout=5)
+            except queue.Empty:
+                # A worker killed by the OS never reports its cell
+                dead = [w for ws in workers.values() for w in ws if w.exitcode not in (None, 0)]
+                if dead:
+                    raise RuntimeError(f'{len(dead)} pipeline worker(s) died unexpectedly')
+                continue
+            if status == 'failed':
+                failed.append(cell_name)
+            on_result(status, cell_name, info)
+            remaining -= 1
+        feeder.join()
+
+        # Shut down the stages in order, each worker stops at its sentinel
+        for stage, in_queue, out_queue, n in stages:
+            for _ in workers[stage]:
+                in_queue.put(None)
+            for worker in workers[stage]:
+                worker.join()
+    finally:
+        for ws in workers.values():
+            for worker in ws:
+                if worker.is_alive():
+                    worker.terminate()
+
+    return failed
@@ -0,0 +1,200 @@
+"""
+mcgosm candidate point sampling.
+
+Generates candidate UE/BS points in a rectangular area in vectorized batches.
+Points inside building footprints are rejected with an STRtree index over the footprints and
+a minimum spacing between the points (Poisson-disk sampling) is enforced with a background grid.
+"""
+
+import json
+import math
+
+import numpy as np
+import shapely
+import shapely.geometry as sg
+from shapely.strtree import STRtree
+
+
+# Offsets of the grid cells that can hold a point closer than min_dist (grid cell size is min_dist / sqrt(2))
+_NEIGHBOUR_OFFSETS = [(di, dj) for di in range(-2, 3) for dj in range(-2, 3) if (di, dj) != (0, 0)]
+
+
+def read_building_footprints(geojson_file):
+    """
+    Reads the building footprints from a GeoJSON file of a grid cell (see Results/area_name/grid_cells_geojson).
+
+    Args:
+        geojson_file (str): The path to the GeoJSON file.
+
+    Returns:
+        A list of shapely (Multi)Polygons of the buildings.
+    """
+    with open(geojson_file, 'r') as f:
+        data = json.load(f)
+    footprints = []
+    for feature in data['features']:
+        if feature.get('properties', {}).get('building') is None:
+            continue
+        geometry = sg.shape(feature['geometry'])
+        if geometry.geom_type in ('Polygon', 'MultiPolygon'):
+            footprints.append(shapely.force_2d(geometry))
+    return footprints
+
+
+def build_footprint_index(footprints):
+    """
+    Builds a spatial index over the building footprints.
+
+    Args:
+        footprints (list): A list of shapely (Multi)Polygons, e.g. from read_building_footprints or a GeoDataFrame geometry column.
+
+    Returns:
+        An STRtree of the footprints.
+    """
+    return STRtree(np.asarray(list(footprints), dtype=object))
+
+
+def points_in_footprints(index, xy):
+    """
+    Checks which points are inside (or on the boundary of) a building footprint.
+
+    Args:
+        index (STRtree): The index of the footprints as returned by build_footprint_index.
+        xy (array): An array of shape (N, 2) with the (x, y) coordinates of the points.
+
+    Returns:
+        A boolean array of shape (N,) which is True for the points inside a footprint.
+    """
+    inside = np.zeros(len(xy), dtype=bool)
+    hits = index.query(shapely.points(xy), predicate='intersects')
+    inside[hits[0]] = True
+    return inside
+
+
+def iter_candidate_point_batches(x_min, y_min, x_max, y_max, n, footprints=None, min_dist=0., batch_size=100000, seed=None, max_attempts=30, min_yield=1e-4, max_low_yield_batches=10):
+    """
+    Generates up to n random points in the rectangular area in batches, rejecting the points inside the
+    building footprints and the points closer than min_dist to an already accepted point.
+    Without min_dist, only one batch is in memory at a time. With min_dist, the accepted points and a
+    grid with cell size min_dist / sqrt(2) (at most one point per grid cell) are kept to check the spacing
+    against the 24 neighbouring grid cells only. Once a quarter of the grid cells is occupied, the candidates
+    are drawn in the free grid cells that were not given up after max_attempts rejected candidates
+    (as in Bridson's algorithm).
+
+    Args:
+        x_min (float): The minimum x-coordinate of the rectangular area.
+        y_min (float): The minimum y-coordinate of the rectangular area.
+        x_max (float): The maximum x-coordinate of the rectangular area.
+        y_max (float): The maximum y-coordinate of the rectangular area.
+        n (int): The number of points to generate.
+        footprints (list or STRtree): The building footprints or their index (default: None)
+        min_dist (float): The minimum distance between two points in the units of the coordinates (default: 0.)
+        batch_size (int): The number of random candidates drawn per batch (default: 100000)
+        seed (int): The seed of the random generator (default: None)
+        max_attempts (int): With min_dist, a free grid cell is given up after this many rejected candidates (default: 30)
+        min_yield (float): The fraction of accepted candidates below which a batch counts as low-yield (default: 1e-4)
+        max_low_yield_batches (int): Stop after this many consecutive low-yield batches, i.e. when the
+            area is (nearly) full (default: 10)
+
+    Yields:
+        Arrays of shape (M, 2) with the accepted points of each batch.
+    """
+    rng = np.random.default_rng(seed)
+    index = footprints
+    if footprints is not None and not isinstance(footprints, STRtree):
+        index = build_footprint_index(footprints)
+
+    if min_dist > 0:
+        cell = min_dist / math.sqrt(2)
+        nx = max(1, math.ceil((x_max - x_min) / cell))
+        ny = max(1, math.ceil((y_max - y_min) / cell))
+        # The grids are padded with two cells on each side and flattened, so that the neighbours of a
+        # grid cell are at fixed offsets and need no bounds checks
+        row = ny + 4
+        offsets = np.array([di * row + dj for di, dj in _NEIGHBOUR_OFFSETS])
+        # Index of the accepted point in each grid cell and of the candidate of the current batch
+        grid = np.full((nx + 4) * row, -1, dtype=np.int64)
+        batch_grid = np.full((nx + 4) * row, -1, dtype=np.int64)
+        attempts = np.zeros((nx + 4) * row, dtype=np.int32)
+        inside = np.zeros((nx + 4, row), dtype=bool)
+        inside[2:-2, 2:-2] = True
+        inside = inside.ravel()
+        accepted = np.empty((n, 2))
+
+    count = 0
+    low_yield_batches = 0
+    while count < n and low_yield_batches < max_low_yield_batches:
+        if min_dist > 0 and count > nx * ny // 4:
+            # Most of the grid is occupied, draw the candidates in the free grid cells only
+            free_cells = np.flatnonzero(inside & (grid < 0) & (attempts < max_attempts))
+            if len(free_cells) == 0:
+                break
+            drawn = free_cells[rng.integers(len(free_cells), size=batch_size)]
+            xy = np.column_stack((x_min + (drawn // row - 2 + rng.random(batch_size)) * cell, y_min + (drawn % row - 2 + rng.random(batch_size)) * cell))
+            # The grid cells of the last row and column extend beyond the area, their candidates outside it are
+            # rejected (and count as attempts of the grid cell)
+            outside = (xy[:, 0] > x_max) | (xy[:, 1] > y_max)
+            attempts[drawn[outside]] += 1
+            xy = xy[~outside]
+        else:
+            xy = np.column_stack((rng.uniform(x_min, x_max, batch_size), rng.uniform(y_min, y_max, batch_size)))
+
+        # Reject the points inside buildings
+        if index is not None:
+            xy = xy[~points_in_footprints(index, xy)]
+
+        if min_dist > 0 and len(xy) > 0:
+            gi = np.minimum(((xy[:, 0] - x_min) / cell).astype(np.int64), nx - 1)
+            gj = np.minimum(((xy[:, 1] - y_min) / cell).astype(np.int64), ny - 1)
+            g = (gi + 2) * row + gj + 2
+
+            # Keep only the first candidate of each free grid cell
+            free = grid[g] < 0
+            xy, g = xy[free], g[free]
+            _, first = np.unique(g, return_index=True)
+            first.sort()
+            xy, g = xy[first], g[first]
+
+            # Reject the candidates too close to an accepted point or to an earlier candidate of this batch
+            batch_grid[g] = np.arange(len(xy))
+            keep = np.ones(len(xy), dtype=bool)
+            for offset in offsets:
+                neighbour = grid[g + offset]
+                rows = np.flatnonzero(neighbour >= 0)
+                too_close = np.sum((accepted[neighbour[rows]] - xy[rows]) ** 2, axis=1) < min_dist ** 2
+                keep[rows[too_close]] = False
+
+                neighbour = batch_grid[g + offset]
+                rows = np.flatnonzero((neighbour >= 0) & (neighbour < np.arange(len(xy))))
+                too_close = np.sum((xy[neighbour[rows]] - xy[rows]) ** 2, axis=1) < min_dist ** 2
+                keep[rows[too_close]] = False
+            batch_grid[g] = -1
+            rejected = g[~keep]
+            attempts[rejected] = np.minimum(attempts[rejected] + 1, max_attempts)
+            xy, g = xy[keep], g[keep]
+
+        xy = xy[:n - count]
+        if min_dist > 0 and len(xy) > 0:
+            grid[g[:len(xy)]] = np.arange(count, count + len(xy))
+            accepted[count:count + len(xy)] = xy
+        count += len(xy)
+        low_yield_batches = low_yield_batches + 1 if len(xy) < min_yield * batch_size else 0
+        if len(xy) > 0:
+            yield xy
+
+    if count < n:
+        print(f'Only {count} of {n} points could be placed in the area')
+
+
+def generate_candidate_points(x_min, y_min, x_max, y_max, n, footprints=None, min_dist=0., batch_size=100000, seed=None):
+    """
+    Generates up to n random points in the rectangular area outside the building footprints and with a
+    minimum spacing. See iter_candidate_point_batches for the arguments.
+
+    Returns:
+        An array of shape (M, 2) with the (x, y) coordinates of the points (M <= n).
+    """
+    batches = list(iter_candidate_point_batches(x_min, y_min, x_max, y_max, n, footprints=footprints, min_dist=min_dist, batch_size=batch_size, seed=seed))
+    if not batches:
+        return np.empty((0, 2))
+    return np.vstack(batches)
@@ -1,15 +1,15 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.spatial import Voronoi, voronoi_plot_2d
 import json
 import os
 import argparse
-import osmnx as ox
-import shapely.geometry as sg
 import time
 import sys
 
+# matplotlib, osmnx and shapely are imported where they are used, so that the CLI starts fast
 from mcgosm_modules import divide_area_into_grid, divide_area_into_voronoi_cells, generate_random_points_in_area, read_points_from_json, is_point_in_areas
+from mcgosm_modules import load_manifest, save_manifest, is_cell_completed
+from mcginstrument import stage, count, event
+from mcgosm_pipeline import fetch_cell_geometries, extrude_buildings, write_cell_outputs, run_cell_pipeline
 
 # Change the name of main() to retrieve_geo_data() to run the code
 
@@ -25,6 +25,9 @@ def retrieve_geo_data(args):
         2. grid_cells: The coordinates of the grid cells
         3. voronoi_cells: The coordinates of the Voronoi cells
         4. buildings: The coordinates of the buildings
+    The status and timing of every grid cell is recorded in Results/area_name/manifest.json.
+    If args.resume is True, the grid cells that are marked as done in the manifest with the same bounding box and have a valid GeoJSON file are skipped.
+    If args.workers > 0, the grid cells are processed with a multi-process pipeline (see mcgosm_pipeline.py).
 
     Args:
         args: The arguments passed to the function
@@ -68,7 +71,12 @@ def retrieve_geo_data(args):
         base_station_loca = []
         for ar in bizirk:
             x_min, y_min, x_max, y_max = ar
-            base_station_loca.extend(generate_random_points_in_area(x_min, y_min, x_max, y_max, k=args.num_bs_per_area))
+            if getattr(args, 'bs_min_spacing', 0.) > 0:
+                # Random base stations with a minimum spacing between them (Poisson-disk sampling)
+                from mcgosm_sampling import generate_candidate_points
+                base_station_loca.extend(generate_candidate_points(x_min, y_min, x_max, y_max, args.num_bs_per_area, min_dist=args.bs_min_spacing))
+            else:
+                base_station_loca.extend(generate_random_points_in_area(x_min, y_min, x_max, y_max, k=args.num_bs_per_area))
     elif read_bs_from_file:
         base_station_loca = read_points_from_json('bs_coordinates.json')
     else:
@@ -92,6 +100,7 @@ def retrieve_geo_data(args):
                 base_station_loca_dict[i].append(bs_loc)
 
     # Save a plot with areas, base stations and grid cells to a filename with the extension .png
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots()
     for i, ar in enumerate(bizirk):
         x_min, y_min, x_max, y_max = ar
@@ -137,83 +146,84 @@ def retrieve_geo_data(args):
     for k, v in grid_cells_new.items():
         print(f'"Bizirk" or sub-area {k} of {area_name} has {len(v)} grid cells')
 
+    # Load the manifest with the status of each grid cell from a previous run
+    manifest_file = 'Results/' + area_name + '/manifest.json'
+    resume = getattr(args, 'resume', False)
+    manifest = load_manifest(manifest_file) if resume else {}
+
     # For each grid cell get center coordinates and get the geometries of buildings and railway from OSM (nodes-edges)
     grid_cell_centers = {}
+    pending_cells = []
+    dist = 300
     for k, v in grid_cells_new.items():
         grid_cell_centers[k] = []
-        j = 0
-        for cell in v:
+        for j, cell in enumerate(v):
             x_min, y_min, x_max, y_max = cell
             grid_cell_centers[k].append(((y_min + y_max) / 2, (x_min + x_max) / 2))
-            dist = 300
-
-            # grid_cell_centers[k][0] in the format of (longitude, latitude)
-
-            #Get tag info on building and railway
-            tags = {'building':True, 'railway':True, 'highway':True, 'amenity':True}
-
-            #Get geometries of buildings and railway (nodes-edges)
-            bbox = ox.utils_geo.bbox_from_point(grid_cell_centers[k][j], dist=dist)
-            print(bbox)
-
-            # Get graph from point
-            #graph_from_point = ox.graph_from_point(grid_cell_centers[k][j], dist=dist,retain_all=True)
-            #fig, ax = ox.plot_graph(graph_from_point, node_size=0, node_color='k', node_edgecolor='gray', node_zorder=2, edge_color='#999999', edge_linewidth=1, edge_alpha=1, bgcolor='k')
-            gdf_geometries = ox.geometries_from_point(grid_cell_centers[k][j], tags, dist)
-
-            # Print sub-area number, grid cell number and point number
-            print(f'Area {k}, Grid cell {j}, Point {grid_cell_centers[k][j]}')
-
-            gdf_proj = ox.project_gdf(gdf_geometries, to_latlong=True)
-
-            # Change longitude and latitude to latitute and longitude for gdf geometry type Point
-            #gdf['geometry'] = gdf['geometry'].apply(lambda x: Point(x.y, x.x))
-            
-            # If building:levels is a column in the gdf_proj dataframe, then use it to calculate the height of each building
-            if "building:levels" in gdf_proj.columns:
-                # Get the number of levels for each building from the building:levels column
-                levels = gdf_proj["building:levels"]
-                # Make all levels with Nan values 0
-                levels = levels.fillna(0+1e-5)
-                # Convert levels to integers
-                levels = levels.astype(int)
-                # Add a column to gdf_proj with the height of each building calculated from the number of levels for each building * 3.5
-                gdf_proj['height'] = levels * 3.5
-                # Convert to float
-                gdf_proj['height'] = gdf_proj['height'].astype(float)
-
-                # Print the heigh of 11 buildings with the highest height
-                print(gdf_proj.sort_values(by='height', ascending=False)['height'][:11])
-                # For each building, update polygon geometry to a 3D polygon with height information
-                for i, row in gdf_proj.iterrows():
-                    height = row['height']
-                    if height >= 0.:
-                        if row['geometry'].geom_type == 'Polygon':
-                            polygon = row['geometry']
-                            # Create a 3D polygon from the 2D polygon and the height
-                            gdf_proj.at[i, 'geometry'] = sg.Polygon([(p[0], p[1], height) for p in polygon.exterior.coords])
-            
-
-            #Save the figure to a Results/area_name and Results/area_name/grid_cells_area_name folder
-            if not os.path.exists('Results/' + area_name + '/grid_cells_images'):
-                os.makedirs('Results/' + area_name + '/grid_cells_images')
-
-            #Create a figure with yellow colors on buildings
-            if "building" in gdf_proj.columns:
-                fig1, ax = ox.plot_footprints(gdf_proj, ax = None, figsize=(10, 10), color='yellow', edge_linewidth=2, bgcolor='#333333', save=False, show=False, close=False, dpi=600)
-                fig1.savefig(f'Results/' + area_name + '/grid_cells_images/' + str(k) + '_' + str(j) + '.png', dpi = 600)
-                # Close the figure  
-                plt.close(fig1)
-            else:
-                # save a blank figure, with background color black
-                fig1 = plt.figure(figsize=(10, 10), facecolor='#333333')
-                fig1.savefig(f'Results/' + area_name + '/grid_cells_images/' + str(k) + '_' + str(j) + '.png', dpi = 600)
-                # Close the figure
-                plt.close(fig1)
-
-            # Save the gdf_proj dataframe to a GeoJSON file
-            if not os.path.exists('Results/' + area_name + '/grid_cells_geojson'):
-                os.makedirs('Results/' + area_name + '/grid_cells_geojson')
-            with open ('Results/' + area_name + '/grid_cells_geojson/' + str(k) + '_' + str(j) + '.geojson', 'w') as f:
-                f.write(gdf_proj.to_json())
-            j += 1
+
+            # Skip the grid cells completed in a previous run
+            cell_name = str(k) + '_' + str(j)
+            geojson_file = 'Results/' + area_name + '/grid_cells_geojson/' + cell_name + '.geojson'
+            if resume and is_cell_completed(manifest, cell_name, geojson_file, bbox=cell):
+                print(f'Area {k}, Grid cell {j} already completed. Skipping.')
+                continue
+            manifest[cell_name] = {'status': 'pending', 'bbox': cell}
+            pending_cells.append((cell_name, k, j, grid_cell_centers[k][j]))
+    save_manifest(manifest, manifest_file)
+
+    # Run the grid cells through the multi-process pipeline
+    workers = getattr(args, 'workers', 0)
+    if workers > 0:
+        def on_result(status, cell_name, info):
+            manifest[cell_name].update({'status': status, 'seconds': sum(v for v in info.values() if isinstance(v, float)), 'stages': info})
+            save_manifest(manifest, manifest_file)
+            count('cells_' + status)
+            event('cell', cell=cell_name, status=status, stages=info)
+        failed = run_cell_pipeline(pending_cells, area_name, dist, on_result, num_workers=workers,
+                                   num_fetch_workers=getattr(args, 'fetch_workers', 2), queue_size=getattr(args, 'queue_size', 4))
+        if failed:
+            raise RuntimeError(f'{len(failed)} grid cells failed: {failed}. Rerun with --resume to retry them.')
+        return
+
+    # Or one after the other in this process
+    for cell_name, k, j, center in pending_cells:
+        manifest[cell_name].update({'status': 'running', 'started': time.time()})
+        save_manifest(manifest, manifest_file)
+        cell_start_time = time.time()
+        try:
+            with stage('cell', cell=cell_name):
+                process_grid_cell(k, j, center, dist, area_name)
+        except Exception as e:
+            manifest[cell_name].update({'status': 'failed', 'error': repr(e), 'seconds': time.time() - cell_start_time})
+            save_manifest(manifest, manifest_file)
+            count('cells_failed')
+            raise
+        manifest[cell_name].update({'status': 'done', 'seconds': time.time() - cell_start_time})
+        save_manifest(manifest, manifest_file)
+        count('cells_done')
+
+
+def process_grid_cell(k, j, center, dist, area_name):
+    """
+    Retrieves the geometries around the center of a grid cell from OSM, extrudes the buildings and
+    saves the figure and the GeoJSON file of the grid cell in the Results/area_name folder.
+
+    Args:
+        k (int): The number of the sub-area.
+        j (int): The number of the grid cell in the sub-area.
+        center (tuple): The center of the grid cell as (latitude, longitude).
+        dist (float): The distance in meters from the center to retrieve the geometries.
+        area_name (str): The name of the area.
+
+    Returns:
+        None
+    """
+    with stage('download'):
+        gdf_proj = fetch_cell_geometries(center, dist)
+
+    # Print sub-area number, grid cell number and point number
+    print(f'Area {k}, Grid cell {j}, Point {center}')
+
+    with stage('extrude'):
+        gdf_proj = extrude_buildings(gdf_proj)
+    write_cell_outputs(gdf_proj, k, j, area_name)
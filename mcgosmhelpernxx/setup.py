@@ -28,7 +28,7 @@ setup(
         'requests',
         'matplotlib',
         'scipy',
-        'shapely',
+        'shapely>=2.0',
         'geopandas',
         'rtree',
         'pyproj',
@@ -0,0 +1,166 @@
+'''
+name: MCGChannelStats.py
+author: Artan Salihu
+version: 1.0
+status: development
+contact: artan.salihuATtuwien.ac.at
+website: https://www.artansalihu.com, https://mcg-deep-wrt.netlify.app/deep-wrt/utilities/
+date: 2026-10-19
+license: MIT
+dependencies: numpy, pandas, argparse, sys, time, MCGReadRemcomPaths.py
+description: Power-weighted channel statistics of the paths of get_queries_paths_remcom, one row per (ue_id, bs_id, bs_sub_antenna) group:
+                number of paths, total received power, mean delay and RMS delay spread, azimuth spreads of arrival and departure
+                (ASA, ASD, circular spread of 3GPP TR 25.996), elevation spreads (ZSA, ZSD, RMS spread of theta), Rician K-factor
+                and LoS flag. The paths are sorted by group once and every statistic is a segment reduction (np.add.reduceat)
+                over the sorted columns, so all groups are computed at once without a pandas groupby.apply.
+                The LoS flag is set if the first arriving path of a group arrives within los_tolerance of the direct
+                distance between the base station and the user divided by the speed of light. The K-factor is the power of
+                that LoS path (or of the strongest path without LoS) over the power of the other paths.
+                For CLI it uses the following arguments:
+                    --db: Sqlite database(s) of WI
+                    --output: Output csv file(s) (default: the database with _stats.csv)
+                    --lean: Read the paths with the lean dtypes of MCGReadRemcomPaths.py
+                    --losTolerance: LoS tolerance of the arrival time in seconds
+                    --help_options: Print options
+
+                Example for CLI:
+                    python MCGChannelStats.py --db VCS_WI_Project_01.Case2_4x2_X3D.sqlite
+
+                You can also import the function into your own script:
+                    from MCGChannelStats import channel_stats
+                    stats = channel_stats(get_queries_paths_remcom(db, json_file, save=False))
+'''
+
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from MCGReadRemcomPaths import PathsView, get_queries_paths_remcom
+
+SPEED_OF_LIGHT = 299792458.
+
+# Spread name -> angle column (degrees) of the paths; azimuths (phi) wrap around, elevations (theta) do not
+AZIMUTH_SPREADS = {'asa': 'arrival_phi', 'asd': 'departure_phi'}
+ELEVATION_SPREADS = {'zsa': 'arrival_theta', 'zsd': 'departure_theta'}
+
+
+def sorted_groups(paths, key_columns=('ue_id', 'bs_id', 'bs_sub_antenna')):
+  '''
+  Sorts the paths by group.
+
+  Arguments:
+    paths: DataFrame of get_queries_paths_remcom(save=False) or PathsView of get_queries_paths_remcom(save=True)
+    key_columns: the columns of the group keys (a PathsView has its own keys)
+
+  Returns:
+    columns: {name: array} sorted by the keys
+    starts: index of the first path of each group in the columns
+    keys: {name: array} with the key of each group
+  '''
+  if isinstance(paths, PathsView):
+    columns = {name: paths.column(name) for name in paths.column_names}
+    return columns, paths.offsets[:-1], paths.key_arrays
+  key_columns = list(key_columns)
+  order = np.lexsort([paths[name].to_numpy() for name in reversed(key_columns)])
+  columns = {name: paths[name].to_numpy()[order] for name in paths.columns}
+  if len(order):
+    keys = np.column_stack([columns[name] for name in key_columns])
+    starts = np.flatnonzero(np.concatenate(([True], np.any(keys[1:] != keys[:-1], axis=1))))
+  else:
+    starts = np.empty(0, dtype=np.int64)
+  return columns, starts, {name: columns[name][starts] for name in key_columns}
+
+
+def _weighted_mean(values, weights, starts, total):
+  # Power-weighted mean of each group
+  return np.add.reduceat(values * weights, starts) / total
+
+
+def _rms_spread(values, weights, starts, counts, total):
+  # Power-weighted standard deviation of each group (two passes, centered on the group mean)
+  mean = _weighted_mean(values, weights, starts, total)
+  centered = values - np.repeat(mean, counts)
+  return mean, np.sqrt(_weighted_mean(centered * centered, weights, starts, total))
+
+
+def _circular_spread(degrees, weights, starts, total):
+  # Circular angular spread sqrt(-2 ln |sum p exp(j phi)| / sum p) in degrees (3GPP TR 25.996)
+  radians = np.radians(degrees)
+  resultant = np.hypot(np.add.reduceat(weights * np.cos(radians), starts), np.add.reduceat(weights * np.sin(radians), starts)) / total
+  return np.degrees(np.sqrt(-2 * np.log(np.clip(resultant, np.finfo(np.float64).tiny, 1.))))
+
+
+def channel_stats(paths, key_columns=('ue_id', 'bs_id', 'bs_sub_antenna'), los_tolerance=1e-9):
+  '''
+  Computes the power-weighted channel statistics of every group of paths at once.
+
+  Arguments:
+    paths: DataFrame of get_queries_paths_remcom(save=False) or PathsView of get_queries_paths_remcom(save=True)
+           (received_power in dBm, time_of_arrival in s, angles in degrees, ue_x..bs_z in m)
+    key_columns: the columns of the group keys
+    los_tolerance: largest difference in s between the first arrival and the direct distance / c for LoS
+
+  Returns:
+    DataFrame with one row per group: the keys, num_paths, total_power_dbm, mean_delay and delay_spread (s),
+    asa, asd, zsa, zsd (degrees), k_factor_db and los
+  '''
+  columns, starts, keys = sorted_groups(paths, key_columns)
+  stats = {name: values for name, values in keys.items()}
+  if len(starts) == 0:
+    for name in ['num_paths', 'total_power_dbm', 'mean_delay', 'delay_spread'] + list(AZIMUTH_SPREADS) + list(ELEVATION_SPREADS) + ['k_factor_db', 'los']:
+      stats[name] = np.empty(0, dtype=bool if name == 'los' else np.float64)
+    return pd.DataFrame(stats)
+
+  # Linear powers in mW, everything in float64 (also for the lean float32 columns)
+  power = np.power(10., columns['received_power'].astype(np.float64) / 10.)
+  delay = columns['time_of_arrival'].astype(np.float64)
+  counts = np.diff(np.append(starts, len(power)))
+  total = np.add.reduceat(power, starts)
+
+  stats['num_paths'] = counts
+  stats['total_power_dbm'] = 10 * np.log10(total)
+  stats['mean_delay'], stats['delay_spread'] = _rms_spread(delay, power, starts, counts, total)
+  for name, column in AZIMUTH_SPREADS.items():
+    stats[name] = _circular_spread(columns[column].astype(np.float64), power, starts, total)
+  for name, column in ELEVATION_SPREADS.items():
+    stats[name] = _rms_spread(columns[column].astype(np.float64), power, starts, counts, total)[1]
+
+  # LoS: the first arrival matches the direct distance (the positions are the same for all the paths of a group)
+  first_arrival = np.minimum.reduceat(delay, starts)
+  ue = np.column_stack([columns[name][starts] for name in ('ue_x', 'ue_y', 'ue_z')]).astype(np.float64)
+  bs = np.column_stack([columns[name][starts] for name in ('bs_x', 'bs_y', 'bs_z')]).astype(np.float64)
+  los = np.abs(first_arrival - np.linalg.norm(ue - bs, axis=1) / SPEED_OF_LIGHT) <= los_tolerance
+  first_power = np.maximum.reduceat(np.where(delay == np.repeat(first_arrival, counts), power, 0.), starts)
+
+  # K-factor: the LoS path (or the strongest path) over the other paths, inf for a single path
+  dominant = np.where(los, first_power, np.maximum.reduceat(power, starts))
+  with np.errstate(divide='ignore'):
+    stats['k_factor_db'] = 10 * np.log10(dominant) - 10 * np.log10(np.maximum(total - dominant, 0.))
+  stats['los'] = los
+  return pd.DataFrame(stats)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Channel statistics of the paths of WI sqlite databases - MCG-Remcom - www.artansalihu.com')
+  parser.add_argument('--db', nargs='+', default=['VCS_WI_Project_01.Case2_4x2_X3D.sqlite'], help='Sqlite database(s) of WI')
+  parser.add_argument('--output', nargs='+', default=None, help='Output csv file(s) (default: the database with _stats.csv)')
+  parser.add_argument('--lean', action='store_true', help='Read the paths with the lean dtypes (float32 values, int32 ids)')
+  parser.add_argument('--losTolerance', type=float, default=1e-9, help='LoS tolerance of the arrival time in seconds')
+  parser.add_argument('--help_options', action='store_true', help='Print options')
+  args = parser.parse_args()
+  if args.help_options:
+    parser.print_help()
+    sys.exit()
+
+  outputs = args.output or [db.rsplit('.', 1)[0] + '_stats.csv' for db in args.db]
+  if len(outputs) != len(args.db):
+    parser.error('--output needs one file per database')
+  for db, output in zip(args.db, outputs):
+    start_time = time.time()
+    df = get_queries_paths_remcom(db, None, save=False, dtypes='lean' if args.lean else None)
+    stats = channel_stats(df, los_tolerance=args.losTolerance)
+    stats.to_csv(output, index=False)
+    print(f'{db} -> {output}: {len(stats)} groups, {len(df)} paths, {int(stats["los"].sum())} LoS in {time.time() - start_time:.1f} s')
@@ -7,7 +7,7 @@ contact: artan.salihuATtuwien.ac.at
 website: https://www.artansalihu.com, https://mcg-deep-wrt.netlify.app/deep-wrt/utilities/
 date: 2022-09-10
 license: MIT
-dependencies: pandas, sqlite3, numpy, json, codec, os, glob
+dependencies: pandas, sqlite3, numpy, json, codec, os, glob, MCGInstrument.py
 description: This tool reads the path information from a sqlite database file obtained from the ray-tracing simulation of Remcom Wireless Insite (WI) when using X3D model. It returns a dictionary of the paths. The dictionary can be saved into a json file. The json file can be used in Matlab.
 Usage:
 1. Install the dependencies.
@@ -26,7 +26,9 @@ file_path_json (str): The path to the json file.
 num_paths (int):  Select only top-num_paths. If num_paths=0, selects all the paths.
 
 Returns:
-dictionary: A dictionary of the paths. The dictionary can be saved into a json file.
+PathsView: A read-only mapping of the paths {(ue_id, bs_id, bs_sub_antenna): {sequence: {column: value}}} backed by NumPy arrays.
+           The paths can be saved into a json file. Use .to_dict() for the nested dictionaries, or .column(name) and
+           view[key].column(name) for the NumPy arrays of all paths or of one group.
 
 In case of multiple files, you can use the following script:
 import os
@@ -34,6 +36,9 @@ import glob
 import json
 from MCGReadRemcomPaths import get_queries_paths_remcom_multiple(files, files_json, num_paths=0, save=True)
 
+To record the time of each step (sql_query, sequence, groupby, serialize) as JSON lines, set the environment variable
+MCG_METRICS to the metrics file (see MCGInstrument.py) or call MCGInstrument.configure('metrics.jsonl') before.
+
 In case of reading only Power (p2m) files, you can use the following script:
 
 
@@ -45,19 +50,290 @@ import codecs, json
 import numpy as np
 import os
 import glob
+import bisect
+import gzip
+import multiprocessing
+import shutil
+import urllib.request
+from collections.abc import Mapping
 
-def get_queries_paths_remcom(sqlite_db_path_file_name, file_path_json, num_paths=0, save=True):
-  """Get the queried results.
-  num_paths (int):  Select only top-num_paths. If num_paths=0, selects all the paths.
-  save (bool): If true, then it saves into a json file. Note that json file is not very well serialized for use in matlab structures.
-              If false, then this returns a dictionary only.
+from MCGInstrument import stage, count
+
+class _SortedKeys:
+  """Sequence of the group keys as tuples, for bisect (keys are built only for the O(log n) probed positions)."""
+  def __init__(self, key_arrays):
+    self.key_arrays = key_arrays
+
+  def __len__(self):
+    return len(self.key_arrays[0])
+
+  def __getitem__(self, i):
+    return tuple(array[i].item() for array in self.key_arrays)
+
+
+class PathGroup(Mapping):
   """
+  Read-only view of the paths of one (ue_id, bs_id, bs_sub_antenna) group: a Mapping sequence -> path dict like the
+  nested dicts of get_queries_paths_remcom. column(name) returns the values of a column as a NumPy slice (no copy).
+  """
+  def __init__(self, columns, index_column, start, stop):
+    self._columns = columns
+    self._index_column = index_column
+    self._start = start
+    self._stop = stop
 
-  # sqlite db file
-  #sqlite_db_path_file_name = "VCS_WI_Project_01.Case2_4x2_X3D.sqlite"
+  def column(self, name):
+    return self._columns[name][self._start:self._stop]
 
-  # # Be sure to close the connection
-  # con.close()
+  def _position(self, sequence):
+    sequences = self.column(self._index_column)
+    position = int(np.searchsorted(sequences, sequence))
+    if position == len(sequences) or sequences[position] != sequence:
+      raise KeyError(sequence)
+    return self._start + position
+
+  def __getitem__(self, sequence):
+    position = self._position(sequence)
+    return {name: values[position].item() for name, values in self._columns.items() if name != self._index_column}
+
+  def __iter__(self):
+    return (sequence.item() for sequence in self.column(self._index_column))
+
+  def __len__(self):
+    return self._stop - self._start
+
+  def to_dict(self):
+    """The paths as {sequence: {column: value}}."""
+    names = [name for name in self._columns if name != self._index_column]
+    rows = zip(*[self._columns[name][self._start:self._stop].tolist() for name in names])
+    return {sequence: dict(zip(names, row)) for sequence, row in zip(self.column(self._index_column).tolist(), rows)}
+
+
+class PathsView(Mapping):
+  """
+  Read-only Mapping (ue_id, bs_id, bs_sub_antenna) -> PathGroup over the paths DataFrame, in place of the nested dicts
+  returned by get_queries_paths_remcom before. The columns are kept as NumPy arrays sorted by the keys and the sequence,
+  the groups are given by offsets into them: a key lookup is a binary search (O(log n)) and the columns of a group are
+  slices of the arrays. to_dict() builds the nested dicts for code that needs them.
+  """
+  def __init__(self, df, key_columns=('ue_id', 'bs_id', 'bs_sub_antenna'), index_column='sequence'):
+    key_columns = list(key_columns)
+    # Sort by the keys, then by the sequence (np.lexsort sorts by the last key first)
+    order = np.lexsort([df[index_column].to_numpy()] + [df[name].to_numpy() for name in reversed(key_columns)])
+    self._columns = {name: df[name].to_numpy()[order] for name in df.columns}
+    self._index_column = index_column
+    if len(order):
+      keys = np.column_stack([self._columns[name] for name in key_columns])
+      starts = np.flatnonzero(np.concatenate(([True], np.any(keys[1:] != keys[:-1], axis=1))))
+    else:
+      starts = np.empty(0, dtype=np.int64)
+    self._offsets = np.append(starts, len(order))
+    self._key_columns = key_columns
+    self._keys = _SortedKeys([self._columns[name][starts] for name in key_columns])
+
+  def _group(self, g):
+    return PathGroup(self._columns, self._index_column, int(self._offsets[g]), int(self._offsets[g + 1]))
+
+  def __getitem__(self, key):
+    if not isinstance(key, tuple):
+      raise KeyError(key)
+    g = bisect.bisect_left(self._keys, key)
+    if g == len(self._keys) or self._keys[g] != key:
+      raise KeyError(key)
+    return self._group(g)
+
+  def __iter__(self):
+    return zip(*[array.tolist() for array in self._keys.key_arrays])
+
+  def __len__(self):
+    return len(self._keys)
+
+  def items(self):
+    return ((key, self._group(g)) for g, key in enumerate(self))
+
+  def values(self):
+    return (self._group(g) for g in range(len(self)))
+
+  def column(self, name):
+    """All values of a column, sorted by the keys and the sequence."""
+    return self._columns[name]
+
+  @property
+  def column_names(self):
+    """The names of the columns, including the keys and the sequence."""
+    return list(self._columns)
+
+  @property
+  def offsets(self):
+    """Start of each group in the columns, and the number of paths at the end (len(view) + 1 values)."""
+    return self._offsets
+
+  @property
+  def key_arrays(self):
+    """The keys of the groups as one array per key column, {name: array}."""
+    return dict(zip(self._key_columns, self._keys.key_arrays))
+
+  @property
+  def nbytes(self):
+    return sum(values.nbytes for values in self._columns.values()) + self._offsets.nbytes
+
+  def to_dict(self):
+    """The nested dicts {(ue_id, bs_id, bs_sub_antenna): {sequence: {column: value}}}, as returned before."""
+    return {key: group.to_dict() for key, group in self.items()}
+
+
+def _group_json(key, paths, indent):
+  # A group of the json list with the separator before it (',' and the indentation of json.dump)
+  if indent is None:
+    return ',' + json.dumps([list(key), paths], separators=(',', ':'))
+  pad = ' ' * indent
+  return ',\n' + pad + json.dumps([list(key), paths], separators=(',', ':'), indent=indent).replace('\n', '\n' + pad)
+
+
+def _open_json(file_path_json, compress=None):
+  if compress is None:
+    compress = file_path_json.endswith('.gz')
+  return gzip.open(file_path_json, 'wt', encoding='utf-8') if compress else open(file_path_json, 'w', encoding='utf-8')
+
+
+def write_paths_json(file_path_json, groups, indent=4, compress=None):
+  '''
+  Writes the path groups to a json file one by one, in the format of get_queries_paths_remcom:
+  [[[ue_id, bs_id, bs_sub_antenna], {sequence: {column: value}}], ...]. Only one group is in memory at a time.
+  With indent=4, the text is the same as json.dump of the whole list.
+
+  Arguments:
+    file_path_json: the json file
+    groups: iterable of (key, paths) with key the (ue_id, bs_id, bs_sub_antenna) tuple and paths the {sequence: {column: value}} dict
+    indent: indentation of the json file (4 as before), None for compact json on one line
+    compress: write a gzip file, by default if file_path_json ends with .gz
+
+  Returns:
+    number of groups written
+  '''
+  n = 0
+  with _open_json(file_path_json, compress) as f:
+    f.write('[')
+    for key, paths in groups:
+      text = _group_json(key, paths, indent)
+      # No separator before the first group
+      f.write(text[1:] if n == 0 else text)
+      n += 1
+    f.write(('\n]' if indent is not None else ']') if n else ']')
+  return n
+
+
+# Lean dtypes of the path columns: float32 for powers, delays, angles and positions (about 7 significant digits,
+# e.g. 1e-13 s on a 1e-6 s delay), compact integers for the ids
+LEAN_DTYPES = {
+  'channel_id': 'int32', 'bs_id': 'int32', 'ue_id': 'int32', 'path_id': 'int32', 'bs_sub_antenna': 'int16', 'sequence': 'int32',
+  'received_power': 'float32', 'time_of_arrival': 'float32',
+  'departure_phi': 'float32', 'departure_theta': 'float32', 'arrival_phi': 'float32', 'arrival_theta': 'float32',
+  'freespace_path_loss': 'float32', 'freespace_path_loss_woa': 'float32', 'cir_phs': 'float32',
+  'ue_x': 'float32', 'ue_y': 'float32', 'ue_z': 'float32', 'bs_x': 'float32', 'bs_y': 'float32', 'bs_z': 'float32',
+}
+
+
+def _lean_chunk(chunk, dtypes=None, drop_columns=None):
+  # Drop the unused columns and convert the others to the schema dtypes (per fetched chunk)
+  if drop_columns:
+    chunk = chunk.drop(columns=[col for col in drop_columns if col in chunk.columns])
+  if dtypes:
+    chunk = chunk.astype({col: dtype for col, dtype in dtypes.items() if col in chunk.columns}, copy=False)
+  return chunk
+
+
+def read_paths(con, sql_query_request, dtypes=None, drop_columns=None, chunksize=100000):
+  '''
+  Reads the paths of a query into a DataFrame. With dtypes or drop_columns, the rows are fetched in chunks and each
+  chunk is converted (and its unused columns dropped) before the next one is fetched, so the float64/int64 and
+  Python row copies exist only for one chunk.
+
+  Arguments:
+    con: the sqlite connection
+    sql_query_request: the query
+    dtypes: {column: dtype}, 'lean' for LEAN_DTYPES or None to keep float64/int64
+    drop_columns: columns not kept, e.g. ['freespace_path_loss_woa']
+    chunksize: number of rows fetched at once
+
+  Returns:
+    DataFrame
+  '''
+  if dtypes == 'lean':
+    dtypes = LEAN_DTYPES
+  if not dtypes and not drop_columns:
+    df = pd.read_sql_query(sql_query_request, con)
+    count('rows', len(df))
+    return df
+  chunks = []
+  for chunk in pd.read_sql_query(sql_query_request, con, chunksize=chunksize):
+    count('rows', len(chunk))
+    chunks.append(_lean_chunk(chunk, dtypes, drop_columns))
+  if not chunks:
+    return _lean_chunk(pd.read_sql_query(sql_query_request, con), dtypes, drop_columns)
+  return pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+
+
+def iter_path_groups(con, sql_query_request, num_paths=0, chunksize=20000, key_columns=('ue_id', 'bs_id', 'bs_sub_antenna'), dtypes=None, drop_columns=None):
+  '''
+  Reads the paths of a query sorted by key_columns in chunks and yields the groups one by one, so the whole result
+  is never in memory. The query must be ordered by key_columns (ORDER BY).
+
+  Arguments:
+    con: the sqlite connection
+    sql_query_request: the query of get_queries_paths_remcom with ORDER BY key_columns
+    num_paths: select only the top-num_paths of each group, 0 for all
+    chunksize: number of rows read at once
+    dtypes, drop_columns: see read_paths
+
+  Returns:
+    generator of (key, {sequence: {column: value}}) with key the (ue_id, bs_id, bs_sub_antenna) tuple
+  '''
+  key_columns = list(key_columns)
+  if dtypes == 'lean':
+    dtypes = LEAN_DTYPES
+  carry = None
+  for chunk in pd.read_sql_query(sql_query_request, con, chunksize=chunksize):
+    count('rows', len(chunk))
+    chunk = _lean_chunk(chunk, dtypes, drop_columns)
+    if carry is not None:
+      chunk = pd.concat([carry, chunk], ignore_index=True)
+    if len(chunk) == 0:
+      # A query without rows gives one empty chunk
+      continue
+    # The last group may continue in the next chunk
+    last = (chunk[key_columns] == chunk[key_columns].iloc[-1]).all(axis=1).to_numpy()
+    last_start = len(chunk) - int(np.argmin(last[::-1])) if not last.all() else 0
+    carry = chunk.iloc[last_start:]
+    chunk = chunk.iloc[:last_start]
+    for key, paths in _path_groups(chunk, key_columns, num_paths):
+      yield key, paths
+  if carry is not None:
+    for key, paths in _path_groups(carry, key_columns, num_paths):
+      yield key, paths
+
+
+def _path_groups(chunk, key_columns, num_paths):
+  # Complete groups of a sorted chunk, with the sequence of each path in its group
+  if len(chunk) == 0:
+    return
+  chunk = chunk.copy()
+  chunk['sequence'] = chunk.groupby(key_columns, sort=False).cumcount()
+  if num_paths > 0:
+    chunk = chunk[chunk['sequence'] < num_paths]
+  for key, group in PathsView(chunk, key_columns=key_columns).items():
+    yield key, group.to_dict()
+
+
+# Order of the paths by group, then by path id (the order of the paths in a group)
+PATHS_ORDER = 'ORDER BY ue_id, bs_id, bs_sub_antenna, path.path_id, path_utd.rowid'
+
+
+def paths_query(where=''):
+  '''
+  Returns the SQL query of the paths (channel, path, path_utd, rx and tx joined), with an optional WHERE clause
+  (e.g. "WHERE channel.rx_id BETWEEN 0 AND 99 ").
+  '''
   table1 = 'channel'
   table2 = 'path'
   table3 = 'path_utd'
@@ -108,6 +384,31 @@ def get_queries_paths_remcom(sqlite_db_path_file_name, file_path_json, num_paths
                         f'INNER JOIN {table5} '
                         f'ON {table1}.{t1_forKey3} = {table5}.{t5_forKey1} '
                         )
+  return sql_query_request + where
+
+
+def get_queries_paths_remcom(sqlite_db_path_file_name, file_path_json, num_paths=0, save=True, stream=False, indent=4, compress=None, dtypes=None, drop_columns=None):
+  """Get the queried results.
+  num_paths (int):  Select only top-num_paths. If num_paths=0, selects all the paths.
+  save (bool): If true, then it saves into a json file. Note that json file is not very well serialized for use in matlab structures.
+              If false, then this returns the DataFrame only.
+  With save=True, returns a PathsView: a read-only Mapping (ue_id, bs_id, bs_sub_antenna) -> {sequence: {column: value}}
+  backed by NumPy arrays. Use .to_dict() to get the nested dicts.
+  stream (bool): With save=True, read the query sorted by group in chunks and write the groups to the json file one by one
+              (bounded memory, nothing is kept). Returns the number of groups written.
+  indent (int): Indentation of the json file, None for compact json.
+  compress (bool): Write a gzip file, by default if file_path_json ends with .gz.
+  dtypes (str or dict): 'lean' (LEAN_DTYPES: float32 values and compact integer ids, about half the memory) or {column: dtype},
+              applied to each fetched chunk. None keeps float64/int64. The json values are then float32 values.
+  drop_columns (list): Columns not kept, e.g. ['freespace_path_loss_woa', 'cir_phs'].
+  """
+
+  # sqlite db file
+  #sqlite_db_path_file_name = "VCS_WI_Project_01.Case2_4x2_X3D.sqlite"
+
+  # # Be sure to close the connection
+  # con.close()
+  sql_query_request = paths_query()
 
   print(sql_query_request)
   #f'WHERE {table3}.{t3_forKey1}<100 OR {table3}.{t3_forKey1} = 750 OR {table3}.{t3_forKey1} = 251'
@@ -115,12 +416,25 @@ def get_queries_paths_remcom(sqlite_db_path_file_name, file_path_json, num_paths
   # Get the sqlite query results. Put into a DataFrame
   con = sqlite3.connect(sqlite_db_path_file_name)
 
-  df = pd.read_sql_query(sql_query_request, con)
+  if save and stream:
+    # Sorted by group (then by path id, the order of the paths in a group), written group by group
+    sql_query_request += PATHS_ORDER
+    with stage('serialize', file=file_path_json, stream=True):
+      n_groups = write_paths_json(file_path_json, iter_path_groups(con, sql_query_request, num_paths=num_paths, dtypes=dtypes, drop_columns=drop_columns),
+                                  indent=indent, compress=compress)
+    con.close()
+    return n_groups
+
+  with stage('sql_query', db=sqlite_db_path_file_name):
+    df = read_paths(con, sql_query_request, dtypes=dtypes, drop_columns=drop_columns)
 
   con.close()
 
   # Inject a sequence column to count the number of paths for each antenna element between a base station and a user location.
-  df['sequence']=df.groupby(['channel_id','bs_id','ue_id','bs_sub_antenna']).cumcount()
+  with stage('sequence'):
+    df['sequence']=df.groupby(['channel_id','bs_id','ue_id','bs_sub_antenna']).cumcount()
+    if dtypes:
+      df['sequence'] = df['sequence'].astype('int32')
 
   if save==True:
     # Now filter the number of paths
@@ -133,26 +447,128 @@ def get_queries_paths_remcom(sqlite_db_path_file_name, file_path_json, num_paths
       if ((col!='tx_id') and (col!='rx_id')): # choose those not interested to get.
         cols_to_save.append(col)
 
-    # Create a dictionary 
-    dict2 = df.groupby(['ue_id','bs_id','bs_sub_antenna'])[cols_to_save].apply(lambda x: x.set_index('sequence').to_dict(orient='index')).to_dict()
-
-    # Convert to list to save in json
-    result = dict2.items()  
-    data = list(result)
-  
-    # Convert list to an array just in case
-    numpyArray = np.array(data, dtype=object)
+    # Group the paths by user, base station and antenna element (arrays sorted by the groups, no nested dicts)
+    with stage('groupby'):
+      dict2 = PathsView(df[cols_to_save])
 
-
-    json.dump(data, codecs.open(file_path_json, 'w', encoding='utf-8'), 
-          separators=(',', ':'), 
-          sort_keys=False, 
-          indent=4)
+    # Write the groups one by one to the json file
+    with stage('serialize', file=file_path_json):
+      write_paths_json(file_path_json, ((key, group.to_dict()) for key, group in dict2.items()), indent=indent, compress=compress)
     
     return dict2
 
   return df
 
+def connect_read_only(sqlite_db_path_file_name):
+  '''
+  Opens a read-only connection to a sqlite file (several processes can read the same file at the same time).
+  '''
+  uri = 'file:' + urllib.request.pathname2url(os.path.abspath(sqlite_db_path_file_name)) + '?mode=ro'
+  return sqlite3.connect(uri, uri=True)
+
+
+# Columns of the channel table the parallel extraction can split by (the column name goes into the SQL)
+PARTITION_COLUMNS = ('rx_id', 'tx_id')
+
+
+def partition_ids(sqlite_db_path_file_name, partitions, by='rx_id'):
+  '''
+  Splits the rx_id (or tx_id) values of the channels into ranges with about the same number of ids.
+
+  Returns:
+    list of (first id, last id) tuples, in increasing order (empty if there are no channels)
+  '''
+  if by not in PARTITION_COLUMNS:
+    raise ValueError(f'by must be one of {PARTITION_COLUMNS}, not {by!r}')
+  con = connect_read_only(sqlite_db_path_file_name)
+  ids = np.array([row[0] for row in con.execute(f'SELECT DISTINCT {by} FROM channel ORDER BY {by}')])
+  con.close()
+  if len(ids) == 0:
+    return []
+  return [(int(part[0]), int(part[-1])) for part in np.array_split(ids, min(partitions, len(ids))) if len(part)]
+
+
+def _extract_partition(task):
+  # Worker: paths of one id range, as a DataFrame or as a fragment of the json list (groups with separators)
+  sqlite_db_path_file_name, by, first, last, num_paths, fragment_file, indent, dtypes, drop_columns = task
+  con = connect_read_only(sqlite_db_path_file_name)
+  sql_query_request = paths_query(f'WHERE channel.{by} BETWEEN {first} AND {last} ')
+  try:
+    if fragment_file is None:
+      with stage('sql_query', db=sqlite_db_path_file_name, first=first, last=last):
+        df = read_paths(con, sql_query_request, dtypes=dtypes, drop_columns=drop_columns)
+      df['sequence'] = df.groupby(['channel_id','bs_id','ue_id','bs_sub_antenna']).cumcount()
+      if dtypes:
+        df['sequence'] = df['sequence'].astype('int32')
+      return df
+    n = 0
+    with stage('serialize', file=fragment_file, first=first, last=last):
+      with open(fragment_file, 'w', encoding='utf-8') as f:
+        for key, paths in iter_path_groups(con, sql_query_request + PATHS_ORDER, num_paths=num_paths, dtypes=dtypes, drop_columns=drop_columns):
+          f.write(_group_json(key, paths, indent))
+          n += 1
+    return n
+  finally:
+    con.close()
+
+
+def get_queries_paths_remcom_parallel(sqlite_db_path_file_name, file_path_json, num_paths=0, save=True, workers=None, partitions=None, by='rx_id', indent=4, compress=None, dtypes=None, drop_columns=None):
+  '''
+  Parallel version of get_queries_paths_remcom for one large sqlite file: the channels are split into rx_id (or tx_id)
+  ranges, and worker processes extract the ranges with their own read-only connection and a range-restricted query.
+
+  Arguments:
+    sqlite_db_path_file_name: the sqlite db file
+    file_path_json: the json file (.gz for gzip)
+    num_paths: select only the top-num_paths of each group, 0 for all
+    save: write the json file (each worker writes the groups of its range to a part file, the parts are joined in order)
+          or return the DataFrame of all paths
+    workers: number of worker processes (default: number of CPUs)
+    partitions: number of id ranges (default: 4 per worker, for load balancing)
+    by: 'rx_id' (default) or 'tx_id' (ValueError otherwise). With 'rx_id' the json has the groups in the order of stream=True (by ue_id);
+        with 'tx_id' the groups are ordered by tx_id range first, then by ue_id within a range
+    indent, compress: see write_paths_json
+    dtypes, drop_columns: see read_paths
+
+  Returns:
+    number of groups written (save=True) or the DataFrame of the paths, with the sequence column, ordered by range (save=False)
+  '''
+  workers = workers or os.cpu_count() or 1
+  # Without channels, one (empty) range, so the result is an empty json list or a DataFrame with the columns of the query
+  ranges = partition_ids(sqlite_db_path_file_name, partitions or 4 * workers, by=by) or [(0, 0)]
+  fragment_files = [f'{file_path_json}.part{p}.{os.getpid()}.tmp' if save else None for p in range(len(ranges))]
+  tasks = [(sqlite_db_path_file_name, by, first, last, num_paths, fragment_file, indent, dtypes, drop_columns) for (first, last), fragment_file in zip(ranges, fragment_files)]
+  print(f'Extracting {len(ranges)} {by} ranges of {sqlite_db_path_file_name} with {workers} workers')
+
+  try:
+    with multiprocessing.get_context('spawn').Pool(workers) as pool:
+      results = pool.map(_extract_partition, tasks, chunksize=1)
+
+    if not save:
+      return pd.concat(results, ignore_index=True)
+
+    # Join the parts in the order of the ranges (by='rx_id': the groups are sorted as with stream=True)
+    n = sum(results)
+    with stage('join_parts', file=file_path_json):
+      with _open_json(file_path_json, compress) as f:
+        f.write('[')
+        first = True
+        for fragment_file in fragment_files:
+          with open(fragment_file, 'r', encoding='utf-8') as part:
+            if first:
+              # No separator before the first group
+              if part.read(1):
+                first = False
+            shutil.copyfileobj(part, f, 1 << 20)
+          os.remove(fragment_file)
+        f.write(('\n]' if indent is not None else ']') if n else ']')
+    return n
+  finally:
+    # The parts left by a failed worker or join
+    for fragment_file in fragment_files:
+      if fragment_file is not None and os.path.exists(fragment_file):
+        os.remove(fragment_file)
+
 # For multiple sqlite files and output multiple json files
 def get_queries_paths_remcom_multiple(sqlite_db_path_file_name_list, file_path_json_list, num_paths=1, save=True):
   '''
@@ -191,6 +607,9 @@ if __name__ == '__main__':
     #1. Case 1 - Single sqlite file and single json file
     get_queries_paths_remcom(sqlite_db_path_file_name="RIS_Remcom_Le.RIS_Remcom_Le_Zero.sqlite", file_path_json='test.json', num_paths=1, save=True)
 
+    #1b. Case 1 with worker processes for a large sqlite file (the paths are split by rx_id ranges)
+    # get_queries_paths_remcom_parallel(sqlite_db_path_file_name="RIS_Remcom_Le.RIS_Remcom_Le_Zero.sqlite", file_path_json='test.json', num_paths=1, workers=8)
+
     #2. Case 2 - Multiple sqlite files and multiple json files
     # # Define the list of sqlite db file names. Json file names will be derived from the sqlite db file names (without .sqlite part).
     # sqlite_db_path_file_name_list = [r'./RIS_Remcom_Le_Zero/RIS_Remcom_Le.RIS_Remcom_Le_Zero', r'./RIS_Remcom_Le_Zero 2/RIS_Remcom_Le_ARTAN.RIS_Remcom_Le_Zero 2']
@@ -7,7 +7,7 @@ contact: artan.salihuATtuwien.ac.at
 website: https://www.artansalihu.com, https://mcg-deep-wrt.netlify.app/deep-wrt/utilities/, https://www.remcom.com
 date: 2023-07-25
 license: MIT
-dependencies: numpy, xml, os, subprocess, re, argparse, sys, time
+dependencies: numpy, xml, os, subprocess, re, argparse, sys, time, hashlib, shutil, copy, contextlib, fcntl/msvcrt, MCGInstrument.py, MCGWorkQueue.py
 acknowledgements: Remcom Inc.
 description: This script automates the creation of a Wireless InSite study area and setup file for a given model.
                 Takes a study area a setup as input and creates a new file with changes to the study area and setup file. It runs the simulation using wibatch.exe and supports command line arguments based on the version of WI.
@@ -25,6 +25,14 @@ description: This script automates the creation of a Wireless InSite study area
                     --spacingValues: Change spacing values in meters, e.g., 1, 2, 3, 4. Useful for ArcSet, or GridSet. Not useful for PointSet.
                     --RISPatternRX: Change RIS Pattern files for RX from BS in a list, e.g., ["RISPatternRX_1", "RISPatternRX_2", "RISPatternRX_3"]
                     --RISPatternTX: Change RIS Pattern files for TX from BS in a list, e.g., ["RISPatternTX_1", "RISPatternTX_2", "RISPatternTX_3"]
+                    --cacheMode: clear deletes the *.cache files before every run (default), geometry keeps them in .mcg_cache/<key>/ per geometry (see geometry_cache_key)
+                    --cacheDir: Folder of the geometry caches (default: .mcg_cache)
+                    --queue: Add the study areas as jobs to this sqlite work queue (MCGWorkQueue.py) instead of running them
+                    --worker: Run the jobs of --queue with wibatch.exe on this node (with --wibatchLocation, --licenseLocation, --projectDir, --cacheMode)
+                    --projectDir: Worker: folder of the project the job paths are relative to (default: the current folder)
+                    --metrics: Write per-stage timings (XML edit, wibatch run, ...) as JSON lines to this file
+                    --profile: With --metrics, also profile with cProfile
+                    --trace_memory: With --metrics, also record the peak memory of each stage
                     --help_options: Print options
 
                 Example for CLI:
@@ -38,6 +46,18 @@ from pkg_resources import parse_version
 import argparse
 import sys
 import time
+import hashlib
+import shutil
+import copy
+import contextlib
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+import MCGInstrument
+from MCGInstrument import stage
+import MCGWorkQueue
 
 class RegexContainer:
     """
@@ -72,9 +92,173 @@ def check_version(editedStudyArea, baseVersion="3.3.5.6"):
     newVersion = parse_version(version[2]) >= parse_version(baseVersion)
     return newVersion
 
-def run_simulation_study(newVersion, wibatchLocation, licenseLocation, initialStudyAreaPath, newStudyArea, studyAreaFilenameSplit):
+# Elements of the study area that do not change the geometry preprocessing of WI (antennas, waveforms, outputs)
+RF_ELEMENT_TAGS = ('Antenna', 'AntennaList', 'Waveform', 'WaveformList', 'CarrierFrequency', 'OutputLocation', 'OutputPrefix', 'PathResultsDatabase')
+
+def geometry_cache_key(tree, setupContent, regexes):
+    '''
+    Compute the key of the WI cache files of a study area from the inputs that affect the geometry preprocessing:
+    the features of the setup file and the study area without its antennas, waveforms and outputs
+    (i.e. the TxRx set placement and spacing). Variants that only change the carrier frequency or the antenna
+    (.uan) files get the same key and can reuse the cache.
+
+    Parameters
+    ----------
+    tree : xml.etree.ElementTree.Element
+        The edited study area (with the SCRIPTPLACEHOLDER prefix)
+    setupContent : str
+        The content of the setup file
+    regexes : RegexContainer
+        The regexes of the script
+    Returns
+    -------
+    key : str
+        A hexadecimal hash
+    '''
+    geometry = copy.deepcopy(tree)
+    stack = [geometry]
+    while stack:
+        parent = stack.pop()
+        for child in list(parent):
+            if child.tag.replace("SCRIPTPLACEHOLDER", "") in RF_ELEMENT_TAGS:
+                parent.remove(child)
+            else:
+                stack.append(child)
+    digest = hashlib.sha1()
+    for feature in regexes.objectSectionRegex.findall(setupContent):
+        digest.update(feature.encode('utf-8'))
+    digest.update(ET.tostring(geometry, encoding='unicode', method='xml').encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+def clear_cache(workDir=None):
+    '''
+    Delete the *.cache files in the working directory (workDir, default: the current folder).
+    '''
+    workDir = os.path.abspath(workDir or os.getcwd())
+    for file in os.listdir(workDir):
+        if file.endswith(".cache"):
+            os.remove(os.path.join(workDir, file))
+
+def restore_cache(key, cacheDir=".mcg_cache", workDir=None):
+    '''
+    Delete the *.cache files in the working directory (workDir, default: the current folder) and copy the cache files
+    stored for the key into it (the stored files are kept, so a failed run does not lose them). A relative cacheDir is
+    relative to the working directory.
+
+    Returns
+    -------
+    restored : int
+        The number of restored cache files (0 if the geometry was not run before)
+    '''
+    workDir = os.path.abspath(workDir or os.getcwd())
+    clear_cache(workDir)
+    keyDir = os.path.join(workDir, cacheDir, key)
+    if not os.path.isdir(keyDir):
+        return 0
+    restored = 0
+    for file in os.listdir(keyDir):
+        shutil.copy2(os.path.join(keyDir, file), os.path.join(workDir, file))
+        restored += 1
+    return restored
+
+def store_cache(key, cacheDir=".mcg_cache", workDir=None):
+    '''
+    Move the *.cache files of the working directory (workDir, default: the current folder) to cacheDir/key, replacing
+    the cache stored before for the key. A relative cacheDir is relative to the working directory. Call it only after
+    a successful run.
+
+    Returns
+    -------
+    stored : int
+        The number of stored cache files
+    '''
+    workDir = os.path.abspath(workDir or os.getcwd())
+    keyDir = os.path.join(workDir, cacheDir, key)
+    # The files are moved to a new folder first, the stored cache is replaced only when all of them are there
+    newKeyDir = keyDir + ".new"
+    if os.path.isdir(newKeyDir):
+        shutil.rmtree(newKeyDir)
+    os.makedirs(newKeyDir)
+    stored = 0
+    for file in os.listdir(workDir):
+        if file.endswith(".cache"):
+            shutil.move(os.path.join(workDir, file), os.path.join(newKeyDir, file))
+            stored += 1
+    if os.path.isdir(keyDir):
+        shutil.rmtree(keyDir)
+    os.rename(newKeyDir, keyDir)
+    return stored
+
+@contextlib.contextmanager
+def project_lock(projectDir, pollInterval=5.):
+    '''
+    Hold an exclusive lock of the project folder (the file .mcg_worker.lock in it) while a job uses its *.cache files,
+    so two workers on the same copy of the project run one after the other. The lock is released by the operating
+    system if the worker dies.
+    '''
+    lockFile = open(os.path.join(projectDir, ".mcg_worker.lock"), "a+")
+    try:
+        waiting = False
+        while True:
+            try:
+                if os.name == "nt":
+                    lockFile.seek(0)
+                    msvcrt.locking(lockFile.fileno(), msvcrt.LK_NBLCK, 1)
+                else:
+                    fcntl.flock(lockFile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                if not waiting:
+                    print("Waiting for the worker using " + projectDir)
+                    waiting = True
+                time.sleep(pollInterval)
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                lockFile.seek(0)
+                msvcrt.locking(lockFile.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(lockFile.fileno(), fcntl.LOCK_UN)
+    finally:
+        lockFile.close()
+
+def run_wibatch(commandLine, wibatchLocation, cacheKey=None, cacheDir=".mcg_cache", studyAreaIndex=None):
+    '''
+    Run wibatch.exe in the current folder. With a cacheKey (--cacheMode geometry), the cache files stored for the key
+    are restored before the run and the new cache files are stored for the key after a successful run (return code 0).
+    Without a cacheKey, the *.cache files are deleted before the run.
+
+    Returns
+    -------
+    completed : subprocess.CompletedProcess
+    '''
+    if cacheKey is not None:
+        #reuse the cache files of a previous run with the same geometry, if any
+        with stage('restore_cache', study_area=studyAreaIndex):
+            restored = restore_cache(cacheKey, cacheDir)
+        print("Geometry cache " + cacheKey + (": reusing " + str(restored) + " cache files" if restored else ": new geometry"))
+        MCGInstrument.count('cache_hits' if restored else 'cache_misses')
+    else:
+        with stage('clear_cache'):
+            #delete any existing cache files to prevent them from being used.
+            clear_cache()
+    print(commandLine)
+    with stage('wibatch_run', study_area=studyAreaIndex):
+        completed = subprocess.run(commandLine, executable=wibatchLocation)
+    if completed.returncode != 0:
+        print("wibatch.exe returned " + str(completed.returncode) + (", the cache files are not stored" if cacheKey is not None else ""))
+    elif cacheKey is not None:
+        with stage('store_cache', study_area=studyAreaIndex):
+            store_cache(cacheKey, cacheDir)
+    return completed
+
+def run_simulation_study(newVersion, wibatchLocation, licenseLocation, initialStudyAreaPath, newStudyArea, studyAreaFilenameSplit,
+                         cacheKey=None, initialCacheKey=None, cacheDir=".mcg_cache", studyAreaIndex=None):
     '''
     Run the simulation using wibatch.exe and the appropriate command line arguments based on the version of WI.
+    With --cacheMode geometry, cacheKey is the geometry key of the new study area and initialCacheKey the one of the
+    initial study area (run the first time through).
     '''
     #run simulation
     wibatch = "wibatch.exe"
@@ -88,8 +272,7 @@ def run_simulation_study(newVersion, wibatchLocation, licenseLocation, initialSt
         else:
             commandLine = wibatch + cmdFileInput + cmdFileOutput
             print("Running initial position simulation")
-            print(commandLine)
-            subprocess.run(commandLine, executable=wibatchLocation)
+            run_wibatch(commandLine, wibatchLocation, initialCacheKey, cacheDir, studyAreaIndex=1)
     newStudyAreaNameSplit = newStudyArea.name.split(".")
     cmdFileInput = " -f " + (f'"{newStudyArea.name}"')
     cmdFileOutput = " -out " + (f'"{newStudyAreaNameSplit[1]}"')
@@ -98,10 +281,54 @@ def run_simulation_study(newVersion, wibatchLocation, licenseLocation, initialSt
         commandLine = wibatch + cmdFileInput + cmdFileOutput + cmdFileLicense
     else:
         commandLine = wibatch + cmdFileInput + cmdFileOutput
-    print(commandLine)
-    subprocess.run(commandLine, executable=wibatchLocation)
+    return run_wibatch(commandLine, wibatchLocation, cacheKey, cacheDir, studyAreaIndex)
     
 
+def wibatch_command(studyAreaPath, outputName, newVersion, licenseLocation):
+    '''
+    Build the wibatch.exe command line of a study area.
+    '''
+    commandLine = "wibatch.exe" + " -f " + (f'"{studyAreaPath}"') + " -out " + (f'"{outputName}"')
+    if newVersion:
+        commandLine += " -set_licenses " + licenseLocation
+    return commandLine
+
+def run_queue_job(payload, wibatchLocation, licenseLocation, projectDir, cacheMode="clear", cacheDir=".mcg_cache"):
+    '''
+    Run a study area job of the work queue (written by MCGRemcom.py --queue) in the project folder of this node.
+    wibatch.exe runs with projectDir as working directory (the worker does not change its own, the heartbeat thread
+    uses the queue meanwhile). The project folder is locked during the job (project_lock): the *.cache files of WI are
+    in the project folder, so workers on the same copy of the project run their jobs one after the other.
+
+    Parameters
+    ----------
+    payload : dict
+        The job: studyArea, output, newVersion, cacheKey and studyAreaIndex
+    Returns
+    -------
+    result : dict
+        The return code and run time of wibatch.exe
+    '''
+    projectDir = os.path.abspath(projectDir)
+    if os.path.exists(wibatchLocation):
+        wibatchLocation = os.path.abspath(wibatchLocation)
+    commandLine = wibatch_command(payload["studyArea"], payload["output"], payload["newVersion"], licenseLocation)
+    with project_lock(projectDir):
+        if cacheMode == "geometry":
+            restore_cache(payload["cacheKey"], cacheDir, projectDir)
+        else:
+            clear_cache(projectDir)
+        print(commandLine)
+        startTime = time.time()
+        with stage('wibatch_run', study_area=payload["studyAreaIndex"]):
+            completed = subprocess.run(commandLine, executable=wibatchLocation, cwd=projectDir)
+        if completed.returncode != 0:
+            raise RuntimeError("wibatch.exe returned " + str(completed.returncode) + " for " + payload["studyArea"])
+        if cacheMode == "geometry":
+            store_cache(payload["cacheKey"], cacheDir, projectDir)
+    return {"returncode": completed.returncode, "seconds": round(time.time() - startTime, 3)}
+
+
 # Create a method for defining regexes below:
 if __name__ == "__main__":
         # Define Arguments
@@ -119,9 +346,18 @@ if __name__ == "__main__":
     parser.add_argument('--spacingValues', nargs='+', type=int, default=None, help='Change spacing values in meters, e.g., 1, 2, 3, 4. Useful for ArcSet, or GridSet. Not useful for PointSet.')
     parser.add_argument('--RISPatternsRX', nargs='+', type=str, default=None, help='List of RIS RX File Patterns converted from MCGst2UanConverter.py')
     parser.add_argument('--RISPatternsTX', nargs='+', type=str, default=['HalfWaveDipoleTest'], help='List of RIS TX File Patterns converted from MCGst2UanConverter.py')
-    
+    parser.add_argument('--cacheMode', default="clear", choices=["clear", "geometry"], help='clear: delete the *.cache files before every run. geometry: keep the caches per geometry (features, TxRx placement and spacing), so frequency and RIS pattern sweeps reuse them')
+    parser.add_argument('--cacheDir', default=".mcg_cache", help='Folder of the caches kept with --cacheMode geometry')
+    parser.add_argument('--queue', default=None, help='Add the study areas as jobs to this sqlite work queue instead of running them (see MCGWorkQueue.py)')
+    parser.add_argument('--worker', action='store_true', help='Run the jobs of --queue on this node until the queue is empty')
+    parser.add_argument('--projectDir', default=None, help='Worker: folder of the project the job paths are relative to (default: the current folder)')
+    parser.add_argument('--heartbeatInterval', type=float, default=30., help='Worker: seconds between two heartbeats of the running job')
+    parser.add_argument('--staleAfter', type=float, default=600., help='Worker: seconds without heartbeat after which the job of another worker is run again')
 
 
+    parser.add_argument('--metrics', default=None, help='Write per-stage timings (XML edit, writing the study area, clearing the cache, wibatch run) as JSON lines to this file')
+    parser.add_argument('--profile', action='store_true', help='With --metrics, also profile with cProfile (saved next to the metrics file)')
+    parser.add_argument('--trace_memory', action='store_true', help='With --metrics, also record the peak memory of each stage with tracemalloc')
     parser.add_argument('--help_options', action='store_true', help='Print options')
     # Parse the arguments
     args = parser.parse_args()
@@ -132,8 +368,20 @@ if __name__ == "__main__":
     # if args.verbose:
     #     print("Verbose enabled")
     # Run the main function with the arguments    
+    MCGInstrument.configure(args.metrics, profile=args.profile, trace_memory=args.trace_memory)
     start_time = time.time() 
 
+    if args.worker:
+        if args.queue is None:
+            parser.error("--worker needs --queue")
+        projectDir = args.projectDir or os.getcwd()
+        counts = MCGWorkQueue.run_worker(args.queue, lambda payload: run_queue_job(payload, args.wibatchLocation, args.licenseLocation, projectDir, args.cacheMode, args.cacheDir),
+                                         heartbeat_interval=args.heartbeatInterval, stale_after=args.staleAfter)
+        print("Worker finished: " + str(counts))
+        print("--- %s seconds ---" % (time.time() - start_time))
+        MCGInstrument.close()
+        sys.exit()
+
     # Use arguments
     studyArea = args.studyArea
     setup = args.setup
@@ -148,6 +396,8 @@ if __name__ == "__main__":
     spacingValues = args.spacingValues
     RISPatternsRX = args.RISPatternsRX
     RISPatternsTX = args.RISPatternsTX
+    cacheMode = args.cacheMode
+    cacheDir = args.cacheDir
 
     # Create a help message for the user for arguments
     helpMessage = "Running script with the following arguments:\n"
@@ -164,6 +414,7 @@ if __name__ == "__main__":
     helpMessage += "CarrierFrequencyRx: " + str(CarrierFrequencyRx) + "\n"
     helpMessage += "RISPatterns: " + str(RISPatternsRX) + "\n"
     helpMessage += "RISPatterns: " + str(RISPatternsTX) + "\n"
+    helpMessage += "Cache Mode: " + cacheMode + "\n"
     
     print(helpMessage)
 
@@ -230,82 +481,95 @@ if __name__ == "__main__":
     displayIndex = 2
     i=0
 
+    #the initial study area has its own geometry (TxRx placement and spacing) and cache
+    initialCacheKey = geometry_cache_key(tree, setupContent, regexes)
+
+    if args.queue is not None:
+        #jobs of the sweep, starting with the initial study area
+        queueJobs = [{"studyArea": initialStudyAreaPath, "output": studyAreaFilenameSplit[1], "newVersion": newVersion,
+                      "cacheKey": initialCacheKey, "studyAreaIndex": 1}]
+
     # Loop through spacing values
     for i in range(max_len_changes):
-        tree = ET.fromstring(editedStudyArea)
-        for elementOutputLocation in tree.find("SCRIPTPLACEHOLDERJob/OutputLocation"):
-            elementOutputLocation.set("Value", elementOutputLocation.get("Value") + " " + str(displayIndex))
-        for elementOutputPrefix in tree.find("SCRIPTPLACEHOLDERJob/OutputPrefix"):
-            elementOutputPrefix.set("Value",newSetupFilename)
-        for elementDatabaseLocation in tree.find("SCRIPTPLACEHOLDERJob/PathResultsDatabase/SCRIPTPLACEHOLDERPathResultsDatabase/Filename/SCRIPTPLACEHOLDERFileDescription/Filename"):
-            elementDatabaseLocation.set("Value", "./" + elementOutputLocation.get("Value")+ "/" + elementOutputPrefix.get("Value") + "." + elementOutputLocation.get("Value") + ".sqlite")   
-            print(elementDatabaseLocation.get("Value"), elementOutputLocation.get("Value"), elementOutputPrefix.get("Value"))
+        with stage('xml_edit', study_area=displayIndex):
+            tree = ET.fromstring(editedStudyArea)
+            for elementOutputLocation in tree.find("SCRIPTPLACEHOLDERJob/OutputLocation"):
+                elementOutputLocation.set("Value", elementOutputLocation.get("Value") + " " + str(displayIndex))
+            for elementOutputPrefix in tree.find("SCRIPTPLACEHOLDERJob/OutputPrefix"):
+                elementOutputPrefix.set("Value",newSetupFilename)
+            for elementDatabaseLocation in tree.find("SCRIPTPLACEHOLDERJob/PathResultsDatabase/SCRIPTPLACEHOLDERPathResultsDatabase/Filename/SCRIPTPLACEHOLDERFileDescription/Filename"):
+                elementDatabaseLocation.set("Value", "./" + elementOutputLocation.get("Value")+ "/" + elementOutputPrefix.get("Value") + "." + elementOutputLocation.get("Value") + ".sqlite")   
+                print(elementDatabaseLocation.get("Value"), elementOutputLocation.get("Value"), elementOutputPrefix.get("Value"))
         
-        if spacingValues is not None:
-            for elementSpacingValue in tree.find(f"SCRIPTPLACEHOLDERJob/Scene/SCRIPTPLACEHOLDERScene/TxRxSetList/SCRIPTPLACEHOLDERTxRxSetList/TxRxSet/SCRIPTPLACEHOLDER{TxRxSet}/Spacing"):
-                elementSpacingValue.set("Value", str(spacingValues[i]))              
-
-        if WaveCarrierFrequency is not None:
-            for elementCarrierValue in tree.find(f"SCRIPTPLACEHOLDERJob/Scene/SCRIPTPLACEHOLDERScene/AntennaList/SCRIPTPLACEHOLDERAntennaList/Antenna/SCRIPTPLACEHOLDER{AntennaType}/Waveform/SCRIPTPLACEHOLDERSinusoid/CarrierFrequency"):
-                elementCarrierValue.set("Value", str(WaveCarrierFrequency[i]))   
-                print('Frequency Carrier Value: ',elementCarrierValue.get("Value"))  
-
-        if CarrierFrequencyTx is not None:
-            for elementCarrierValueTx in tree.find(f"SCRIPTPLACEHOLDERJob/Scene/SCRIPTPLACEHOLDERScene/TxRxSetList/SCRIPTPLACEHOLDERTxRxSetList/TxRxSet/SCRIPTPLACEHOLDERPointSet/Transmitter/SCRIPTPLACEHOLDERTransmitter/Antenna/SCRIPTPLACEHOLDER{AntennaType}/Waveform/SCRIPTPLACEHOLDERSinusoid/CarrierFrequency"):
-                print('Frequency Carrier Value of Tx: ',elementCarrierValueTx.get("Value"))
-                elementCarrierValueTx.set("Value", str(CarrierFrequencyTx[i]))
-
-        if RISPatternsRX is not None:
-            # for elementRISPatternRX in tree.find(f"SCRIPTPLACEHOLDERJob/Scene/SCRIPTPLACEHOLDERScene/AntennaList/SCRIPTPLACEHOLDERAntennaList/Antenna/SCRIPTPLACEHOLDERUserDefinedAntenna/Filename/SCRIPTPLACEHOLDERFileDescription/Filename"):
-            #     elementRISPatternRX.set("Value", "./"+RISPatternsRX[i] + ".uan")
-            #     print('RIS Pattern Value: ',elementRISPatternRX.get("Value"))
-            for elementRISPatternReceiver in tree.find(f"SCRIPTPLACEHOLDERJob/Scene/SCRIPTPLACEHOLDERScene/TxRxSetList/SCRIPTPLACEHOLDERTxRxSetList/TxRxSet/SCRIPTPLACEHOLDERPointSet/Receiver/SCRIPTPLACEHOLDERReceiver/Antenna/SCRIPTPLACEHOLDERUserDefinedAntenna/Filename/SCRIPTPLACEHOLDERFileDescription/Filename"):
-                print('RIS Pattern Value of RX: ',elementRISPatternReceiver.get("Value"))
-                elementRISPatternReceiver.set("Value", "./"+RISPatternsRX[i] + ".uan")
-                print('RIS Pattern Value of RX: ',elementRISPatternReceiver.get("Value"))
+            if spacingValues is not None:
+                for elementSpacingValue in tree.find(f"SCRIPTPLACEHOLDERJob/Scene/SCRIPTPLACEHOLDERScene/TxRxSetList/SCRIPTPLACEHOLDERTxRxSetList/TxRxSet/SCRIPTPLACEHOLDER{TxRxSet}/Spacing"):
+                    elementSpacingValue.set("Value", str(spacingValues[i]))              
+
+            if WaveCarrierFrequency is not None:
+                for elementCarrierValue in tree.find(f"SCRIPTPLACEHOLDERJob/Scene/SCRIPTPLACEHOLDERScene/AntennaList/SCRIPTPLACEHOLDERAntennaList/Antenna/SCRIPTPLACEHOLDER{AntennaType}/Waveform/SCRIPTPLACEHOLDERSinusoid/CarrierFrequency"):
+                    elementCarrierValue.set("Value", str(WaveCarrierFrequency[i]))   
+                    print('Frequency Carrier Value: ',elementCarrierValue.get("Value"))  
+
+            if CarrierFrequencyTx is not None:
+                for elementCarrierValueTx in tree.find(f"SCRIPTPLACEHOLDERJob/Scene/SCRIPTPLACEHOLDERScene/TxRxSetList/SCRIPTPLACEHOLDERTxRxSetList/TxRxSet/SCRIPTPLACEHOLDERPointSet/Transmitter/SCRIPTPLACEHOLDERTransmitter/Antenna/SCRIPTPLACEHOLDER{AntennaType}/Waveform/SCRIPTPLACEHOLDERSinusoid/CarrierFrequency"):
+                    print('Frequency Carrier Value of Tx: ',elementCarrierValueTx.get("Value"))
+                    elementCarrierValueTx.set("Value", str(CarrierFrequencyTx[i]))
+
+            if RISPatternsRX is not None:
+                # for elementRISPatternRX in tree.find(f"SCRIPTPLACEHOLDERJob/Scene/SCRIPTPLACEHOLDERScene/AntennaList/SCRIPTPLACEHOLDERAntennaList/Antenna/SCRIPTPLACEHOLDERUserDefinedAntenna/Filename/SCRIPTPLACEHOLDERFileDescription/Filename"):
+                #     elementRISPatternRX.set("Value", "./"+RISPatternsRX[i] + ".uan")
+                #     print('RIS Pattern Value: ',elementRISPatternRX.get("Value"))
+                for elementRISPatternReceiver in tree.find(f"SCRIPTPLACEHOLDERJob/Scene/SCRIPTPLACEHOLDERScene/TxRxSetList/SCRIPTPLACEHOLDERTxRxSetList/TxRxSet/SCRIPTPLACEHOLDERPointSet/Receiver/SCRIPTPLACEHOLDERReceiver/Antenna/SCRIPTPLACEHOLDERUserDefinedAntenna/Filename/SCRIPTPLACEHOLDERFileDescription/Filename"):
+                    print('RIS Pattern Value of RX: ',elementRISPatternReceiver.get("Value"))
+                    elementRISPatternReceiver.set("Value", "./"+RISPatternsRX[i] + ".uan")
+                    print('RIS Pattern Value of RX: ',elementRISPatternReceiver.get("Value"))
 
             
-        if RISPatternsTX is not None:
-            for elementRISPatternTransmitter in tree.find(f"SCRIPTPLACEHOLDERJob/Scene/SCRIPTPLACEHOLDERScene/TxRxSetList/SCRIPTPLACEHOLDERTxRxSetList/TxRxSet/SCRIPTPLACEHOLDERPointSet/Transmitter/SCRIPTPLACEHOLDERTransmitter/Antenna/SCRIPTPLACEHOLDERUserDefinedAntenna/Filename/SCRIPTPLACEHOLDERFileDescription/Filename"):
-                print('RIS Pattern Value of Tx: ',elementRISPatternTransmitter.get("Value"))
-                elementRISPatternTransmitter.set("Value", "./"+RISPatternsTX[i] + ".uan")
-                print('RIS Pattern Value of Tx: ',elementRISPatternTransmitter.get("Value"))
+            if RISPatternsTX is not None:
+                for elementRISPatternTransmitter in tree.find(f"SCRIPTPLACEHOLDERJob/Scene/SCRIPTPLACEHOLDERScene/TxRxSetList/SCRIPTPLACEHOLDERTxRxSetList/TxRxSet/SCRIPTPLACEHOLDERPointSet/Transmitter/SCRIPTPLACEHOLDERTransmitter/Antenna/SCRIPTPLACEHOLDERUserDefinedAntenna/Filename/SCRIPTPLACEHOLDERFileDescription/Filename"):
+                    print('RIS Pattern Value of Tx: ',elementRISPatternTransmitter.get("Value"))
+                    elementRISPatternTransmitter.set("Value", "./"+RISPatternsTX[i] + ".uan")
+                    print('RIS Pattern Value of Tx: ',elementRISPatternTransmitter.get("Value"))
 
               
 
-        #modify .setup to add the new study area to the project
-        #duplicate existing study area and increment index
-        setupContent = re.sub(r"FirstAvailableStudyAreaNumber.+", "FirstAvailableStudyAreaNumber " + str(fileIndex), setupContent)
-        match = regexes.studyAreaSectionRegex.search(setupContent)
-        studyAreaMatch = "\n"+match.group(0)+"\n"
-        studyAreaMatch = re.sub(r"(begin_<studyarea>.+)", r"\g<0> " + str(displayIndex), studyAreaMatch)
-        studyAreaMatch = re.sub(r"(StudyAreaNumber\s)(\d+)", r"StudyAreaNumber " + str(fileIndex), studyAreaMatch)
-        #insert new study area after the last one in the file
-        for studyAreaPlacementBounds in regexes.studyAreaPlacementRegex.finditer(setupContent):
-            studyAreaMatchTop, studyAreaMatchBottom = studyAreaPlacementBounds.groups()
-        setupContent = regexes.studyAreaPlacementRegex.sub(studyAreaMatchTop + studyAreaMatch + studyAreaMatchBottom, setupContent)        
-
-        #convert the xml to a string to be parsed
-        treestring = ET.tostring(tree, encoding='unicode', method='xml')
-        #undo the modifications to the xml so that it is a valid WI study area again
-        editedTreestring = ""
-        editedTreestring += regexes.studyAreaRevertRegex.sub("remcom::rxapi::", treestring)
-        #save the new study area to a new file
-        newStudyAreaPath = newSetupFilename + "." + studyAreaFilenameSplit[1] + " " + str(displayIndex) + studyAreaFilepathSplit[1]
-        newStudyArea = open(newStudyAreaPath, "w")
-        newStudyArea.write(editedTreestring)
-        newStudyArea.close()
+            #modify .setup to add the new study area to the project
+            #duplicate existing study area and increment index
+            setupContent = re.sub(r"FirstAvailableStudyAreaNumber.+", "FirstAvailableStudyAreaNumber " + str(fileIndex), setupContent)
+            match = regexes.studyAreaSectionRegex.search(setupContent)
+            studyAreaMatch = "\n"+match.group(0)+"\n"
+            studyAreaMatch = re.sub(r"(begin_<studyarea>.+)", r"\g<0> " + str(displayIndex), studyAreaMatch)
+            studyAreaMatch = re.sub(r"(StudyAreaNumber\s)(\d+)", r"StudyAreaNumber " + str(fileIndex), studyAreaMatch)
+            #insert new study area after the last one in the file
+            for studyAreaPlacementBounds in regexes.studyAreaPlacementRegex.finditer(setupContent):
+                studyAreaMatchTop, studyAreaMatchBottom = studyAreaPlacementBounds.groups()
+            setupContent = regexes.studyAreaPlacementRegex.sub(studyAreaMatchTop + studyAreaMatch + studyAreaMatchBottom, setupContent)        
+
+        with stage('write_study_area', study_area=displayIndex):
+            #convert the xml to a string to be parsed
+            treestring = ET.tostring(tree, encoding='unicode', method='xml')
+            #undo the modifications to the xml so that it is a valid WI study area again
+            editedTreestring = ""
+            editedTreestring += regexes.studyAreaRevertRegex.sub("remcom::rxapi::", treestring)
+            #save the new study area to a new file
+            newStudyAreaPath = newSetupFilename + "." + studyAreaFilenameSplit[1] + " " + str(displayIndex) + studyAreaFilepathSplit[1]
+            newStudyArea = open(newStudyAreaPath, "w")
+            newStudyArea.write(editedTreestring)
+            newStudyArea.close()
         i += 1
         fileIndex += 1
         displayIndex += 1
-        #delete any existing cache files to prevent them from being used.
-        projectFiles = os.listdir(os.getcwd())
-        for file in projectFiles:
-            if file.endswith(".cache"):
-                os.remove(file)
-        
-        # Run simulation
-        run_simulation_study(newVersion, wibatchLocation, licenseLocation, initialStudyAreaPath, newStudyArea, studyAreaFilenameSplit)
+        if args.queue is not None:
+            #the workers run the study area
+            queueJobs.append({"studyArea": newStudyArea.name, "output": newStudyArea.name.split(".")[1], "newVersion": newVersion,
+                              "cacheKey": geometry_cache_key(tree, setupContent, regexes), "studyAreaIndex": displayIndex - 1})
+            continue
+
+        # Run simulation (with --cacheMode geometry, each run restores and stores the caches of its own geometry)
+        cacheKey = geometry_cache_key(tree, setupContent, regexes) if cacheMode == "geometry" else None
+        run_simulation_study(newVersion, wibatchLocation, licenseLocation, initialStudyAreaPath, newStudyArea, studyAreaFilenameSplit,
+                             cacheKey=cacheKey, initialCacheKey=initialCacheKey if cacheMode == "geometry" else None,
+                             cacheDir=cacheDir, studyAreaIndex=displayIndex - 1)
 
     #modified setup file
     outSetup = open(newSetupFile,'w')
@@ -313,5 +577,10 @@ if __name__ == "__main__":
     outSetup.writelines(setupContent)
     outSetup.close()
     print("Created new setup file " + newSetupFile)
+
+    if args.queue is not None:
+        jobIds = MCGWorkQueue.WorkQueue(args.queue).add_jobs(queueJobs, sweep=newSetupFilename)
+        print("Added " + str(len(jobIds)) + " jobs to the queue " + args.queue + ", start the workers with --worker --queue " + args.queue)
     
-    print("--- %s seconds ---" % (time.time() - start_time))
\ No newline at end of file
+    print("--- %s seconds ---" % (time.time() - start_time))
+    MCGInstrument.close()
\ No newline at end of file
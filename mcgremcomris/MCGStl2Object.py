@@ -0,0 +1,283 @@
+'''
+name: MCGStl2Object.py
+author: Artan Salihu
+version: 1.0
+status: development
+contact: artan.salihuATtuwien.ac.at
+website: https://www.artansalihu.com, https://mcg-deep-wrt.netlify.app/deep-wrt/utilities/
+date: 2026-10-19
+license: MIT
+dependencies: numpy, re, argparse, sys, time, MCGRemcom.py
+description: Converts binary or ASCII STL files (e.g. the k_i_terrain.stl / k_i_buildings.stl of mcgosmhelperblend) into Wireless InSite
+                .object feature files, without SketchUp (mcgconverterstl2skp). The triangles are read and written in chunks, so the
+                memory does not grow with the size of the STL file. All faces get the material of the object (MATERIALS or a custom
+                permittivity/conductivity). With face merging, two consecutive triangles of a chunk that share an edge, are coplanar
+                and form a convex quad are written as one 4-vertex face (the exporters write the two triangles of a quad one after
+                the other), which roughly halves the number of faces of buildings.
+                For CLI it uses the following arguments:
+                    --stl: STL file(s)
+                    --output: Output .object file(s) (default: the STL files with .object)
+                    --material: Material of the faces, one of MATERIALS, or Custom with --permittivity and --conductivity
+                    --noMerge: Write every triangle as a face
+                    --help_options: Print options
+
+                Example for CLI:
+                    python MCGStl2Object.py --stl 0_1_buildings.stl 0_1_terrain.stl --material Concrete
+'''
+import os
+import re
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from MCGRemcom import RegexContainer
+
+# Record of a triangle in a binary STL file (50 bytes)
+STL_DTYPE = np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attribute', '<u2')])
+
+# Dielectric half-space materials: (permittivity, conductivity S/m), ITU-R P.2040 at about 1 GHz
+MATERIALS = {
+    "Concrete": (5.31, 0.0326),
+    "Brick": (3.75, 0.038),
+    "Glass": (6.27, 0.0043),
+    "Wood": (1.99, 0.0047),
+    "Ground": (15.0, 0.035),
+}
+
+OBJECT_HEADER = """Format type:keyword version: 1.1.0
+begin_<object> {name}
+begin_<reference>
+cartesian
+longitude 0.000000000000000
+latitude 0.000000000000000
+visible no
+sealevel
+end_<reference>
+begin_<Material> {material}
+Material 0
+DielectricLayer
+conductivity {conductivity:.3e}
+permittivity {permittivity:.6f}
+roughness 0.000e+00
+thickness 0.000e+00
+end_<Material>
+begin_<structure_group>
+begin_<structure>
+begin_<sub_structure>
+"""
+
+OBJECT_FOOTER = """end_<sub_structure>
+end_<structure>
+end_<structure_group>
+end_<object>
+"""
+
+def is_binary_stl(filename):
+    '''
+    Check whether an STL file is binary: its size matches the triangle count of the header
+    (ASCII files start with "solid", but so do some binary files).
+    '''
+    with open(filename, 'rb') as f:
+        header = f.read(84)
+    if len(header) < 84:
+        return False
+    count = int(np.frombuffer(header[80:84], dtype='<u4')[0])
+    return os.path.getsize(filename) == 84 + count * STL_DTYPE.itemsize
+
+def iter_stl_triangles(filename, chunkSize=100000):
+    '''
+    Read the triangles of a binary or ASCII STL file in chunks.
+
+    Parameters
+    ----------
+    filename : str
+        The STL file
+    chunkSize : int, optional
+        The number of triangles per chunk
+    Returns
+    -------
+    generator of arrays of shape (n, 3, 3) with the corners of the triangles (float64)
+    '''
+    if is_binary_stl(filename):
+        with open(filename, 'rb') as f:
+            f.seek(80)
+            count = int(np.frombuffer(f.read(4), dtype='<u4')[0])
+            for start in range(0, count, chunkSize):
+                records = np.fromfile(f, dtype=STL_DTYPE, count=min(chunkSize, count - start))
+                yield records['vertices'].astype(np.float64)
+        return
+    # ASCII: only the "vertex x y z" lines are needed, three per facet
+    vertexLines = []
+    with open(filename, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("vertex"):
+                vertexLines.append(line[6:])
+                if len(vertexLines) == 3 * chunkSize:
+                    yield np.array(" ".join(vertexLines).split(), dtype=np.float64).reshape(-1, 3, 3)
+                    vertexLines = []
+    if vertexLines:
+        yield np.array(" ".join(vertexLines).split(), dtype=np.float64).reshape(-1, 3, 3)
+
+def merge_triangle_pairs(triangles, tolerance=1e-6, angleTolerance=1e-4):
+    '''
+    Merge consecutive triangles that share an edge, are coplanar and form a convex quad.
+
+    Parameters
+    ----------
+    triangles : array
+        The corners of the triangles, shape (n, 3, 3)
+    tolerance : float, optional
+        Distance below which two vertices are the same
+    angleTolerance : float, optional
+        1 - cos of the largest angle between the normals of coplanar triangles
+    Returns
+    -------
+    quads : array
+        The corners of the merged faces, shape (m, 4, 3), in the orientation of the triangles
+    remaining : array
+        The corners of the triangles that were not merged, shape (n - 2m, 3, 3)
+    '''
+    n = len(triangles)
+    if n < 2:
+        return np.empty((0, 4, 3)), triangles
+    a = triangles[:-1]
+    b = triangles[1:]
+    # same[:, j, l]: vertex j of the triangle equals vertex l of the next triangle
+    same = np.all(np.abs(a[:, :, None, :] - b[:, None, :, :]) < tolerance, axis=3)
+    shared = same.sum(axis=(1, 2)) == 2
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    lengths = np.linalg.norm(normals, axis=1)
+    normals = np.divide(normals, lengths[:, None], out=np.zeros_like(normals), where=lengths[:, None] > 0)
+    coplanar = np.einsum('ij,ij->i', normals[:-1], normals[1:]) > 1 - angleTolerance
+
+    # Quad: the vertex m of a not in b, then the shared edge of a with the vertex of b not in a inserted
+    m = np.argmin(same.any(axis=2), axis=1)
+    extra = np.argmin(same.any(axis=1), axis=1)
+    rows = np.arange(n - 1)
+    quads = np.stack((a[rows, m], a[rows, (m + 1) % 3], b[rows, extra], a[rows, (m + 2) % 3]), axis=1)
+    edges = np.roll(quads, -1, axis=1) - quads
+    turns = np.cross(edges, np.roll(edges, -1, axis=1))
+    convex = np.all(np.einsum('ijk,ik->ij', turns, normals[:-1]) > 0, axis=1)
+    candidate = shared & coplanar & convex & (lengths[:-1] > 0) & (lengths[1:] > 0)
+
+    # Non-overlapping pairs: every other candidate of a run of consecutive candidates
+    index = np.arange(n - 1)
+    runStart = candidate & ~np.concatenate(([False], candidate[:-1]))
+    startIndex = np.maximum.accumulate(np.where(runStart, index, 0))
+    selected = candidate & ((index - startIndex) % 2 == 0)
+    merged = np.zeros(n, dtype=bool)
+    merged[:-1] |= selected
+    merged[1:] |= selected
+    return quads[selected], triangles[~merged]
+
+def format_faces(faces, precision=6):
+    '''
+    Format faces of shape (n, k, 3) as begin_<face> blocks of a .object file.
+    '''
+    if len(faces) == 0:
+        return ""
+    vertexFormat = " ".join(["%." + str(precision) + "f"] * 3) + "\n"
+    template = "begin_<face> \nMaterial 0\nnVertices " + str(faces.shape[1]) + "\n" + vertexFormat * faces.shape[1] + "end_<face>\n"
+    return "".join([template % tuple(row) for row in faces.reshape(len(faces), -1).tolist()])
+
+def stl_to_object(stl, output, material="Concrete", permittivity=None, conductivity=None, merge=True, chunkSize=100000, precision=6, name=None):
+    '''
+    Convert an STL file to a Wireless InSite .object file.
+
+    Parameters
+    ----------
+    stl : str
+        The STL file (binary or ASCII)
+    output : str
+        The .object file
+    material : str, optional
+        The name of the material, one of MATERIALS or any name with permittivity and conductivity
+    permittivity, conductivity : float, optional
+        The relative permittivity and the conductivity (S/m), override the values of MATERIALS
+    merge : bool, optional
+        Merge consecutive coplanar triangles into quads
+    chunkSize : int, optional
+        The number of triangles read and written at once
+    precision : int, optional
+        Number of decimals of the coordinates
+    name : str, optional
+        The name of the object (default: the name of the output file)
+    Returns
+    -------
+    stats : dict
+        The number of triangles read and of faces written
+    '''
+    defaultPermittivity, defaultConductivity = MATERIALS.get(material, (None, None))
+    permittivity = defaultPermittivity if permittivity is None else permittivity
+    conductivity = defaultConductivity if conductivity is None else conductivity
+    if permittivity is None or conductivity is None:
+        raise ValueError("Unknown material " + material + ", give its permittivity and conductivity or use one of " + ", ".join(MATERIALS))
+    name = name or re.sub(r"\.object$", "", output.replace("\\", "/").split("/")[-1])
+    stats = {"triangles": 0, "faces": 0, "quads": 0}
+    with open(output, 'w') as f:
+        f.write(OBJECT_HEADER.format(name=name, material=material, permittivity=permittivity, conductivity=conductivity))
+        for triangles in iter_stl_triangles(stl, chunkSize):
+            stats["triangles"] += len(triangles)
+            if merge:
+                quads, triangles = merge_triangle_pairs(triangles)
+                f.write(format_faces(quads, precision))
+                stats["quads"] += len(quads)
+                stats["faces"] += len(quads)
+            f.write(format_faces(triangles, precision))
+            stats["faces"] += len(triangles)
+        f.write(OBJECT_FOOTER)
+    return stats
+
+def read_object_faces(filename):
+    '''
+    Read the faces of a .object file back (e.g. to check a conversion), using the regexes of MCGRemcom.py.
+
+    Returns
+    -------
+    name : str
+        The name of the object
+    faces : list of arrays
+        The vertices of each face, shape (k, 3)
+    '''
+    regexes = RegexContainer()
+    with open(filename, 'r') as f:
+        content = f.read()
+    name = ""
+    for line in content.splitlines():
+        if regexes.objectFilenameRegex.match(line):
+            name = regexes.objectFilenameRegex.sub("", line).strip()
+            break
+    faces = []
+    for face in re.findall(r"begin_<face>.*?end_<face>", content, re.DOTALL):
+        vertices = [line.split() for line in face.splitlines() if line and regexes.objectVertexRegex.match(line)]
+        faces.append(np.array(vertices, dtype=np.float64))
+    return name, faces
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert STL files to Wireless InSite .object files - MCG-Remcom - www.artansalihu.com')
+    parser.add_argument('--stl', nargs='+', default=["buildings.stl"], help='STL file(s), binary or ASCII')
+    parser.add_argument('--output', nargs='+', default=None, help='Output .object file(s) (default: the STL files with .object)')
+    parser.add_argument('--material', default="Concrete", help='Material of the faces: ' + ", ".join(MATERIALS) + ', or any name with --permittivity and --conductivity')
+    parser.add_argument('--permittivity', type=float, default=None, help='Relative permittivity of the material')
+    parser.add_argument('--conductivity', type=float, default=None, help='Conductivity of the material in S/m')
+    parser.add_argument('--noMerge', action='store_true', help='Write every triangle as a face (no merging of coplanar triangles into quads)')
+    parser.add_argument('--chunkSize', type=int, default=100000, help='Number of triangles read and written at once')
+    parser.add_argument('--help_options', action='store_true', help='Print options')
+    args = parser.parse_args()
+    if args.help_options:
+        parser.print_help()
+        sys.exit()
+
+    outputs = args.output or [re.sub(r"\.stl$", "", stl, flags=re.IGNORECASE) + ".object" for stl in args.stl]
+    if len(outputs) != len(args.stl):
+        parser.error("--output needs one file per STL file")
+    for stl, output in zip(args.stl, outputs):
+        start_time = time.time()
+        stats = stl_to_object(stl, output, material=args.material, permittivity=args.permittivity, conductivity=args.conductivity,
+                              merge=not args.noMerge, chunkSize=args.chunkSize)
+        print(stl + " -> " + output + ": " + str(stats["triangles"]) + " triangles, " + str(stats["faces"]) + " faces (" + str(stats["quads"]) + " quads)"
+              + " in %.1f s" % (time.time() - start_time))
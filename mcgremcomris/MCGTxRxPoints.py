@@ -0,0 +1,227 @@
+'''
+name: MCGTxRxPoints.py
+author: Artan Salihu
+version: 1.0
+status: development
+contact: artan.salihuATtuwien.ac.at
+website: https://www.artansalihu.com, https://mcg-deep-wrt.netlify.app/deep-wrt/utilities/
+date: 2026-10-19
+license: MIT
+dependencies: numpy, xml, re, argparse, sys, time, MCGRemcom.py
+description: Places many Tx/Rx points in a PointSet of a Wireless InSite study area XML from a NumPy array of shape (N, 3) or (N, 2).
+                The control points are not built as ElementTree elements: the first control point of the PointSet is used as a
+                template (or DEFAULT_POINT_TEMPLATE if the PointSet has no point), the study area is serialized once around a
+                marker and the points are written in chunks into the file, so 100k+ points take about a second and little memory.
+                Uses the same placeholder for the remcom::rxapi:: prefix as MCGRemcom.py.
+                For CLI it uses the following arguments:
+                    --studyArea: Study area XML file (only valid for X3D model)
+                    --points: Points as .npy, .csv or .txt (x y [z] per row), e.g. the centers of the grid cells of mcgosm_modules
+                    --output: Output study area XML file
+                    --txrxSet: Index of the PointSet in the TxRxSetList (default: 0, the first PointSet)
+                    --height: z of the points if they have only x and y
+                    --help_options: Print options
+
+                Example for CLI:
+                    python MCGTxRxPoints.py --studyArea 03_Automate_WIS.Study_Zero.xml --points grid_centers.npy --height 1.5 --output 03_Automate_WIS.Study_Grid.xml
+
+                You can also import the functions into your own script:
+                    from MCGTxRxPoints import read_study_area, write_point_set
+                    tree = read_study_area("03_Automate_WIS.Study_Zero.xml")
+                    write_point_set(tree, points, "03_Automate_WIS.Study_Grid.xml")
+'''
+import re
+import xml.etree.ElementTree as ET
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from MCGRemcom import RegexContainer
+
+PLACEHOLDER = "SCRIPTPLACEHOLDER"
+MARKER = "MCGCONTROLPOINTSMARKER"
+
+# Control point of a PointSet if the study area has none to copy (placeholders X, Y and Z)
+DEFAULT_POINT_TEMPLATE = ('<ProjectedPoint><SCRIPTPLACEHOLDERCartesianPoint>'
+                          '<X><SCRIPTPLACEHOLDERDouble Value="__MCG_X__" /></X>'
+                          '<Y><SCRIPTPLACEHOLDERDouble Value="__MCG_Y__" /></Y>'
+                          '<Z><SCRIPTPLACEHOLDERDouble Value="__MCG_Z__" /></Z>'
+                          '</SCRIPTPLACEHOLDERCartesianPoint></ProjectedPoint>')
+
+def local_tag(element):
+    '''
+    The tag of an element without the placeholder of the remcom::rxapi:: prefix.
+    '''
+    return element.tag.replace(PLACEHOLDER, "")
+
+def read_study_area(studyArea):
+    '''
+    Read a study area XML file with the remcom::rxapi:: prefix replaced by the placeholder, as MCGRemcom.py does.
+
+    Parameters
+    ----------
+    studyArea : str
+        The study area XML file
+    Returns
+    -------
+    tree : xml.etree.ElementTree.Element
+    '''
+    regexes = RegexContainer()
+    with open(studyArea, 'r') as f:
+        editedStudyArea = regexes.studyAreaPrefixRegex.sub(PLACEHOLDER, f.read())
+    return ET.fromstring(editedStudyArea)
+
+def find_point_list(tree, txrxSet=0):
+    '''
+    Find the element holding the control points of a PointSet.
+
+    Parameters
+    ----------
+    tree : xml.etree.ElementTree.Element
+        The study area
+    txrxSet : int, optional
+        The index of the PointSet among the PointSets of the study area
+    Returns
+    -------
+    pointList : xml.etree.ElementTree.Element
+        The child of ControlPoints (e.g. ProjectedPointList) whose children are the points
+    '''
+    pointSets = [element for element in tree.iter() if local_tag(element) == "PointSet" and element.tag.startswith(PLACEHOLDER)]
+    if txrxSet >= len(pointSets):
+        raise ValueError("The study area has " + str(len(pointSets)) + " PointSets, no PointSet " + str(txrxSet))
+    controlPoints = [element for element in pointSets[txrxSet].iter() if local_tag(element) == "ControlPoints"]
+    if not controlPoints or len(controlPoints[0]) == 0:
+        raise ValueError("PointSet " + str(txrxSet) + " has no ControlPoints list")
+    return controlPoints[0][0]
+
+def point_template(pointList):
+    '''
+    Build the format string of a control point from the first point of the list.
+
+    Returns
+    -------
+    template : str
+        The XML of a point with %s in place of the X, Y and Z values
+    order : list of int
+        The indices of the coordinates (0: x, 1: y, 2: z) in the order of the %s
+    '''
+    if len(pointList) == 0:
+        text = DEFAULT_POINT_TEMPLATE
+    else:
+        point = pointList[0]
+        values = {}
+        for element in point.iter():
+            if local_tag(element) in ("X", "Y", "Z"):
+                valueElements = [child for child in element.iter() if child.get("Value") is not None]
+                values[local_tag(element)] = valueElements[0]
+        if len(values) != 3:
+            raise ValueError("Cannot find the X, Y and Z values of the control point " + ET.tostring(point, encoding='unicode'))
+        saved = {axis: element.get("Value") for axis, element in values.items()}
+        for axis, element in values.items():
+            element.set("Value", "__MCG_" + axis + "__")
+        text = ET.tostring(point, encoding='unicode', method='xml')
+        for axis, element in values.items():
+            element.set("Value", saved[axis])
+    positions = sorted((text.index("__MCG_" + axis + "__"), index) for index, axis in enumerate("XYZ"))
+    template = text.replace("%", "%%")
+    for axis in "XYZ":
+        template = template.replace("__MCG_" + axis + "__", "%s")
+    return template, [index for _, index in positions]
+
+def as_points(points, height=0.):
+    '''
+    Convert an array of shape (N, 3), or (N, 2) with z = height, to float64 points of shape (N, 3).
+    '''
+    points = np.asarray(points, dtype=np.float64)
+    if points.ndim != 2 or points.shape[1] not in (2, 3):
+        raise ValueError("Expected points of shape (N, 3) or (N, 2), got " + str(points.shape))
+    if points.shape[1] == 2:
+        points = np.column_stack((points, np.full(len(points), height)))
+    return points
+
+def write_point_set(tree, points, output, txrxSet=0, height=0., precision=6, chunkSize=10000):
+    '''
+    Write the study area to a file with the control points of a PointSet replaced by the points.
+    The tree is not changed.
+
+    Parameters
+    ----------
+    tree : xml.etree.ElementTree.Element
+        The study area (read_study_area)
+    points : array
+        The points, shape (N, 3) or (N, 2)
+    output : str
+        The output study area XML file
+    txrxSet : int, optional
+        The index of the PointSet
+    height : float, optional
+        z of the points if they have only x and y
+    precision : int, optional
+        Number of decimals of the coordinates
+    chunkSize : int, optional
+        Number of points formatted and written at once
+    Returns
+    -------
+    count : int
+        The number of points written
+    '''
+    regexes = RegexContainer()
+    points = as_points(points, height)
+    pointList = find_point_list(tree, txrxSet)
+    template, order = point_template(pointList)
+
+    # Serialize the study area once with a marker in place of the points
+    children = list(pointList)
+    text = pointList.text
+    for child in children:
+        pointList.remove(child)
+    pointList.text = MARKER
+    try:
+        treeString = ET.tostring(tree, encoding='unicode', method='xml')
+    finally:
+        pointList.text = text
+        pointList.extend(children)
+    head, tail = regexes.studyAreaRevertRegex.sub("remcom::rxapi::", treeString).split(MARKER)
+    template = regexes.studyAreaRevertRegex.sub("remcom::rxapi::", template)
+
+    # The coordinates are formatted column by column with NumPy, the points joined in chunks
+    with open(output, 'w') as f:
+        f.write(head)
+        for start in range(0, len(points), chunkSize):
+            chunk = points[start:start + chunkSize]
+            columns = [np.char.mod("%." + str(precision) + "f", chunk[:, index]) for index in order]
+            f.write("".join([template % values for values in zip(*columns)]))
+        f.write(tail)
+    return len(points)
+
+def read_points(filename):
+    '''
+    Read points from a .npy file or a text file (x y [z] per row, separated by spaces or commas, # for comments).
+    '''
+    if filename.endswith(".npy"):
+        return np.load(filename)
+    with open(filename, 'r') as f:
+        first = f.readline()
+    return np.loadtxt(filename, delimiter="," if "," in first else None, ndmin=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Bulk PointSet control points of a WIS study area - MCG-Remcom - www.artansalihu.com')
+    parser.add_argument('--studyArea', default="RIS_Remcom_Le.RIS_Remcom_Le_Zero.xml", help='Study area XML file (only valid for X3D model)')
+    parser.add_argument('--points', default="points.npy", help='Points as .npy, .csv or .txt (x y [z] per row)')
+    parser.add_argument('--output', default=None, help='Output study area XML file (default: the study area with _points before .xml)')
+    parser.add_argument('--txrxSet', type=int, default=0, help='Index of the PointSet in the study area')
+    parser.add_argument('--height', type=float, default=1.5, help='z of the points if they have only x and y')
+    parser.add_argument('--precision', type=int, default=6, help='Number of decimals of the coordinates')
+    parser.add_argument('--help_options', action='store_true', help='Print options')
+    args = parser.parse_args()
+    if args.help_options:
+        parser.print_help()
+        sys.exit()
+
+    start_time = time.time()
+    output = args.output or re.sub(r"\.xml$", "", args.studyArea) + "_points.xml"
+    count = write_point_set(read_study_area(args.studyArea), read_points(args.points), output, txrxSet=args.txrxSet, height=args.height, precision=args.precision)
+    print("Wrote " + str(count) + " points to " + output)
+    print("--- %s seconds ---" % (time.time() - start_time))
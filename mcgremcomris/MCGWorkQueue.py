@@ -0,0 +1,356 @@
+'''
+name: MCGWorkQueue.py
+author: Artan Salihu
+version: 1.0
+status: development
+contact: artan.salihuATtuwien.ac.at
+website: https://www.artansalihu.com, https://mcg-deep-wrt.netlify.app/deep-wrt/utilities/
+date: 2026-10-19
+license: MIT
+dependencies: sqlite3, json, os, socket, threading, time, argparse, multiprocessing
+description: A work queue in a sqlite file for running sweeps of MCGRemcom.py on several machines.
+                The sweep generator (MCGRemcom.py --queue) adds one job per study area variant, and any number of workers
+                (MCGRemcom.py --worker --queue, on any node that can open the file) claim the jobs one by one, run them and
+                report the result. A claim is atomic (BEGIN IMMEDIATE), so every job is run by one worker at a time.
+                A worker updates the heartbeat of its job while it runs; a job whose heartbeat is older than stale_after seconds
+                (the worker crashed or the node went down) is given to the next worker that asks, until max_attempts is reached.
+                The status of the jobs: pending -> running -> done | failed.
+
+                For CLI it uses the following commands:
+                    status: Print the number of jobs per status and the failed jobs
+                    retry: Set the failed jobs back to pending
+                    demo: Run a local sweep of stub jobs with several worker processes and check that every job ran exactly once
+
+                Example for CLI:
+                    python MCGWorkQueue.py status --queue sweep_queue.sqlite
+                    python MCGWorkQueue.py demo --queue demo_queue.sqlite --jobs 50 --workers 4 --help_options
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import socket
+import sqlite3
+import sys
+import threading
+import time
+
+
+class WorkQueue:
+    """
+    Jobs in a sqlite file. Every method uses its own short connection, so a queue object can be shared by threads
+    and the file can be on a network share. The path is made absolute, so a change of the working directory does not
+    change the queue.
+    """
+    def __init__(self, path, timeout=60.):
+        self.path = os.path.abspath(path)
+        self.timeout = timeout
+        with self._connect() as con:
+            con.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sweep TEXT,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 3,
+                created_at REAL,
+                claimed_at REAL,
+                heartbeat_at REAL,
+                finished_at REAL,
+                result TEXT,
+                error TEXT)''')
+            con.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, job_id)')
+
+    def _connect(self):
+        # isolation_level=None: the transactions are explicit (BEGIN IMMEDIATE takes the write lock at once)
+        con = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        return _Closing(con)
+
+    def add_jobs(self, payloads, sweep=None, max_attempts=3):
+        '''
+        Add jobs to the queue.
+
+        Parameters
+        ----------
+        payloads : list of dict
+            The description of each job (JSON serializable)
+        sweep : str, optional
+            The name of the sweep the jobs belong to
+        max_attempts : int, optional
+            How often a job is claimed again after its worker went stale
+        Returns
+        -------
+        job_ids : list of int
+        '''
+        now = time.time()
+        job_ids = []
+        with self._connect() as con:
+            con.execute('BEGIN IMMEDIATE')
+            for payload in payloads:
+                cursor = con.execute('INSERT INTO jobs (sweep, payload, max_attempts, created_at) VALUES (?, ?, ?, ?)',
+                                     (sweep, json.dumps(payload), max_attempts, now))
+                job_ids.append(cursor.lastrowid)
+            con.execute('COMMIT')
+        return job_ids
+
+    def claim(self, worker, stale_after=300.):
+        '''
+        Claim the oldest pending job. Jobs of stale workers are recovered first.
+
+        Parameters
+        ----------
+        worker : str
+            The id of the worker
+        stale_after : float, optional
+            Seconds without heartbeat after which a running job is recovered
+        Returns
+        -------
+        job : tuple or None
+            (job_id, payload) or None if there is no pending job
+        '''
+        now = time.time()
+        with self._connect() as con:
+            con.execute('BEGIN IMMEDIATE')
+            try:
+                con.execute("UPDATE jobs SET status = 'failed', finished_at = ?, error = 'stale claim of ' || worker "
+                            "WHERE status = 'running' AND heartbeat_at < ? AND attempts >= max_attempts", (now, now - stale_after))
+                con.execute("UPDATE jobs SET status = 'pending', worker = NULL "
+                            "WHERE status = 'running' AND heartbeat_at < ?", (now - stale_after,))
+                row = con.execute("SELECT job_id, payload FROM jobs WHERE status = 'pending' ORDER BY job_id LIMIT 1").fetchone()
+                if row is not None:
+                    con.execute("UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, claimed_at = ?, heartbeat_at = ? "
+                                "WHERE job_id = ?", (worker, now, now, row[0]))
+                con.execute('COMMIT')
+            except BaseException:
+                con.execute('ROLLBACK')
+                raise
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def heartbeat(self, job_id, worker):
+        '''
+        Update the heartbeat of a running job. Returns False if the worker lost the claim (the job was recovered).
+        '''
+        with self._connect() as con:
+            cursor = con.execute("UPDATE jobs SET heartbeat_at = ? WHERE job_id = ? AND worker = ? AND status = 'running'",
+                                 (time.time(), job_id, worker))
+        return cursor.rowcount == 1
+
+    def finish(self, job_id, worker, result=None, error=None):
+        '''
+        Mark a running job as done (error is None) or failed. Returns False if the worker lost the claim.
+        '''
+        status = 'done' if error is None else 'failed'
+        with self._connect() as con:
+            cursor = con.execute("UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ? WHERE job_id = ? AND worker = ? AND status = 'running'",
+                                 (status, time.time(), json.dumps(result), error, job_id, worker))
+        return cursor.rowcount == 1
+
+    def retry_failed(self):
+        '''
+        Set the failed jobs back to pending (with new attempts). Returns the number of jobs.
+        '''
+        with self._connect() as con:
+            cursor = con.execute("UPDATE jobs SET status = 'pending', worker = NULL, attempts = 0, error = NULL WHERE status = 'failed'")
+        return cursor.rowcount
+
+    def status(self):
+        '''
+        Returns a dictionary with the number of jobs per status.
+        '''
+        with self._connect() as con:
+            return dict(con.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+    def jobs(self, status=None):
+        '''
+        Returns the jobs (optionally with the given status) as a list of dictionaries.
+        '''
+        with self._connect() as con:
+            con.row_factory = sqlite3.Row
+            if status is None:
+                rows = con.execute('SELECT * FROM jobs ORDER BY job_id').fetchall()
+            else:
+                rows = con.execute('SELECT * FROM jobs WHERE status = ? ORDER BY job_id', (status,)).fetchall()
+        return [dict(row) for row in rows]
+
+
+class _Closing:
+    # sqlite3 connections used as context managers do not close, this one does
+    def __init__(self, con):
+        self.con = con
+
+    def __enter__(self):
+        return self.con
+
+    def __exit__(self, *exc):
+        self.con.close()
+
+
+def default_worker_id():
+    '''
+    The id of a worker: host name and process id.
+    '''
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def run_worker(queue_path, handler, worker=None, heartbeat_interval=30., stale_after=300., poll_interval=10., exit_when_empty=True, max_jobs=None):
+    '''
+    Claim and run jobs until the queue is empty.
+
+    Parameters
+    ----------
+    queue_path : str
+        The sqlite file of the queue
+    handler : callable
+        Runs a job: handler(payload) returns a JSON serializable result or raises an exception (the job fails)
+    worker : str, optional
+        The id of the worker. The default is host name and process id
+    heartbeat_interval : float, optional
+        Seconds between two heartbeats of the running job
+    stale_after : float, optional
+        Seconds without heartbeat after which the jobs of other workers are recovered (larger than heartbeat_interval
+        and the clock difference between the nodes)
+    poll_interval : float, optional
+        Seconds to wait for new jobs if exit_when_empty is False
+    exit_when_empty : bool, optional
+        Return when there is no pending job (otherwise wait for new jobs)
+    max_jobs : int, optional
+        Return after this number of jobs
+    Returns
+    -------
+    counts : dict
+        The number of done and failed jobs of this worker
+    '''
+    queue = WorkQueue(queue_path)
+    worker = worker or default_worker_id()
+    counts = {'done': 0, 'failed': 0}
+    while max_jobs is None or counts['done'] + counts['failed'] < max_jobs:
+        job = queue.claim(worker, stale_after=stale_after)
+        if job is None:
+            if exit_when_empty:
+                break
+            time.sleep(poll_interval)
+            continue
+        job_id, payload = job
+        print(f'{worker}: running job {job_id}')
+        stop = threading.Event()
+        def beat():
+            while not stop.wait(heartbeat_interval):
+                if not queue.heartbeat(job_id, worker):
+                    print(f'{worker}: lost the claim of job {job_id}')
+                    return
+        heartbeat_thread = threading.Thread(target=beat, daemon=True)
+        heartbeat_thread.start()
+        try:
+            result = handler(payload)
+            error = None
+        except Exception as e:
+            result = None
+            error = repr(e)
+        finally:
+            stop.set()
+            heartbeat_thread.join()
+        queue.finish(job_id, worker, result=result, error=error)
+        counts['done' if error is None else 'failed'] += 1
+        print(f'{worker}: job {job_id} ' + ('done' if error is None else 'failed: ' + error))
+    return counts
+
+
+def stub_simulator(payload):
+    '''
+    A stand-in for wibatch.exe for local tests: sleeps payload["seconds"] and fails with probability payload["fail"].
+    Every run is appended to the file payload["log"] (if given) as the job number and the process id.
+    '''
+    if payload.get('log'):
+        with open(payload['log'], 'a') as f:
+            f.write(f'{payload["job"]} {os.getpid()}\n')
+    time.sleep(payload.get('seconds', 0.05))
+    if random.random() < payload.get('fail', 0.):
+        raise RuntimeError('stub simulator failure')
+    return {'job': payload['job'], 'pid': os.getpid()}
+
+
+def _demo_worker(queue_path, crash):
+    if crash:
+        # Claim a job and die without finishing it, the job must be recovered as stale
+        queue = WorkQueue(queue_path)
+        queue.claim(default_worker_id())
+        os._exit(1)
+    run_worker(queue_path, stub_simulator, heartbeat_interval=0.2, stale_after=1.)
+
+
+def run_demo(queue_path, n_jobs=50, n_workers=4, seconds=0.05, fail=0.):
+    '''
+    Run n_jobs stub jobs with n_workers local worker processes (and one that crashes after its claim) and check that
+    every job finished and was run exactly once (from the log of the stub runs, next to the queue), and that the job
+    of the crashed worker was recovered (2 attempts).
+
+    Returns
+    -------
+    ok : bool
+    '''
+    log_path = queue_path + '.runs.log'
+    for path in (queue_path, log_path):
+        if os.path.exists(path):
+            os.remove(path)
+    queue = WorkQueue(queue_path)
+    queue.add_jobs([{'job': i, 'seconds': seconds, 'fail': fail, 'log': os.path.abspath(log_path)} for i in range(n_jobs)], sweep='demo')
+    context = multiprocessing.get_context('spawn')
+    crashed = context.Process(target=_demo_worker, args=(queue_path, True))
+    crashed.start()
+    crashed.join()
+    crashed_jobs = [job['job_id'] for job in queue.jobs('running')]
+    # Wait until the claim of the crashed worker is stale
+    time.sleep(1.5)
+    start_time = time.time()
+    workers = [context.Process(target=_demo_worker, args=(queue_path, False)) for _ in range(n_workers)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+    jobs = queue.jobs()
+    finished = [job for job in jobs if job['status'] in ('done', 'failed')]
+    runs = {}
+    if os.path.exists(log_path):
+        with open(log_path, 'r') as f:
+            for line in f:
+                job = int(line.split()[0])
+                runs[job] = runs.get(job, 0) + 1
+    repeated = {job: n for job, n in runs.items() if n != 1}
+    missing = [job for job in range(n_jobs) if job not in runs]
+    recovered = [job['attempts'] == 2 for job in jobs if job['job_id'] in crashed_jobs]
+    print(f'{len(jobs)} jobs, {queue.status()}, {len({job["worker"] for job in jobs})} workers, {time.time() - start_time:.1f} s')
+    if repeated or missing:
+        print(f'Jobs run more than once: {repeated}, jobs not run: {missing}')
+    print(f'Jobs of the crashed worker: {crashed_jobs}, recovered: {recovered}')
+    return len(finished) == n_jobs and not repeated and not missing and len(crashed_jobs) == 1 and all(recovered)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Work queue for MCGRemcom sweeps - MCG-Remcom - www.artansalihu.com')
+    parser.add_argument('command', nargs='?', default='status', choices=['status', 'retry', 'demo'], help='status, retry (failed jobs) or demo (local stub sweep)')
+    parser.add_argument('--queue', default='sweep_queue.sqlite', help='sqlite file of the queue')
+    parser.add_argument('--jobs', type=int, default=50, help='demo: number of stub jobs')
+    parser.add_argument('--workers', type=int, default=4, help='demo: number of worker processes')
+    parser.add_argument('--seconds', type=float, default=0.05, help='demo: run time of a stub job')
+    parser.add_argument('--fail', type=float, default=0., help='demo: probability that a stub job fails')
+    parser.add_argument('--help_options', action='store_true', help='Print options')
+    args = parser.parse_args()
+    if args.help_options:
+        parser.print_help()
+        sys.exit()
+
+    if args.command == 'demo':
+        ok = run_demo(args.queue, n_jobs=args.jobs, n_workers=args.workers, seconds=args.seconds, fail=args.fail)
+        print('Every job finished exactly once' if ok else 'Some jobs did not finish exactly once')
+        sys.exit(0 if ok else 1)
+
+    queue = WorkQueue(args.queue)
+    if args.command == 'retry':
+        print(f'{queue.retry_failed()} failed jobs set back to pending')
+    print(queue.status())
+    for job in queue.jobs('failed'):
+        print(f'job {job["job_id"]} ({job["worker"]}, {job["attempts"]} attempts): {job["error"]}')
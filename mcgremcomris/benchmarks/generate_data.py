@@ -0,0 +1,163 @@
+'''
+name: generate_data.py
+author: Artan Salihu
+version: 1.0
+status: development
+contact: artan.salihuATtuwien.ac.at
+website: https://www.artansalihu.com, https://mcg-deep-wrt.netlify.app/deep-wrt/utilities/
+date: 2026-10-19
+license: MIT
+dependencies: numpy, sqlite3
+description: Generators of synthetic inputs for the benchmarks of the Remcom scripts (see run_benchmarks.py):
+    - make_remcom_sqlite: a Wireless InSite path results database with the tables channel, path, path_utd, rx and tx
+      (only the columns read by MCGReadRemcomPaths.py) at a configurable scale
+    - make_p2m_files: received power (.p2m) files as read by read_p2m_power
+    - make_cst_farfield: a CST farfield export as read by MCGCst2UanConverter
+The values are random but have the right types and ranges, with a fixed seed the files are reproducible.
+
+Example:
+    python generate_data.py --out data --n_tx 4 --n_rx 1000 --paths 25
+'''
+
+import argparse
+import os
+import sqlite3
+import sys
+
+import numpy as np
+
+
+def make_remcom_sqlite(filename, n_tx=2, n_rx=1000, paths_per_channel=25, sub_antennas=1, seed=0, batch_size=100000):
+  '''
+  Writes a synthetic Wireless InSite path results database. Every tx-rx pair is a channel with paths_per_channel
+  paths and each path has one path_utd row per tx sub-antenna, so path_utd has n_tx * n_rx * paths_per_channel * sub_antennas rows.
+
+  Arguments:
+    filename: the sqlite file, it is replaced if it exists
+    n_tx: number of transmitters (base stations)
+    n_rx: number of receivers (user locations)
+    paths_per_channel: number of paths per channel
+    sub_antennas: number of tx sub-antennas
+    seed: seed of the random generator
+    batch_size: number of rows inserted at once
+
+  Returns:
+    number of rows in path_utd
+  '''
+  rng = np.random.default_rng(seed)
+  if os.path.exists(filename):
+    os.remove(filename)
+  con = sqlite3.connect(filename)
+  con.executescript('''
+    PRAGMA journal_mode = OFF;
+    PRAGMA synchronous = OFF;
+    CREATE TABLE tx (tx_id INTEGER PRIMARY KEY, x REAL, y REAL, z REAL);
+    CREATE TABLE rx (rx_id INTEGER PRIMARY KEY, x REAL, y REAL, z REAL);
+    CREATE TABLE channel (channel_id INTEGER PRIMARY KEY, tx_id INTEGER, rx_id INTEGER);
+    CREATE TABLE path (path_id INTEGER PRIMARY KEY, channel_id INTEGER, foliage_distance REAL);
+    CREATE TABLE path_utd (path_utd_id INTEGER PRIMARY KEY, path_id INTEGER, tx_sub_antenna INTEGER,
+                           received_power REAL, time_of_arrival REAL, departure_phi REAL, departure_theta REAL,
+                           arrival_phi REAL, arrival_theta REAL, freespace_path_loss REAL, freespace_path_loss_woa REAL, cir_phs REAL);
+  ''')
+
+  tx = np.column_stack((np.arange(n_tx), rng.uniform(0, 500, (n_tx, 2)), rng.uniform(10, 30, n_tx)))
+  rx = np.column_stack((np.arange(n_rx), rng.uniform(0, 500, (n_rx, 2)), np.full(n_rx, 1.5)))
+  con.executemany('INSERT INTO tx VALUES (?, ?, ?, ?)', tx.tolist())
+  con.executemany('INSERT INTO rx VALUES (?, ?, ?, ?)', rx.tolist())
+
+  # Channels in the order of Wireless InSite: all receivers of a transmitter
+  channel_tx = np.repeat(np.arange(n_tx), n_rx)
+  channel_rx = np.tile(np.arange(n_rx), n_tx)
+  con.executemany('INSERT INTO channel VALUES (?, ?, ?)', zip(range(n_tx * n_rx), channel_tx.tolist(), channel_rx.tolist()))
+
+  n_paths = n_tx * n_rx * paths_per_channel
+  for start in range(0, n_paths, batch_size):
+    path_id = np.arange(start, min(start + batch_size, n_paths))
+    con.executemany('INSERT INTO path VALUES (?, ?, ?)', zip(path_id.tolist(), (path_id // paths_per_channel).tolist(), np.zeros(len(path_id)).tolist()))
+
+  n_rows = n_paths * sub_antennas
+  for start in range(0, n_rows, batch_size):
+    row = np.arange(start, min(start + batch_size, n_rows))
+    n = len(row)
+    # Paths of a channel sorted by arrival time, as written by Wireless InSite
+    order = row // sub_antennas % paths_per_channel
+    toa = 1e-6 + order * 5e-8 + rng.uniform(0, 5e-8, n)
+    fspl = 20 * np.log10(toa * 3e8) + 20 * np.log10(28e9) - 147.55
+    values = np.column_stack((
+      row, row // sub_antennas, row % sub_antennas,
+      -60 - fspl * 0.1 - order * 3 + rng.normal(0, 2, n),
+      toa,
+      rng.uniform(-180, 180, n), rng.uniform(0, 180, n), rng.uniform(-180, 180, n), rng.uniform(0, 180, n),
+      fspl, fspl + rng.uniform(0, 1, n), rng.uniform(-180, 180, n)))
+    con.executemany('INSERT INTO path_utd VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', values.tolist())
+  con.commit()
+  con.close()
+  return n_rows
+
+
+def make_p2m_files(prefix, n_files=2, n_rx=1000, seed=0):
+  '''
+  Writes received power files prefix.power.t001_NN.r001.p2m in the format read by read_p2m_power
+  (three header lines, then: id x y z distance power phase).
+
+  Returns:
+    list of the file names without the .p2m extension (the input of read_p2m_power)
+  '''
+  rng = np.random.default_rng(seed)
+  files = []
+  for f in range(n_files):
+    name = f'{prefix}.power.t001_{f + 1:02d}.r001'
+    xyz = np.column_stack((rng.uniform(0, 500, (n_rx, 2)), np.full(n_rx, 1.5)))
+    distance = np.linalg.norm(xyz - (250, 250, 20), axis=1)
+    power = -40 - 20 * np.log10(distance) + rng.normal(0, 3, n_rx)
+    phase = rng.uniform(-180, 180, n_rx)
+    body = np.column_stack((np.arange(1, n_rx + 1), xyz, distance, power, phase))
+    header = '# Receiver Set:synthetic\n# Rx#      X(m)      Y(m)      Z(m)  Distance   Power(dBm)  Phase(Deg)\n' + f'{n_rx}'
+    np.savetxt(name + '.p2m', body, fmt=['%d', '%.3f', '%.3f', '%.3f', '%.3f', '%.4f', '%.2f'], header=header, comments='')
+    files.append(name)
+  return files
+
+
+def make_cst_farfield(filename, theta_inc=1., phi_inc=1., seed=0):
+  '''
+  Writes a CST farfield export (two header lines, then: theta phi abs(dir) abs(theta) phase(theta) abs(phi) phase(phi) ax.ratio)
+  on a theta/phi grid with the given increments in degrees.
+
+  Returns:
+    number of rows
+  '''
+  rng = np.random.default_rng(seed)
+  theta, phi = np.meshgrid(np.arange(0, 180 + theta_inc / 2, theta_inc), np.arange(0, 360 + phi_inc / 2, phi_inc), indexing='ij')
+  theta, phi = theta.ravel(), phi.ravel()
+  n = len(theta)
+  gain = np.abs(np.cos(np.radians(theta))) ** 2 * 10 + rng.uniform(0, 0.1, n)
+  body = np.column_stack((theta, phi, gain, gain * 0.8, rng.uniform(-180, 180, n), gain * 0.2, rng.uniform(-180, 180, n), rng.uniform(0, 40, n)))
+  header = ('Theta [deg.]  Phi   [deg.]  Abs(Dir.)[dBi   ]   Abs(Theta)[dBi   ]  Phase(Theta)[deg.]  Abs(Phi  )[dBi   ]  Phase(Phi  )[deg.]  Ax.Ratio[dB    ]\n'
+            + '-' * 150)
+  np.savetxt(filename, body, fmt='%.3f', header=header, comments='')
+  return n
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Generate synthetic Remcom and CST inputs for the benchmarks')
+  parser.add_argument('--out', default='data', help='Output folder')
+  parser.add_argument('--n_tx', type=int, default=2, help='Number of transmitters')
+  parser.add_argument('--n_rx', type=int, default=1000, help='Number of receivers')
+  parser.add_argument('--paths', type=int, default=25, help='Number of paths per channel')
+  parser.add_argument('--sub_antennas', type=int, default=1, help='Number of tx sub-antennas')
+  parser.add_argument('--p2m_files', type=int, default=2, help='Number of p2m files')
+  parser.add_argument('--angle_inc', type=float, default=1., help='Theta and phi increment of the CST farfield in degrees')
+  parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator')
+  parser.add_argument('--help_options', action='store_true', help='Print options')
+  args = parser.parse_args()
+  if args.help_options:
+    parser.print_help()
+    sys.exit()
+
+  os.makedirs(args.out, exist_ok=True)
+  rows = make_remcom_sqlite(os.path.join(args.out, 'synthetic.sqlite'), args.n_tx, args.n_rx, args.paths, args.sub_antennas, seed=args.seed)
+  print(f'synthetic.sqlite: {rows} path_utd rows')
+  files = make_p2m_files(os.path.join(args.out, 'synthetic'), args.p2m_files, args.n_rx, seed=args.seed)
+  print(f'{len(files)} p2m files with {args.n_rx} receivers')
+  rows = make_cst_farfield(os.path.join(args.out, 'farfield.txt'), args.angle_inc, args.angle_inc, seed=args.seed)
+  print(f'farfield.txt: {rows} rows')
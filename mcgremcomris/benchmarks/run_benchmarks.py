@@ -0,0 +1,282 @@
+'''
+name: run_benchmarks.py
+author: Artan Salihu
+version: 1.0
+status: development
+contact: artan.salihuATtuwien.ac.at
+website: https://www.artansalihu.com, https://mcg-deep-wrt.netlify.app/deep-wrt/utilities/
+date: 2026-10-19
+license: MIT
+dependencies: numpy, pandas, sqlite3, generate_data.py, MCGReadRemcomPaths.py, MCGCst2UanConverter.py, MCGChannelStats.py
+description: Benchmarks of the extraction and conversion paths of the Remcom scripts on synthetic inputs (see generate_data.py):
+    - sqlite_query: get_queries_paths_remcom(save=False), the SQL join into a DataFrame
+    - sqlite_query_lean: the same with dtypes='lean' (float32 values, int32/int16 ids, converted per fetched chunk)
+    - sqlite_json: get_queries_paths_remcom(save=True), the query, grouping and json output
+    - sqlite_json_stream: get_queries_paths_remcom(save=True, stream=True), the sorted query written group by group
+    - sqlite_json_parallel: get_queries_paths_remcom_parallel, the query split by rx_id ranges over worker processes (one per CPU)
+    - channel_stats: MCGChannelStats.channel_stats on the DataFrame of the query (the query is not timed)
+    - p2m_read: read_p2m_power
+    - cst_convert: MCGCst2UanConverter
+Every case runs in a fresh process: the best wall time over --repeat runs gives the throughput (rows/s), a further run
+with tracemalloc gives the peak of the Python and NumPy allocations (peak_mb) and the peak resident memory of the process (max_rss_mb).
+The results are appended as JSON lines to --results with the git commit and the package versions, so runs of different
+versions can be compared with --compare.
+
+Example:
+    python run_benchmarks.py --scale small --label baseline
+    python run_benchmarks.py --scale small --label my-change
+    python run_benchmarks.py --compare
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import queue as queue_module
+import subprocess
+import sys
+import time
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+import generate_data
+
+
+# Sizes of the synthetic inputs: path_utd rows = n_tx * n_rx * paths * sub_antennas
+SCALES = {
+  'small': dict(n_tx=2, n_rx=500, paths=10, sub_antennas=1, p2m_files=4, angle_inc=2.),
+  'medium': dict(n_tx=4, n_rx=2000, paths=25, sub_antennas=1, p2m_files=16, angle_inc=1.),
+  'large': dict(n_tx=8, n_rx=10000, paths=25, sub_antennas=1, p2m_files=64, angle_inc=0.5),
+}
+
+
+def prepare_data(data_dir, scale):
+  '''
+  Generates the inputs of a scale in data_dir/<scale> unless they exist already.
+
+  Returns:
+    dictionary with the input files and their number of rows
+  '''
+  params = SCALES[scale]
+  folder = os.path.join(data_dir, scale)
+  info_file = os.path.join(folder, 'info.json')
+  if os.path.exists(info_file):
+    with open(info_file, 'r') as f:
+      info = json.load(f)
+    if info.get('params') == params:
+      return info
+  os.makedirs(folder, exist_ok=True)
+  print(f'Generating the {scale} inputs in {folder}')
+  info = {'params': params, 'sqlite': os.path.join(folder, 'synthetic.sqlite'), 'farfield': os.path.join(folder, 'farfield.txt')}
+  info['sqlite_rows'] = generate_data.make_remcom_sqlite(info['sqlite'], params['n_tx'], params['n_rx'], params['paths'], params['sub_antennas'])
+  info['p2m'] = generate_data.make_p2m_files(os.path.join(folder, 'synthetic'), params['p2m_files'], params['n_rx'])
+  info['p2m_rows'] = params['p2m_files'] * params['n_rx']
+  info['farfield_rows'] = generate_data.make_cst_farfield(info['farfield'], params['angle_inc'], params['angle_inc'])
+  with open(info_file, 'w') as f:
+    json.dump(info, f, indent=2)
+  return info
+
+
+def case_sqlite_query(info, out_dir):
+  from MCGReadRemcomPaths import get_queries_paths_remcom
+  df = get_queries_paths_remcom(info['sqlite'], os.path.join(out_dir, 'paths.json'), save=False)
+  return len(df)
+
+
+def case_sqlite_query_lean(info, out_dir):
+  from MCGReadRemcomPaths import get_queries_paths_remcom
+  df = get_queries_paths_remcom(info['sqlite'], os.path.join(out_dir, 'paths.json'), save=False, dtypes='lean')
+  return len(df)
+
+
+def case_sqlite_json(info, out_dir):
+  from MCGReadRemcomPaths import get_queries_paths_remcom
+  get_queries_paths_remcom(info['sqlite'], os.path.join(out_dir, 'paths.json'), save=True)
+  return info['sqlite_rows']
+
+
+def case_sqlite_json_stream(info, out_dir):
+  from MCGReadRemcomPaths import get_queries_paths_remcom
+  get_queries_paths_remcom(info['sqlite'], os.path.join(out_dir, 'paths_stream.json'), save=True, stream=True)
+  return info['sqlite_rows']
+
+
+def case_sqlite_json_parallel(info, out_dir):
+  from MCGReadRemcomPaths import get_queries_paths_remcom_parallel
+  get_queries_paths_remcom_parallel(info['sqlite'], os.path.join(out_dir, 'paths_parallel.json'), save=True)
+  return info['sqlite_rows']
+
+
+def case_channel_stats(info, out_dir):
+  from MCGChannelStats import channel_stats
+  channel_stats(info['paths'])
+  return len(info['paths'])
+
+
+def case_p2m_read(info, out_dir):
+  from MCGReadRemcomPaths import read_p2m_power
+  data = read_p2m_power(info['p2m'])
+  return sum(len(df) for df in data.values())
+
+
+def case_cst_convert(info, out_dir):
+  from MCGCst2UanConverter import MCGCst2UanConverter
+  MCGCst2UanConverter(info['farfield'], os.path.join(out_dir, 'farfield.uan'))
+  return info['farfield_rows']
+
+
+# Benchmark cases: name -> function(info, out_dir) returning the number of rows processed
+CASES = {
+  'sqlite_query': case_sqlite_query,
+  'sqlite_query_lean': case_sqlite_query_lean,
+  'sqlite_json': case_sqlite_json,
+  'sqlite_json_stream': case_sqlite_json_stream,
+  'sqlite_json_parallel': case_sqlite_json_parallel,
+  'channel_stats': case_channel_stats,
+  'p2m_read': case_p2m_read,
+  'cst_convert': case_cst_convert,
+}
+
+
+def _timed_case(name, info, out_dir, trace_memory):
+  # Import the scripts (and pandas) before the timer, the cases measure only the work
+  import MCGReadRemcomPaths, MCGCst2UanConverter, MCGChannelStats
+  if name == 'channel_stats':
+    # The input of the statistics is the DataFrame of the query, read before the timer
+    with contextlib.redirect_stdout(io.StringIO()):
+      info = dict(info, paths=MCGReadRemcomPaths.get_queries_paths_remcom(info['sqlite'], None, save=False))
+  if trace_memory:
+    tracemalloc.start()
+  start_time = time.perf_counter()
+  with contextlib.redirect_stdout(io.StringIO()):
+    rows = CASES[name](info, out_dir)
+  return rows, time.perf_counter() - start_time
+
+
+def _run_case(name, info, out_dir, trace_memory, queue):
+  # Runs in a fresh process, the output of the scripts is discarded. An exception is sent back as an error record,
+  # so run_case does not wait for a result forever
+  import resource
+  try:
+    rows, seconds = _timed_case(name, info, out_dir, trace_memory)
+  except Exception as e:
+    queue.put({'error': repr(e)})
+    return
+  result = {'rows': rows, 'seconds': seconds}
+  if trace_memory:
+    result['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+  # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+  max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  result['max_rss_mb'] = max_rss / 2**20 if sys.platform == 'darwin' else max_rss / 2**10
+  queue.put(result)
+
+
+def run_case(name, info, out_dir, trace_memory=False):
+  '''
+  Runs a benchmark case in a fresh process. Raises RuntimeError if the case raises or the process dies.
+
+  Returns:
+    dictionary with rows, seconds, max_rss_mb and, with trace_memory, peak_mb
+  '''
+  context = multiprocessing.get_context('spawn')
+  queue = context.Queue()
+  process = context.Process(target=_run_case, args=(name, info, out_dir, trace_memory, queue))
+  process.start()
+  try:
+    while True:
+      try:
+        result = queue.get(timeout=1.)
+        break
+      except queue_module.Empty:
+        # A process killed (e.g. out of memory) before its result never puts one
+        if not process.is_alive() and queue.empty():
+          raise RuntimeError(f'{name}: the benchmark process exited with code {process.exitcode}')
+  finally:
+    process.join()
+  if 'error' in result:
+    raise RuntimeError(f'{name}: {result["error"]}')
+  return result
+
+
+def version_info():
+  '''
+  Returns the git commit of the repository (with -dirty for local changes) and the versions of Python and the packages.
+  '''
+  try:
+    commit = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=BENCHMARK_DIR, capture_output=True, text=True, check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    commit = 'unknown'
+  import numpy
+  import pandas
+  return {'commit': commit, 'python': platform.python_version(), 'numpy': numpy.__version__, 'pandas': pandas.__version__}
+
+
+def compare(results_file):
+  '''
+  Prints the throughput and memory of the last run of every label, case and scale in the results file.
+  '''
+  latest = {}
+  with open(results_file, 'r') as f:
+    for line in f:
+      if line.strip():
+        record = json.loads(line)
+        latest[(record['case'], record['scale'], record['label'])] = record
+  print(f'{"case":<14} {"scale":<8} {"label":<20} {"commit":<14} {"rows/s":>12} {"seconds":>9} {"peak_mb":>9} {"rss_mb":>9}')
+  for (case, scale, label), record in sorted(latest.items(), key=lambda item: (item[0][0], item[0][1], item[1]['time'])):
+    print(f'{case:<14} {scale:<8} {label:<20} {record["commit"]:<14} {record["rows_per_s"]:>12,.0f} {record["seconds"]:>9.3f} '
+          f'{record.get("peak_mb", float("nan")):>9.1f} {record["max_rss_mb"]:>9.1f}')
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark the Remcom and CST scripts on synthetic inputs')
+  parser.add_argument('--scale', nargs='+', default=['small'], choices=list(SCALES), help='Sizes of the inputs')
+  parser.add_argument('--cases', nargs='+', default=list(CASES), choices=list(CASES), help='Benchmark cases')
+  parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs per case (the best is reported)')
+  parser.add_argument('--no_memory', action='store_true', help='Skip the run with tracemalloc')
+  parser.add_argument('--data_dir', default=os.path.join(BENCHMARK_DIR, 'data'), help='Folder of the generated inputs and outputs')
+  parser.add_argument('--results', default=os.path.join(BENCHMARK_DIR, 'results.jsonl'), help='JSON lines file the results are appended to')
+  parser.add_argument('--label', default=None, help='Label of the run, e.g. the name of the change (default: the git commit)')
+  parser.add_argument('--compare', action='store_true', help='Only print the last results of every label in --results')
+  parser.add_argument('--help_options', action='store_true', help='Print options')
+  args = parser.parse_args()
+  if args.help_options:
+    parser.print_help()
+    sys.exit()
+
+  if args.compare:
+    compare(args.results)
+    sys.exit()
+
+  versions = version_info()
+  label = args.label or versions['commit']
+  for scale in args.scale:
+    info = prepare_data(args.data_dir, scale)
+    out_dir = os.path.join(args.data_dir, scale, 'output')
+    os.makedirs(out_dir, exist_ok=True)
+    for name in args.cases:
+      try:
+        runs = [run_case(name, info, out_dir) for _ in range(args.repeat)]
+      except RuntimeError as e:
+        print(f'{name} ({scale}) failed: {e}')
+        continue
+      best = min(runs, key=lambda run: run['seconds'])
+      record = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'label': label, 'case': name, 'scale': scale, 'repeat': args.repeat,
+                'rows': best['rows'], 'seconds': round(best['seconds'], 6), 'rows_per_s': round(best['rows'] / best['seconds'], 1),
+                'max_rss_mb': round(max(run['max_rss_mb'] for run in runs), 1)}
+      if not args.no_memory:
+        try:
+          record['peak_mb'] = round(run_case(name, info, out_dir, trace_memory=True)['peak_mb'], 1)
+        except RuntimeError as e:
+          print(f'{name} ({scale}) memory run failed: {e}')
+      record.update(versions)
+      with open(args.results, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+      print(f'{name} ({scale}): {record["rows"]} rows in {record["seconds"]:.3f} s, {record["rows_per_s"]:,.0f} rows/s, '
+            f'peak {record.get("peak_mb", float("nan")):.1f} MB (traced), {record["max_rss_mb"]:.1f} MB (rss)')
@@ -11,14 +11,29 @@ bl_info = {
 }
 
 import bpy
-import random
-from mathutils import Vector
+import numpy as np
 from bpy.props import FloatVectorProperty
 import math
+import os
+import sys
 
 class NoiseGeneratorProperties(bpy.types.PropertyGroup):
     T: bpy.props.IntProperty(name="T", description="Key frames for the uncertainty model", default=100)
     std_dev: bpy.props.FloatProperty(name="sigma", description="std dev (Only Gaussian noise for now)", default=0.1)
+    use_seed: bpy.props.BoolProperty(name="Use seed", description="Use a fixed seed to get the same noise every time", default=False)
+    seed: bpy.props.IntProperty(name="seed", description="Seed of the random generator", default=0, min=0)
+    process: bpy.props.EnumProperty(name="Process", description="Correlation of the noise over the key frames",
+                                    items=[('iid', "i.i.d.", "Independent noise in every key frame"),
+                                           ('random_walk', "Random walk", "x[t] = x[t-1] + noise"),
+                                           ('ou', "Ornstein-Uhlenbeck", "Mean-reverting noise with stationary std sigma"),
+                                           ('ar1', "AR(1)", "x[t] = phi x[t-1] + noise")], default='iid')
+    theta: bpy.props.FloatProperty(name="theta", description="Mean reversion rate of the Ornstein-Uhlenbeck process", default=1.0, min=0.001)
+    dt: bpy.props.FloatProperty(name="dt", description="Time between two key frames for the Ornstein-Uhlenbeck process", default=1.0, min=0.001)
+    phi: bpy.props.FloatProperty(name="phi", description="Coefficient of the AR(1) process", default=0.9, min=-1.0, max=1.0)
+    export_model: bpy.props.EnumProperty(name="Model", description="Noise model of the exported trajectories",
+                                         items=[('gaussian', "Gaussian", ""), ('uniform', "Uniform", ""), ('laplace', "Laplace", "")], default='gaussian')
+    export_chunk_size: bpy.props.IntProperty(name="Chunk", description="Number of frames generated and written at once", default=1000, min=1)
+    export_path: bpy.props.StringProperty(name="File", description="Output file (.npy or .parquet)", default="//uncertainty_trajectories.npy", subtype='FILE_PATH')
 
 class OBJECT_OT_add_noise(bpy.types.Operator):
     bl_idname = "object.add_noise"
@@ -33,29 +48,95 @@ class OBJECT_OT_add_noise(bpy.types.Operator):
 
         bpy.ops.object.select_all(action='SELECT')
 
-        # Over selected objects, add noise to their location
-        for obj in bpy.context.selected_objects:
-            initial_loc = obj.location.copy()
-            if obj.animation_data is None:
-                obj.animation_data_create()
-
-            # create a new anim if nothing exist
-            if obj.animation_data.action is None:
-                obj.animation_data.action = bpy.data.actions.new(name="UncertaintyAction")
-
-            for i in range(ng_tool.T):
-                n_x = random.gauss(mean, ng_tool.std_dev)
-                n_y = random.gauss(mean, ng_tool.std_dev)
-                n_z = random.gauss(mean, ng_tool.std_dev)
+        objects = list(bpy.context.selected_objects)
+        data_module = import_data_module(self)
+        if data_module is None:
+            return {'CANCELLED'}
 
-                obj.location = Vector((initial_loc.x + n_x, initial_loc.y + n_y, initial_loc.z + n_z))
+        # All frames in one chunk: (objects, T, 3), the same Gaussian trajectories as "Export Noise" for the same seed
+        initial_locs = np.array([obj.location[:] for obj in objects]).reshape(-1, 3)
+        chunks = data_module.iter_trajectory_chunks(initial_locs, ng_tool.T, model='gaussian', std_dev=ng_tool.std_dev, mean=mean,
+                                                    seed=ng_tool.seed if ng_tool.use_seed else None, chunk_size=max(ng_tool.T, 1), dtype=np.float64,
+                                                    process=ng_tool.process, theta=ng_tool.theta, dt=ng_tool.dt, phi=ng_tool.phi)
+        _, locations = next(chunks, (0, np.zeros((len(objects), 0, 3))))
 
-                obj.keyframe_insert(data_path='location', frame=i)
+        # Over selected objects, add noise to their location
+        for obj, obj_locations in zip(objects, locations):
+            set_location_keyframes(obj, obj_locations)
 
         bpy.ops.object.select_all(action='DESELECT')
         
         return {'FINISHED'}
 
+class OBJECT_OT_export_noise(bpy.types.Operator):
+    """Export the noisy trajectories (object, frame, xyz) of the selected objects to a file without keyframes"""
+    bl_idname = "object.export_noise"
+    bl_label = "Export Noise"
+
+    def execute(self, context):
+        ng_tool = context.scene.ng_tool
+
+        data_module = import_data_module(self)
+        if data_module is None:
+            return {'CANCELLED'}
+
+        objects = list(context.selected_objects)
+        if not objects:
+            self.report({'WARNING'}, "No objects selected")
+            return {'CANCELLED'}
+        filename = bpy.path.abspath(ng_tool.export_path)
+        seed = ng_tool.seed if ng_tool.use_seed else None
+        try:
+            shape = data_module.export_trajectories([obj.location[:] for obj in objects], filename, ng_tool.T, names=[obj.name for obj in objects],
+                                                    model=ng_tool.export_model, std_dev=ng_tool.std_dev, seed=seed, chunk_size=ng_tool.export_chunk_size,
+                                                    process=ng_tool.process, theta=ng_tool.theta, dt=ng_tool.dt, phi=ng_tool.phi)
+        except ImportError as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        self.report({'INFO'}, f"Exported trajectories of shape {shape} to {filename}")
+        return {'FINISHED'}
+
+def import_data_module(operator):
+    """
+    Imports mcguncertaintydata.py (correlated processes and export), which must be next to this script.
+    Reports an error on the operator and returns None if it is not found.
+    """
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        import mcguncertaintydata
+    except ImportError as e:
+        operator.report({'ERROR'}, f"mcguncertaintydata.py not found next to the add-on: {e}")
+        return None
+    return mcguncertaintydata
+
+def set_location_keyframes(obj, locations, frame_start=0):
+    """
+    Replaces the location keyframes of the object with the given locations, one per frame starting at frame_start.
+    The keyframes are written to the F-Curves in bulk (keyframe_points.add and foreach_set) instead of
+    setting obj.location and calling keyframe_insert for every frame.
+
+    locations: array of shape (T, 3)
+    """
+    if obj.animation_data is None:
+        obj.animation_data_create()
+
+    # create a new anim if nothing exist
+    if obj.animation_data.action is None:
+        obj.animation_data.action = bpy.data.actions.new(name="UncertaintyAction")
+    action = obj.animation_data.action
+
+    frames = np.arange(frame_start, frame_start + len(locations), dtype=np.float32)
+    for axis in range(3):
+        # Start from an empty F-Curve, the old keyframes would be mixed with the new ones
+        fcurve = action.fcurves.find('location', index=axis)
+        if fcurve is not None:
+            action.fcurves.remove(fcurve)
+        fcurve = action.fcurves.new('location', index=axis, action_group="Object Transforms")
+        fcurve.keyframe_points.add(len(locations))
+        fcurve.keyframe_points.foreach_set('co', np.column_stack((frames, locations[:, axis])).astype(np.float32).ravel())
+        fcurve.update()
+
+
 class OBJECT_PT_noise_generator(bpy.types.Panel):
     bl_label = "MCG Uncertainty Basic"
     bl_idname = "OBJECT_PT_uncertainty_basic"
@@ -70,23 +151,43 @@ class OBJECT_PT_noise_generator(bpy.types.Panel):
 
         layout.prop(ng_tool, "T")
         layout.prop(ng_tool, "std_dev")
+        layout.prop(ng_tool, "process")
+        if ng_tool.process == 'ou':
+            layout.prop(ng_tool, "theta")
+            layout.prop(ng_tool, "dt")
+        elif ng_tool.process == 'ar1':
+            layout.prop(ng_tool, "phi")
+        layout.prop(ng_tool, "use_seed")
+        if ng_tool.use_seed:
+            layout.prop(ng_tool, "seed")
         layout.operator("object.add_noise")
 
+        layout.separator()
+        layout.label(text="Export (selected objects)")
+        layout.prop(ng_tool, "export_model")
+        layout.prop(ng_tool, "export_chunk_size")
+        layout.prop(ng_tool, "export_path")
+        layout.operator("object.export_noise")
+
 classes = (
     NoiseGeneratorProperties,
     OBJECT_OT_add_noise,
+    OBJECT_OT_export_noise,
     OBJECT_PT_noise_generator,
 )
 
 def register():
     bpy.utils.register_class(NoiseGeneratorProperties)
     bpy.utils.register_class(OBJECT_OT_add_noise)
+    bpy.utils.register_class(OBJECT_OT_export_noise)
     bpy.utils.register_class(OBJECT_PT_noise_generator)
     bpy.types.Scene.ng_tool = bpy.props.PointerProperty(type=NoiseGeneratorProperties)
 
 def unregister():
     if OBJECT_PT_noise_generator.is_registered:
         bpy.utils.unregister_class(OBJECT_PT_noise_generator)
+    if OBJECT_OT_export_noise.is_registered:
+        bpy.utils.unregister_class(OBJECT_OT_export_noise)
     if OBJECT_OT_add_noise.is_registered:
         bpy.utils.unregister_class(OBJECT_OT_add_noise)
     if NoiseGeneratorProperties.is_registered:
@@ -0,0 +1,336 @@
+"""
+Headless export of the uncertainty model of MCG Uncertainty as a dataset.
+
+Generates the perturbed trajectories (object, frame, xyz) of a set of objects directly from their locations,
+without Blender keyframes, and writes them in chunks of frames, so very large T does not need to fit in memory:
+    - .npy: one array of shape (objects, T, 3), written through a memory map
+    - .parquet: one row per object and frame with the columns object, name, frame, x, y, z (needs pyarrow)
+
+Runs with a normal Python (only NumPy is needed), e.g.
+    python mcguncertaintydata.py --locations locations.csv --T 100000 --model gaussian --std_dev 0.1 --output noise.npy
+or from the "Export Noise" button of the add-on in Blender.
+
+The offsets from the initial locations follow one of the processes (eps: the i.i.d. noise of the noise model with std sigma):
+    - iid: x[t] = eps[t]
+    - random_walk: x[t] = x[t-1] + eps[t]
+    - ou: Ornstein-Uhlenbeck, x[t] = a x[t-1] + sqrt(1 - a^2) eps[t] with a = exp(-theta dt) (theta > 0), stationary std sigma
+    - ar1: x[t] = phi x[t-1] + eps[t]
+The random walk and AR(1) start at the initial locations (x[-1] = 0). The Ornstein-Uhlenbeck process starts from its
+stationary distribution (x[-1] drawn from the noise model), so every frame has std sigma without a warm-up.
+The processes carry their state from one chunk to the next. Every object draws its noise from its own random
+generator (spawned from the seed with np.random.SeedSequence), so for a seed the trajectories do not depend on the
+chunk size, and the "Add Noise" keyframes of the add-on are the Gaussian trajectories of the export.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+
+NOISE_MODELS = ('gaussian', 'uniform', 'laplace')
+PROCESSES = ('iid', 'random_walk', 'ou', 'ar1')
+
+try:
+    from scipy.signal import lfilter
+except ImportError:
+    lfilter = None
+
+
+def draw_noise(rng, model, size, std_dev, mean=0.):
+    """
+    Draws i.i.d. noise with the given mean and standard deviation.
+
+    Args:
+        rng: The NumPy random generator.
+        model: 'gaussian', 'uniform' or 'laplace'.
+        size: The shape of the noise array.
+        std_dev: The standard deviation of the noise (the same for all models).
+        mean: The mean of the noise.
+
+    Returns:
+        An array of the given shape.
+    """
+    if model == 'gaussian':
+        return rng.normal(mean, std_dev, size=size)
+    if model == 'uniform':
+        # U(-a, a) has std a / sqrt(3)
+        half_width = std_dev * np.sqrt(3.)
+        return rng.uniform(mean - half_width, mean + half_width, size=size)
+    if model == 'laplace':
+        # Laplace(b) has std b * sqrt(2)
+        return rng.laplace(mean, std_dev / np.sqrt(2.), size=size)
+    raise ValueError(f'Unknown noise model {model!r}, expected one of {NOISE_MODELS}')
+
+
+def object_generators(seed, n_objects):
+    """
+    Creates one random generator per object, spawned from the seed. An object draws its offsets frame after frame
+    from its own generator, so its noise depends only on the seed and its index, not on how the frames are chunked.
+
+    Args:
+        seed: The seed, None for a random seed.
+        n_objects: The number of objects.
+
+    Returns:
+        A list of n_objects NumPy random generators.
+    """
+    return [np.random.default_rng(child) for child in np.random.SeedSequence(seed).spawn(n_objects)]
+
+
+def draw_object_noise(rngs, model, frames, std_dev, mean=0.):
+    """
+    Draws the i.i.d. noise of the next frames of every object from its own generator.
+
+    Args:
+        rngs: The generators of the objects, see object_generators.
+        model, std_dev, mean: See draw_noise.
+        frames: The number of frames.
+
+    Returns:
+        An array of shape (objects, frames, 3).
+    """
+    noise = np.empty((len(rngs), frames, 3))
+    for i, rng in enumerate(rngs):
+        noise[i] = draw_noise(rng, model, (frames, 3), std_dev, mean)
+    return noise
+
+
+def ar1_filter(innovations, phi, state):
+    """
+    Computes x[t] = phi x[t-1] + innovations[t] along axis 1 for all objects and axes at once.
+
+    Args:
+        innovations: An array of shape (objects, frames, 3).
+        phi: The AR(1) coefficient.
+        state: The last value x[-1] of the previous chunk, an array of shape (objects, 1, 3).
+
+    Returns:
+        An array of the same shape as innovations.
+    """
+    if phi == 1.:
+        return state + np.cumsum(innovations, axis=1)
+    if lfilter is not None:
+        x, _ = lfilter([1.], [1., -phi], innovations, axis=1, zi=phi * state)
+        return x
+    # Without SciPy: x[t] = phi^(t+1) x[-1] + sum_s phi^(t-s) e[s], in blocks short enough that phi^-s does not overflow
+    x = np.empty_like(innovations)
+    if phi == 0.:
+        x[:] = innovations
+        return x
+    block = max(1, int(np.log(1e-8) / np.log(abs(phi)))) if abs(phi) < 1 else len(innovations[0])
+    for start in range(0, innovations.shape[1], block):
+        e = innovations[:, start:start + block]
+        powers = phi ** np.arange(1, e.shape[1] + 1).reshape(1, -1, 1)
+        x[:, start:start + block] = powers * (state + np.cumsum(e / powers, axis=1))
+        state = x[:, start + e.shape[1] - 1:start + e.shape[1]]
+    return x
+
+
+def ou_coefficient(theta, dt):
+    """
+    The coefficient a = exp(-theta dt) of the Ornstein-Uhlenbeck process. Raises a ValueError for theta * dt <= 0
+    (a = 1 would scale the innovations by 0 and give constant offsets).
+    """
+    if not theta * dt > 0:
+        raise ValueError(f'The Ornstein-Uhlenbeck process needs theta * dt > 0, got theta={theta}, dt={dt}')
+    return np.exp(-theta * dt)
+
+
+def initial_state(rngs, model, std_dev, mean=0., process='iid', theta=1., dt=1.):
+    """
+    The offsets before the first frame (x[-1]) of a process: zeros, or for the Ornstein-Uhlenbeck process a draw of
+    its stationary distribution (the noise model with std sigma and the stationary mean).
+
+    Args:
+        rngs: The generators of the objects, see object_generators (nothing is drawn for the other processes).
+        model, std_dev, mean: See draw_noise.
+        process, theta, dt: See correlate_noise.
+
+    Returns:
+        An array of shape (objects, 1, 3).
+    """
+    if process != 'ou':
+        return np.zeros((len(rngs), 1, 3))
+    a = ou_coefficient(theta, dt)
+    return draw_object_noise(rngs, model, 1, std_dev) + mean * np.sqrt(1. - a * a) / (1. - a)
+
+
+def correlate_noise(noise, process, state, theta=1., dt=1., phi=0.9):
+    """
+    Turns i.i.d. noise into the offsets of a (correlated) process, see the module docstring.
+
+    Args:
+        noise: An array of shape (objects, frames, 3) with the i.i.d. noise.
+        process: 'iid', 'random_walk', 'ou' or 'ar1'.
+        state: The last offsets of the previous chunk, an array of shape (objects, 1, 3).
+        theta: The mean reversion rate of the Ornstein-Uhlenbeck process (per unit of dt), theta * dt > 0.
+        dt: The time between two frames for the Ornstein-Uhlenbeck process.
+        phi: The coefficient of the AR(1) process.
+
+    Returns:
+        An array of shape (objects, frames, 3) with the offsets.
+    """
+    if process == 'iid':
+        return noise
+    if process == 'random_walk':
+        return ar1_filter(noise, 1., state)
+    if process == 'ou':
+        a = ou_coefficient(theta, dt)
+        return ar1_filter(np.sqrt(1. - a * a) * noise, a, state)
+    if process == 'ar1':
+        return ar1_filter(noise, phi, state)
+    raise ValueError(f'Unknown process {process!r}, expected one of {PROCESSES}')
+
+
+def iter_trajectory_chunks(initial_locs, T, model='gaussian', std_dev=0.1, mean=0., seed=None, chunk_size=1000, dtype=np.float32, process='iid', theta=1., dt=1., phi=0.9):
+    """
+    Generates the perturbed locations of the objects frame chunk by frame chunk.
+
+    Args:
+        initial_locs: An array of shape (objects, 3) with the locations of the objects.
+        T: The number of frames.
+        model: The noise model, see draw_noise.
+        std_dev: The standard deviation of the noise.
+        mean: The mean of the noise.
+        seed: The seed of the random generators of the objects (see object_generators), None for a random seed.
+        chunk_size: The number of frames per chunk (the trajectories do not depend on it).
+        dtype: The data type of the locations.
+        process, theta, dt, phi: The process of the offsets, see correlate_noise.
+
+    Yields:
+        (frame_start, locations) tuples with locations of shape (objects, frames in the chunk, 3).
+    """
+    initial_locs = np.asarray(initial_locs, dtype=np.float64).reshape(-1, 1, 3)
+    rngs = object_generators(seed, len(initial_locs))
+    state = initial_state(rngs, model, std_dev, mean, process=process, theta=theta, dt=dt)
+    for frame_start in range(0, T, chunk_size):
+        frames = min(chunk_size, T - frame_start)
+        noise = draw_object_noise(rngs, model, frames, std_dev, mean)
+        offsets = correlate_noise(noise, process, state, theta=theta, dt=dt, phi=phi)
+        state = offsets[:, -1:]
+        yield frame_start, (initial_locs + offsets).astype(dtype)
+
+
+def export_trajectories(initial_locs, filename, T, names=None, model='gaussian', std_dev=0.1, mean=0., seed=None, chunk_size=1000, dtype=np.float32, process='iid', theta=1., dt=1., phi=0.9):
+    """
+    Writes the perturbed trajectories of the objects to a .npy or .parquet file (see the module docstring).
+    For .npy files, the object names are written to <filename>.names.json.
+
+    Args:
+        initial_locs: An array of shape (objects, 3) with the locations of the objects.
+        filename: The output file, .npy or .parquet.
+        T: The number of frames.
+        names: The names of the objects (optional).
+        model, std_dev, mean, seed, chunk_size, dtype, process, theta, dt, phi: See iter_trajectory_chunks.
+
+    Returns:
+        The shape of the trajectories (objects, T, 3).
+    """
+    initial_locs = np.asarray(initial_locs, dtype=np.float64).reshape(-1, 3)
+    n_objects = len(initial_locs)
+    if names is None:
+        names = [str(i) for i in range(n_objects)]
+    chunks = iter_trajectory_chunks(initial_locs, T, model=model, std_dev=std_dev, mean=mean, seed=seed, chunk_size=chunk_size, dtype=dtype,
+                                    process=process, theta=theta, dt=dt, phi=phi)
+
+    if filename.endswith('.parquet'):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('Writing .parquet files needs pyarrow (pip install pyarrow), or use a .npy file')
+        writer = None
+        object_ids = np.arange(n_objects, dtype=np.int32)
+        try:
+            for frame_start, locations in chunks:
+                frames = locations.shape[1]
+                # One row per object and frame, object-major like the .npy array
+                table = pa.table({
+                    'object': np.repeat(object_ids, frames),
+                    'name': pa.DictionaryArray.from_arrays(np.repeat(object_ids, frames), pa.array(names)),
+                    'frame': np.tile(np.arange(frame_start, frame_start + frames, dtype=np.int32), n_objects),
+                    'x': locations[:, :, 0].ravel(),
+                    'y': locations[:, :, 1].ravel(),
+                    'z': locations[:, :, 2].ravel(),
+                })
+                if writer is None:
+                    writer = pq.ParquetWriter(filename, table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        trajectories = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=(n_objects, T, 3))
+        for frame_start, locations in chunks:
+            trajectories[:, frame_start:frame_start + locations.shape[1]] = locations
+        trajectories.flush()
+        del trajectories
+        with open(filename + '.names.json', 'w') as f:
+            json.dump(list(names), f)
+
+    return n_objects, T, 3
+
+
+def read_locations(filename):
+    """
+    Reads the locations of the objects from a .npy file (array of shape (objects, 3)), a .json file
+    ({name: [x, y, z]}) or a .csv file (name,x,y,z or x,y,z per line, an optional header line is skipped).
+
+    Returns:
+        A (locations, names) tuple.
+    """
+    if filename.endswith('.npy'):
+        locations = np.load(filename).reshape(-1, 3)
+        return locations, [str(i) for i in range(len(locations))]
+    if filename.endswith('.json'):
+        with open(filename, 'r') as f:
+            data = json.load(f)
+        return np.array(list(data.values()), dtype=np.float64).reshape(-1, 3), list(data.keys())
+    names = []
+    locations = []
+    with open(filename, 'r') as f:
+        for line in f:
+            values = [value.strip() for value in line.split(',')]
+            if len(values) < 3:
+                continue
+            try:
+                xyz = [float(value) for value in values[-3:]]
+            except ValueError:
+                # Header line
+                continue
+            names.append(values[0] if len(values) > 3 else str(len(names)))
+            locations.append(xyz)
+    return np.array(locations, dtype=np.float64).reshape(-1, 3), names
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Export the uncertainty model trajectories (object, frame, xyz) of a set of objects')
+    parser.add_argument('--locations', type=str, required='--help_options' not in sys.argv, help='Locations of the objects: .npy (objects x 3), .json ({name: [x, y, z]}) or .csv (name,x,y,z)')
+    parser.add_argument('--output', type=str, default='trajectories.npy', help='Output file, .npy or .parquet (needs pyarrow)')
+    parser.add_argument('--T', type=int, default=100, help='Number of frames')
+    parser.add_argument('--model', type=str, default='gaussian', choices=NOISE_MODELS, help='Noise model')
+    parser.add_argument('--process', type=str, default='iid', choices=PROCESSES, help='Process of the offsets from the initial locations')
+    parser.add_argument('--theta', type=float, default=1., help='Mean reversion rate of the Ornstein-Uhlenbeck process')
+    parser.add_argument('--dt', type=float, default=1., help='Time between two frames for the Ornstein-Uhlenbeck process')
+    parser.add_argument('--phi', type=float, default=0.9, help='Coefficient of the AR(1) process')
+    parser.add_argument('--std_dev', type=float, default=0.1, help='Standard deviation of the noise')
+    parser.add_argument('--mean', type=float, default=0., help='Mean of the noise')
+    parser.add_argument('--seed', type=int, default=None, help='Seed of the random generator')
+    parser.add_argument('--chunk_size', type=int, default=1000, help='Number of frames generated and written at once')
+    parser.add_argument('--float64', action='store_true', help='Write float64 instead of float32 locations')
+    parser.add_argument('--help_options', action='store_true', help='Print options')
+    args = parser.parse_args()
+    if args.help_options:
+        parser.print_help()
+        sys.exit()
+
+    start_time = time.time()
+    locations, names = read_locations(args.locations)
+    shape = export_trajectories(locations, args.output, args.T, names=names, model=args.model, std_dev=args.std_dev, mean=args.mean,
+                                seed=args.seed, chunk_size=args.chunk_size, dtype=np.float64 if args.float64 else np.float32,
+                                process=args.process, theta=args.theta, dt=args.dt, phi=args.phi)
+    print(f'Wrote trajectories of shape {shape} to {os.path.abspath(args.output)} in {time.time() - start_time:.1f} s')